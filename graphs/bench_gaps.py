@@ -0,0 +1,114 @@
+import sys
+import os
+import time
+import tempfile
+import importlib
+import numpy as np
+
+# Compares the run time of searches that start in long gaps between covered
+# regions, like centromeres, with the one in another copy of pyBedGraph, such
+# as a checkout from before gaps were binary searched.
+#
+# python3 bench_gaps.py [other_pyBedGraph_folder]
+
+NUM_TESTS = 1000
+NUM_REPEATS = 3
+RANDOM_SEED = 1
+STATS = ['mean', 'max', 'coverage', 'approx_mean']
+BIN_SIZE = 100
+
+# made up sparse track of covered blocks separated by long gaps
+NUM_BLOCKS = 20
+INTERVALS_PER_BLOCK = 1000
+GAP_SIZE = 3000000
+
+
+def import_BedGraph(folder=None):
+    for module_name in list(sys.modules):
+        if module_name.startswith('pyBedGraph'):
+            del sys.modules[module_name]
+
+    if folder is not None:
+        sys.path.insert(0, folder)
+    pyBedGraph = importlib.import_module('pyBedGraph')
+    if folder is not None:
+        sys.path.pop(0)
+
+    return pyBedGraph.BedGraph
+
+
+def make_sparse_track(folder):
+    rng = np.random.default_rng(RANDOM_SEED)
+    start_list = []
+    end_list = []
+    gap_starts = []
+    position = GAP_SIZE
+    for _ in range(NUM_BLOCKS):
+        sizes = rng.integers(1, 50, INTERVALS_PER_BLOCK)
+        end_list.append(position + np.cumsum(sizes))
+        start_list.append(end_list[-1] - sizes)
+        position = end_list[-1][-1]
+        gap_starts.append(position)
+        position += GAP_SIZE
+    start_list = np.concatenate(start_list)
+    end_list = np.concatenate(end_list)
+    values = rng.random(start_list.size)
+
+    chrom_size_file = os.path.join(folder, 'sparse.sizes')
+    data_file = os.path.join(folder, 'sparse.bedGraph')
+    with open(chrom_size_file, 'w') as out_file:
+        out_file.write(f'chr1\t{position}\n')
+    with open(data_file, 'w') as out_file:
+        for start, end, value in zip(start_list, end_list, values):
+            out_file.write(f'chr1\t{start}\t{end}\t{float(value)!r}\n')
+
+    return chrom_size_file, data_file, np.array(gap_starts)
+
+
+def make_tests(gap_starts):
+    # every search starts in a gap and most reach the next covered block
+    rng = np.random.default_rng(RANDOM_SEED)
+    gaps = rng.integers(0, gap_starts.size - 1, NUM_TESTS)
+    start_list = gap_starts[gaps] + rng.integers(0, GAP_SIZE, NUM_TESTS)
+    end_list = start_list + rng.integers(1, GAP_SIZE, NUM_TESTS)
+    return start_list.astype(np.int32), end_list.astype(np.int32)
+
+
+def bench(BedGraph, chrom_size_file, data_file, start_list, end_list):
+    bedGraph = BedGraph(chrom_size_file, data_file)
+    bedGraph.load_chrom_data('chr1')
+    bedGraph.load_chrom_bins('chr1', BIN_SIZE)
+
+    run_times = {}
+    for stat in STATS:
+        best_time = None
+        for _ in range(NUM_REPEATS):
+            start_time = time.time()
+            bedGraph.stats(stat, start_list=start_list, end_list=end_list,
+                           chrom_name='chr1')
+            run_time = time.time() - start_time
+            if best_time is None or run_time < best_time:
+                best_time = run_time
+        run_times[stat] = best_time
+    return run_times
+
+
+with tempfile.TemporaryDirectory() as temp_folder:
+    chrom_size_file, data_file, gap_starts = make_sparse_track(temp_folder)
+    start_list, end_list = make_tests(gap_starts)
+
+    folders = [None]
+    names = ['current']
+    if len(sys.argv) > 1:
+        folders.append(sys.argv[1])
+        names.append(sys.argv[1])
+
+    print(f"{NUM_TESTS} searches starting in gaps of {GAP_SIZE} bp, best of "
+          f"{NUM_REPEATS}")
+    for name, folder in zip(names, folders):
+        BedGraph = import_BedGraph(folder)
+        run_times = bench(BedGraph, chrom_size_file, data_file, start_list,
+                          end_list)
+        print(f"{name}:")
+        for stat, run_time in run_times.items():
+            print(f"\t{stat}: {run_time:.4f}s")
@@ -0,0 +1,164 @@
+import sys
+import os
+import time
+import tempfile
+import importlib
+import numpy as np
+
+# Compares the run time and accuracy of the std kernel, walked and with prefix
+# sums loaded, with the one in another copy of pyBedGraph, such as a checkout
+# from before std was found in one pass.
+#
+# python3 bench_std.py chrom_size_file data_file [other_pyBedGraph_folder]
+
+NUM_TESTS = 100000
+MAX_INTERVAL_SIZE = 5000
+NUM_REPEATS = 3
+RANDOM_SEED = 1
+
+# values of the made up track far from 0 compared to how much they vary
+OFFSET = 1e9
+NUM_OFFSET_INTERVALS = 100000
+
+
+def import_BedGraph(folder=None):
+    for module_name in list(sys.modules):
+        if module_name.startswith('pyBedGraph'):
+            del sys.modules[module_name]
+
+    if folder is not None:
+        sys.path.insert(0, folder)
+    pyBedGraph = importlib.import_module('pyBedGraph')
+    if folder is not None:
+        sys.path.pop(0)
+
+    return pyBedGraph.BedGraph
+
+
+def make_tests(chrom_size):
+    rng = np.random.default_rng(RANDOM_SEED)
+    start_list = rng.integers(0, chrom_size - 1, NUM_TESTS).astype(np.int32)
+    end_list = start_list + rng.integers(1, MAX_INTERVAL_SIZE, NUM_TESTS)
+    end_list = np.minimum(end_list, chrom_size).astype(np.int32)
+    return start_list, end_list
+
+
+def time_stat(bedGraph, stat, chrom_name, start_list, end_list):
+    best_time = None
+    result = None
+    for _ in range(NUM_REPEATS):
+        start_time = time.time()
+        result = bedGraph.stats(stat, start_list=start_list, end_list=end_list,
+                                chrom_name=chrom_name)
+        run_time = time.time() - start_time
+        if best_time is None or run_time < best_time:
+            best_time = run_time
+    return best_time, result
+
+
+def exact_stds(chrom, start_list, end_list):
+    # std of each search in extended precision, ignoring missing base pairs
+    interval_start, interval_end = chrom.intervals[0], chrom.intervals[1]
+    values = chrom.value_map.astype(np.longdouble)
+    result = np.full(start_list.size, -1, dtype=np.longdouble)
+    for i in range(start_list.size):
+        first = np.searchsorted(interval_end, start_list[i], side='right')
+        last = np.searchsorted(interval_start, end_list[i], side='left')
+        sizes = np.minimum(interval_end[first:last], end_list[i]) - \
+            np.maximum(interval_start[first:last], start_list[i])
+        if sizes.sum() == 0:
+            continue
+        sizes = sizes.astype(np.longdouble)
+        mean = (values[first:last] * sizes).sum() / sizes.sum()
+        result[i] = np.sqrt(
+            ((values[first:last] - mean) ** 2 * sizes).sum() / sizes.sum())
+    return result
+
+
+def make_offset_track(folder):
+    rng = np.random.default_rng(RANDOM_SEED)
+    sizes = rng.integers(1, 50, NUM_OFFSET_INTERVALS)
+    gaps = rng.integers(0, 10, NUM_OFFSET_INTERVALS)
+    start_list = np.cumsum(sizes + gaps) - sizes
+    values = OFFSET + rng.random(NUM_OFFSET_INTERVALS)
+
+    chrom_size_file = os.path.join(folder, 'offset.sizes')
+    data_file = os.path.join(folder, 'offset.bedGraph')
+    with open(chrom_size_file, 'w') as out_file:
+        out_file.write(f'chr1\t{start_list[-1] + sizes[-1]}\n')
+    with open(data_file, 'w') as out_file:
+        for start, size, value in zip(start_list, sizes, values):
+            out_file.write(f'chr1\t{start}\t{start + size}\t{float(value)!r}\n')
+
+    return chrom_size_file, data_file
+
+
+def max_relative_error(stds, exact):
+    covered = exact > 0
+    return float((np.abs(stds[covered] - exact[covered]) / exact[covered]).max())
+
+
+def bench(BedGraph, chrom_size_file, data_file, offset_files):
+    bedGraph = BedGraph(chrom_size_file, data_file)
+    chrom_name = max(bedGraph.chrom_sizes, key=bedGraph.chrom_sizes.get)
+    bedGraph.load_chrom_data(chrom_name)
+    start_list, end_list = make_tests(bedGraph.chrom_sizes[chrom_name])
+
+    mean_time, _ = time_stat(bedGraph, 'mean', chrom_name, start_list, end_list)
+    std_time, _ = time_stat(bedGraph, 'std', chrom_name, start_list, end_list)
+
+    # copies from before prefix sums only walk the intervals
+    has_prefix_sums = hasattr(bedGraph, 'load_chrom_prefix_sums')
+    prefix_std_time = None
+    if has_prefix_sums:
+        bedGraph.load_chrom_prefix_sums(chrom_name)
+        prefix_std_time, _ = time_stat(bedGraph, 'std', chrom_name, start_list,
+                                       end_list)
+
+    offset_bedGraph = BedGraph(*offset_files)
+    offset_bedGraph.load_chrom_data('chr1')
+    offset_start_list, offset_end_list = \
+        make_tests(offset_bedGraph.chrom_sizes['chr1'])
+    offset_start_list = offset_start_list[:NUM_TESTS // 10]
+    offset_end_list = offset_end_list[:NUM_TESTS // 10]
+    _, offset_stds = time_stat(offset_bedGraph, 'std', 'chr1',
+                               offset_start_list, offset_end_list)
+    exact = exact_stds(offset_bedGraph.chromosome_map['chr1'],
+                       offset_start_list, offset_end_list)
+    max_error = max_relative_error(offset_stds, exact)
+
+    prefix_max_error = None
+    if has_prefix_sums:
+        offset_bedGraph.load_chrom_prefix_sums('chr1')
+        _, prefix_offset_stds = time_stat(offset_bedGraph, 'std', 'chr1',
+                                          offset_start_list, offset_end_list)
+        prefix_max_error = max_relative_error(prefix_offset_stds, exact)
+
+    return mean_time, std_time, max_error, prefix_std_time, prefix_max_error
+
+
+with tempfile.TemporaryDirectory() as temp_folder:
+    offset_files = make_offset_track(temp_folder)
+
+    folders = [None]
+    names = ['current']
+    if len(sys.argv) > 3:
+        folders.append(sys.argv[3])
+        names.append(sys.argv[3])
+
+    print(f"{NUM_TESTS} searches of up to {MAX_INTERVAL_SIZE} bp, best of "
+          f"{NUM_REPEATS}")
+    for name, folder in zip(names, folders):
+        BedGraph = import_BedGraph(folder)
+        mean_time, std_time, max_error, prefix_std_time, prefix_max_error = \
+            bench(BedGraph, sys.argv[1], sys.argv[2], offset_files)
+        print(f"{name}:\n"
+              f"\tmean: {mean_time:.4f}s\n"
+              f"\tstd: {std_time:.4f}s ({std_time / mean_time:.2f}x mean)\n"
+              f"\tmax relative std error with values near {OFFSET:g}: "
+              f"{max_error:.3g}")
+        if prefix_std_time is not None:
+            print(f"\tprefix std: {prefix_std_time:.4f}s "
+                  f"({prefix_std_time / mean_time:.2f}x mean)\n"
+                  f"\tmax relative prefix std error with values near "
+                  f"{OFFSET:g}: {prefix_max_error:.3g}")
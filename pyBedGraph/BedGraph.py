@@ -2,20 +2,154 @@
 # from .Chromosome import Chromosome
 
 # normal import for local use
-from .Chrom_Data import Chrom_Data
+from .Chrom_Data import Chrom_Data, DEFAULT_SEARCH_SIZE
 from .Chrom_Data_Complete import Chrom_Data_Complete
+from .Memory_Manager import Memory_Manager
+from .BigWig_Reader import BigWig_Reader
+from .BigWig_Writer import BigWig_Writer
+from .Bgzip_Reader import open_data_file
+from .Stats_Writer import Stats_Writer
+from .util import parse_bedgraph_chunk, find_chrom_runs, \
+    parse_interval_chunk, format_bed_rows
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import time
 import os
+import json
 import logging
 
 CHROM_NAME_INDEX = 0
-BUFFER_COUNTER = 10000  # 10^4
-BUFFER_COUNTER = 100000  # 10^4
+READ_CHUNK_SIZE = 1 << 24  # 16 MB of bedGraph text parsed at a time
+MIN_THREAD_CHUNK_SIZE = 10000  # fewest searches given to a thread at a time
+CHUNKS_PER_THREAD = 4  # more chunks than threads evens out uneven searches
+CACHE_VERSION = 4  # changes whenever the layout of the cache changes
+CACHE_MANIFEST_NAME = 'manifest.json'
+WRITE_CHUNK_SIZE = 1 << 20  # bedgraph lines formatted at a time
+ZOOM_FACTOR = 4  # each zoom level summarizes this many times more bp
+MAX_ZOOM_LEVELS = 10
+VALUE_TYPES = ['float64', 'float32']  # types the values can be stored as
 
 log = logging.getLogger()
 
 
+class SearchError(RuntimeError):
+    """
+    Raised when the intervals of a file have a chromosome that can not be
+    searched
+    """
+
+
+def read_chunks(data_file, chunk_size=READ_CHUNK_SIZE, num_bytes=None):
+    """
+    Reads a binary file in chunks that only hold complete lines.
+
+    Parameters
+    ----------
+    data_file : file object
+        File opened in binary mode
+    chunk_size : int
+        Number of bytes to read at a time (Default is 16 MB)
+    num_bytes : int
+        Number of bytes to read from the current position of the file
+        (Default is the rest of the file)
+
+    Returns
+    -------
+    generator of bytes
+        Chunks of the file, each ending at the end of a line
+    """
+    remainder = b''
+    while True:
+        if num_bytes is None:
+            chunk = data_file.read(chunk_size)
+        else:
+            chunk = data_file.read(min(chunk_size, num_bytes))
+            num_bytes -= len(chunk)
+        if not chunk:
+            break
+
+        last_line_end = chunk.rfind(b'\n')
+        if last_line_end == -1:
+            remainder += chunk
+            continue
+
+        yield remainder + chunk[:last_line_end + 1]
+        remainder = chunk[last_line_end + 1:]
+
+    if remainder:
+        yield remainder
+
+
+def run_in_threads(method_to_call, start_list, end_list, n_threads):
+    """
+    Splits the searches into chunks and finds a statistic for each chunk in
+    a pool of threads. The Cython kernels release the GIL so the chunks are
+    searched in parallel.
+
+    Parameters
+    ----------
+    method_to_call : Function
+        Function that finds a statistic for a start_list and end_list
+    start_list : numpy array
+        Start indexes of intervals
+    end_list : numpy array
+        End indexes of intervals
+    n_threads : int
+        Number of threads to use
+
+    Returns
+    -------
+    numpy array
+        Results in the same order as a single call to method_to_call
+    """
+    num_tests = start_list.size
+    chunk_size = max(MIN_THREAD_CHUNK_SIZE,
+                     -(-num_tests // (n_threads * CHUNKS_PER_THREAD)))
+
+    if n_threads < 2 or num_tests <= chunk_size:
+        return method_to_call(start_list, end_list)
+
+    def search_chunk(chunk_start):
+        chunk_end = chunk_start + chunk_size
+        return method_to_call(start_list[chunk_start:chunk_end],
+                              end_list[chunk_start:chunk_end])
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        results = list(executor.map(search_chunk,
+                                    range(0, num_tests, chunk_size)))
+
+    return np.concatenate(results)
+
+
+def group_rows_by_chrom(chrom_list):
+    """
+    Groups the rows of intervals by chromosome
+
+    Parameters
+    ----------
+    chrom_list : numpy array
+        Chromosome name of each interval
+
+    Returns
+    -------
+    generator of tuples
+        Name of each chromosome and the indexes of its rows, in input order
+    """
+    # rows of each chromosome next to each other, in input order
+    row_order = np.argsort(chrom_list, kind='stable')
+    sorted_chroms = chrom_list[row_order]
+    group_starts = np.flatnonzero(sorted_chroms[1:] != sorted_chroms[:-1]) + 1
+    group_starts = np.concatenate(([0], group_starts))
+    group_ends = np.append(group_starts[1:], chrom_list.size)
+
+    for group_start, group_end in zip(group_starts, group_ends):
+        chrom_name = sorted_chroms[group_start]
+        if isinstance(chrom_name, bytes):
+            chrom_name = chrom_name.decode()
+
+        yield str(chrom_name), row_order[group_start:group_end]
+
+
 class BedGraph:
     """
     Class that holds the information of the entire loaded (bigwig or bedgraph)
@@ -23,14 +157,17 @@ class BedGraph:
     """
 
     def __init__(self, chrom_size_file_name, data_file_name, chroms_to_load=None,
-                 ignore_missing_bp=True, min_value=-1, debug=False):
+                 ignore_missing_bp=True, min_value=-1, debug=False,
+                 sparse_index=False, cache_dir=None, lazy=False,
+                 memory_budget=None, value_type='float64'):
         """
         Parameters
         ----------
         chrom_size_file_name : str
             Name of the file containing chromosome sizes
         data_file_name : str
-            Name of the bedgraph or bigwig file to read
+            Name of the bedgraph or bigwig file to read. The bedgraph file
+            may be compressed with gzip or bgzip.
         chroms_to_load : list
             List of chromosomes to load (Default is all)
         ignore_missing_bp : bool
@@ -48,7 +185,36 @@ class BedGraph:
             Minimum value of interval to keep (Default is -1)
         debug: bool
             (Default is False)
+        sparse_index : bool
+            Whether to find intervals with a binary search instead of an index
+            array holding 4 bytes per base pair. Uses less memory but
+            searches are slightly slower. (Default is False)
+        cache_dir : str
+            Directory of a cache made by save_cache. If the cache matches
+            data_file_name its arrays are memory-mapped instead of reading the
+            file. Otherwise the file is read and the cache is saved.
+            (Default is None)
+        lazy : bool
+            Whether to wait until a chromosome is first used to read it in.
+            Only the byte offsets of each chromosome in a bedgraph file are
+            found here. The index array of a chromosome is loaded when it is
+            first searched. (Default is False)
+        memory_budget : int
+            Number of bytes the index arrays, prefix sums, range indexes and
+            bins of all chromosomes can use. The least recently searched ones
+            are freed when over budget and loaded again when next searched.
+            (Default is no limit)
+        value_type : str
+            Type to store the values of the intervals as. 'float32' uses 4
+            bytes less per interval than 'float64' but keeps only about 7
+            significant digits of each value. Statistics are still found and
+            returned as float64. (Default is 'float64')
         """
+        if value_type not in VALUE_TYPES:
+            error_msg = f"{value_type} is not a valid value type. It must " \
+                        f"be one of {VALUE_TYPES}"
+            log.critical(error_msg)
+            raise RuntimeError(error_msg)
 
         file_parts = os.path.basename(data_file_name).split('.')
         using_bigwig = (file_parts[-1].lower() == 'bigwig')
@@ -62,9 +228,23 @@ class BedGraph:
         self.chromosome_map = {}
         self.chrom_sizes = {}
         self.ignore_missing_bp = ignore_missing_bp
+        self.sparse_index = sparse_index
+        self.chrom_size_file_name = chrom_size_file_name
+        self.data_file_name = data_file_name
+        self.min_value = min_value
+        self.debug = debug
+        self.lazy = lazy
+        self.value_type = value_type
+        self.using_bigwig = using_bigwig
+        self.memory_manager = Memory_Manager(memory_budget)
+
+        # chromosomes that have not been read in yet, with the byte ranges of
+        # their lines in a bedgraph file or None for a bigwig file
+        self.pending_chroms = {}
 
         if chroms_to_load:
             chroms_to_load = set(chroms_to_load)
+        self.chroms_to_load = chroms_to_load
 
         log.info(f"Reading in {chrom_size_file_name} ...")
         with open(chrom_size_file_name) as chrom_size_file:
@@ -82,55 +262,53 @@ class BedGraph:
                 chrom_name = data[0]
                 self.chrom_sizes[chrom_name] = int(data[1])
 
-        if not using_bigwig:
-            current_chrom = None
-            log.info(f"Reading in {data_file_name} ...")
-            with open(data_file_name) as data_file:
-                for line in data_file:
-                    data = line.split()
-                    chrom_name = data[CHROM_NAME_INDEX]
-
-                    if chrom_name not in self.chrom_sizes:
-                        log.warning(
-                            f"{chrom_name} was not included in {chrom_size_file}")
-                        continue
-
-                    if chroms_to_load is not None and chrom_name not in chroms_to_load:
-                        continue
-
-                    # Create chromosome object here to trim right after adding
-                    if chrom_name not in self.chromosome_map:
-                        if ignore_missing_bp:
-                            self.chromosome_map[chrom_name] = \
-                                Chrom_Data(chrom_name,
-                                           self.chrom_sizes[chrom_name],
-                                           min_value, debug=debug)
+        loaded_from_cache = cache_dir is not None and \
+            self.load_from_cache(cache_dir, debug)
+
+        if loaded_from_cache:
+            log.info(f"Loaded {data_file_name} from {cache_dir}")
+        elif lazy and not using_bigwig:
+            log.info(f"Finding chromosomes in {data_file_name} ...")
+            unknown_chroms = set()
+            chunk_offset = 0
+            with open_data_file(data_file_name) as data_file:
+                for chunk in read_chunks(data_file):
+                    chrom_names, run_starts, run_ends = find_chrom_runs(chunk)
+
+                    for chrom_name, run_start, run_end in \
+                            zip(chrom_names, run_starts, run_ends):
+                        if not self.is_chrom_to_load(chrom_name,
+                                                     unknown_chroms):
+                            continue
+
+                        byte_ranges = \
+                            self.pending_chroms.setdefault(chrom_name, [])
+                        run_start += chunk_offset
+                        run_end += chunk_offset
+
+                        # join runs split between two chunks
+                        if byte_ranges and byte_ranges[-1][1] == run_start:
+                            byte_ranges[-1][1] = run_end
                         else:
-                            self.chromosome_map[chrom_name] = \
-                                Chrom_Data_Complete(chrom_name,
-                                                    self.chrom_sizes[
-                                                        chrom_name],
-                                                    min_value, debug=debug)
+                            byte_ranges.append([run_start, run_end])
 
-                    if current_chrom is None:
-                        current_chrom = self.chromosome_map[chrom_name]
+                    chunk_offset += len(chunk)
 
-                    if current_chrom.name != chrom_name:
-                        current_chrom.trim_extra_space()
-                        current_chrom = self.chromosome_map[chrom_name]
-
-                    current_chrom.add_data(data)
+        elif not using_bigwig:
+            log.info(f"Reading in {data_file_name} ...")
+            unknown_chroms = set()
+            with open_data_file(data_file_name) as data_file:
+                for chunk in read_chunks(data_file):
+                    self.add_bedgraph_chunk(chunk, unknown_chroms)
 
-                # clean up the last chromosome found in the bedGraph file
-                if current_chrom:
-                    current_chrom.trim_extra_space()
+            for chrom in self.chromosome_map.values():
+                chrom.trim_extra_space()
 
         else:
             # start_time = time.time()
 
-            # Use pyBigWig to read in the bigwig file
-            import pyBigWig
-            bw = pyBigWig.open(data_file_name)
+            bw = BigWig_Reader(data_file_name)
+            bigwig_chroms = bw.chroms()
 
             for chrom_name in self.chrom_sizes:
 
@@ -138,54 +316,368 @@ class BedGraph:
                         chrom_name not in chroms_to_load:
                     continue
 
-                try:
-                    chrom_intervals = bw.intervals(chrom_name)
-                except RuntimeError:
+                if lazy:
+                    if chrom_name in bigwig_chroms:
+                        self.pending_chroms[chrom_name] = None
                     continue
 
-                if ignore_missing_bp:
-                    self.chromosome_map[chrom_name] = \
-                        Chrom_Data(chrom_name,
-                                   self.chrom_sizes[chrom_name],
-                                   min_value, debug=debug)
-                else:
-                    self.chromosome_map[chrom_name] = \
-                        Chrom_Data_Complete(chrom_name,
-                                            self.chrom_sizes[chrom_name],
-                                            min_value, debug=debug)
-
-                current_chrom = self.chromosome_map[chrom_name]
-                if min_value > -1:
-                    for interval in chrom_intervals:
-                        current_chrom.add_data(interval)
-                else:
-                    current_chrom.add_bigwig_data(chrom_intervals)
-                current_chrom.trim_extra_space()
+                self.read_bigwig_chrom(bw, chrom_name)
 
+            bw.close()
             # print(time.time() - start_time)
 
         # Check that all chroms that were specified were successfully loaded
         if chroms_to_load:
             for chrom_name in chroms_to_load:
-                if chrom_name not in self.chromosome_map:
+                if chrom_name not in self.chromosome_map and \
+                        chrom_name not in self.pending_chroms:
                     error_msg = f"{chrom_name} was not found in " \
                                 f"{data_file_name}"
                     log.critical(error_msg)
 
                     raise RuntimeError(error_msg)
 
+        if cache_dir is not None and not loaded_from_cache:
+            self.save_cache(cache_dir)
+
+    def is_chrom_to_load(self, chrom_name, unknown_chroms):
+        """
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome found in the data file
+        unknown_chroms : set
+            Chromosomes not in the chromosome sizes file that were already
+            warned about
+
+        Returns
+        -------
+        bool
+            Whether the chromosome should be read in
+        """
+        if chrom_name not in self.chrom_sizes:
+            if chrom_name not in unknown_chroms:
+                unknown_chroms.add(chrom_name)
+                log.warning(f"{chrom_name} was not included in "
+                            f"{self.chrom_size_file_name}")
+            return False
+
+        return self.chroms_to_load is None or \
+            chrom_name in self.chroms_to_load
+
+    def add_bedgraph_chunk(self, chunk, unknown_chroms):
+        """
+        Parses a chunk of complete bedgraph lines and adds its intervals to
+        their chromosomes
+
+        Parameters
+        ----------
+        chunk : bytes
+            Lines of the bedgraph file
+        unknown_chroms : set
+            Chromosomes not in the chromosome sizes file that were already
+            warned about
+        """
+        chrom_names, run_starts, start_list, end_list, value_list, \
+            numb_skipped = parse_bedgraph_chunk(chunk)
+
+        if numb_skipped > 0:
+            log.warning(f"Skipped {numb_skipped} lines in "
+                        f"{self.data_file_name} with an incorrect format")
+
+        for run_index, chrom_name in enumerate(chrom_names):
+            if not self.is_chrom_to_load(chrom_name, unknown_chroms):
+                continue
+
+            if chrom_name not in self.chromosome_map:
+                self.chromosome_map[chrom_name] = \
+                    self.create_chrom(chrom_name, self.min_value, self.debug)
+
+            run_start = run_starts[run_index]
+            run_end = run_starts[run_index + 1]
+            self.chromosome_map[chrom_name].add_data_arrays(
+                start_list[run_start:run_end],
+                end_list[run_start:run_end],
+                value_list[run_start:run_end])
+
+    def read_bigwig_chrom(self, bw, chrom_name):
+        """
+        Reads in the intervals of a chromosome from a bigwig file
+
+        Parameters
+        ----------
+        bw : BigWig_Reader
+            Opened bigwig file
+        chrom_name : str
+            Name of chromosome to read in
+        """
+        if chrom_name not in bw.chroms():
+            return
+
+        current_chrom = self.create_chrom(chrom_name, self.min_value,
+                                          self.debug)
+        self.chromosome_map[chrom_name] = current_chrom
+
+        for start_list, end_list, value_list in bw.iter_intervals(chrom_name):
+            current_chrom.add_data_arrays(start_list, end_list, value_list)
+        current_chrom.trim_extra_space()
+
+    def read_pending_chrom(self, chrom_name):
+        """
+        Reads in a chromosome that was skipped when loading lazily
+
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome to read in
+        """
+        byte_ranges = self.pending_chroms.pop(chrom_name)
+        log.info(f"Reading in {chrom_name} from {self.data_file_name} ...")
+
+        if byte_ranges is None:
+            with BigWig_Reader(self.data_file_name) as bw:
+                self.read_bigwig_chrom(bw, chrom_name)
+            return
+
+        with open_data_file(self.data_file_name) as data_file:
+            for range_start, range_end in byte_ranges:
+                data_file.seek(range_start)
+                for chunk in read_chunks(data_file,
+                                         num_bytes=range_end - range_start):
+                    self.add_bedgraph_chunk(chunk, set())
+
+        self.chromosome_map[chrom_name].trim_extra_space()
+
+    def get_written_chroms(self):
+        """
+        Reads in the chromosomes that were not read yet so they can be written
+
+        Returns
+        -------
+        list
+            Chromosomes with intervals, in the order of the chromosome sizes
+            file
+        """
+        for chrom_name in list(self.pending_chroms):
+            self.read_pending_chrom(chrom_name)
+
+        return [self.chromosome_map[chrom_name]
+                for chrom_name in self.chrom_sizes
+                if chrom_name in self.chromosome_map]
+
+    def write_bedgraph(self, file_name):
+        """
+        Writes the intervals of every chromosome to a bedgraph file, such as
+        after filtering them with min_value or Chrom_Data.remove_intervals
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the bedgraph file to write
+        """
+        with open(file_name, 'wb') as out_file:
+            for chrom in self.get_written_chroms():
+                for chunk_start in range(0, chrom.num_intervals,
+                                         WRITE_CHUNK_SIZE):
+                    chunk_end = min(chunk_start + WRITE_CHUNK_SIZE,
+                                    chrom.num_intervals)
+                    out_file.write(format_bed_rows(
+                        [chrom.name],
+                        np.zeros(chunk_end - chunk_start, dtype=np.int64),
+                        chrom.intervals[0][chunk_start:chunk_end].astype(
+                            np.int64),
+                        chrom.intervals[1][chunk_start:chunk_end].astype(
+                            np.int64),
+                        chrom.value_map[chunk_start:chunk_end].astype(
+                            np.float64)[:, np.newaxis]))
+
+    def write_bigwig(self, file_name, zoom_sizes=None):
+        """
+        Writes the intervals of every chromosome to a bigwig file with zoom
+        levels. Values are stored as float32 in bigwig files.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the bigwig file to write
+        zoom_sizes : list
+            Number of base pairs summarized by each record of each zoom level
+            (Default is powers of two, starting from the first one at least
+            ZOOM_FACTOR times the average interval size and growing
+            ZOOM_FACTOR times each level)
+        """
+        chroms = self.get_written_chroms()
+
+        if zoom_sizes is None:
+            numb_intervals = sum(chrom.num_intervals for chrom in chroms)
+            covered_size = sum(int(np.sum(chrom.intervals[1].astype(np.int64) -
+                                          chrom.intervals[0]))
+                               for chrom in chroms)
+            largest_size = max([chrom.size for chrom in chroms], default=0)
+
+            zoom_size = 1
+            if numb_intervals > 0:
+                while zoom_size < ZOOM_FACTOR * covered_size / numb_intervals:
+                    zoom_size *= 2
+
+            zoom_sizes = []
+            while zoom_size < largest_size and \
+                    len(zoom_sizes) < MAX_ZOOM_LEVELS:
+                zoom_sizes.append(zoom_size)
+                zoom_size *= ZOOM_FACTOR
+
+        chrom_sizes = {chrom.name: chrom.size for chrom in chroms}
+        with BigWig_Writer(file_name, chrom_sizes, zoom_sizes) as writer:
+            for chrom in chroms:
+                writer.add_chrom(chrom.name,
+                                 chrom.intervals[0][:chrom.num_intervals],
+                                 chrom.intervals[1][:chrom.num_intervals],
+                                 chrom.value_map[:chrom.num_intervals])
+
+    def save_cache(self, cache_dir, save_index_list=False, save_bins=False):
+        """
+        Saves the loaded chromosomes as .npy files with a manifest so later
+        BedGraph objects can memory-map them instead of reading the data file
+
+        Parameters
+        ----------
+        cache_dir : str
+            Directory to save the cache in, created if it does not exist
+        save_index_list : bool
+            Whether to also save loaded index arrays (Default is False)
+        save_bins : bool
+            Whether to also save loaded bins (Default is False)
+        """
+        log.info(f"Saving cache of {self.data_file_name} to {cache_dir} ...")
+        for chrom_name in list(self.pending_chroms):
+            self.read_pending_chrom(chrom_name)
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        data_file_stat = os.stat(self.data_file_name)
+        manifest = {
+            'version': CACHE_VERSION,
+            'data_file_size': data_file_stat.st_size,
+            'data_file_mtime': data_file_stat.st_mtime_ns,
+            'min_value': self.min_value,
+            'value_type': self.value_type,
+            'ignore_missing_bp': self.ignore_missing_bp,
+            'chrom_sizes': self.chrom_sizes,
+            'chroms_to_load': None,
+            'chroms': {}
+        }
+        if self.chroms_to_load is not None:
+            manifest['chroms_to_load'] = sorted(self.chroms_to_load)
+
+        for chrom_name, chrom in self.chromosome_map.items():
+            manifest['chroms'][chrom_name] = \
+                chrom.save_cache(cache_dir, chrom_name, save_index_list,
+                                 save_bins)
+
+        # the manifest is written last so a cache is never half visible
+        manifest_file_name = os.path.join(cache_dir, CACHE_MANIFEST_NAME)
+        temp_file_name = f"{manifest_file_name}.{os.getpid()}.tmp"
+        with open(temp_file_name, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temp_file_name, manifest_file_name)
+
+    def load_from_cache(self, cache_dir, debug=False):
+        """
+        Memory-maps the chromosomes saved in cache_dir by save_cache
+
+        Parameters
+        ----------
+        cache_dir : str
+            Directory the cache was saved in
+        debug : bool
+            (Default is False)
+
+        Returns
+        -------
+        bool
+            Whether the cache matched the data file and was loaded
+        """
+        manifest_file_name = os.path.join(cache_dir, CACHE_MANIFEST_NAME)
+        if not os.path.isfile(manifest_file_name):
+            return False
+
+        with open(manifest_file_name) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        data_file_stat = os.stat(self.data_file_name)
+        if manifest['version'] != CACHE_VERSION or \
+                manifest['data_file_size'] != data_file_stat.st_size or \
+                manifest['data_file_mtime'] != data_file_stat.st_mtime_ns or \
+                manifest['min_value'] != self.min_value or \
+                manifest['value_type'] != self.value_type or \
+                manifest['chrom_sizes'] != self.chrom_sizes:
+            log.info(f"Cache in {cache_dir} does not match "
+                     f"{self.data_file_name}")
+            return False
+
+        cached_chroms = manifest['chroms_to_load']
+        if cached_chroms is not None and (
+                self.chroms_to_load is None or
+                not self.chroms_to_load.issubset(cached_chroms)):
+            log.info(f"Cache in {cache_dir} is missing chromosomes to load")
+            return False
+
+        # bins differ depending on whether missing base pairs are ignored
+        load_bins = manifest['ignore_missing_bp'] == self.ignore_missing_bp
+
+        for chrom_name, chrom_manifest in manifest['chroms'].items():
+            if self.chroms_to_load is not None and \
+                    chrom_name not in self.chroms_to_load:
+                continue
+
+            chrom = self.create_chrom(chrom_name, self.min_value, debug)
+            chrom.load_cache(cache_dir, chrom_manifest, load_bins)
+            self.chromosome_map[chrom_name] = chrom
+
+        return True
+
+    def create_chrom(self, chrom_name, min_value, debug):
+        """
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome to create
+        min_value : int
+            Minimum value of interval to keep
+        debug : bool
+
+        Returns
+        -------
+        Chrom_Data
+            Empty Chrom_Data object matching ignore_missing_bp
+        """
+        if self.ignore_missing_bp:
+            return Chrom_Data(chrom_name, self.chrom_sizes[chrom_name],
+                              min_value, debug=debug,
+                              sparse_index=self.sparse_index,
+                              value_type=self.value_type)
+
+        return Chrom_Data_Complete(chrom_name, self.chrom_sizes[chrom_name],
+                                   min_value, debug=debug,
+                                   sparse_index=self.sparse_index,
+                                   value_type=self.value_type)
+
     def get_chrom(self, chrom_name):
         """
         Parameters
         ----------
         chrom_name : str
-            Name of chromosome to get
+            Name of chromosome to get, read in first if it was skipped when
+            loading lazily
 
         Returns
         -------
         Chrom_Data
             Specified Chrom_Data object with given name
         """
+        if chrom_name in self.pending_chroms:
+            self.read_pending_chrom(chrom_name)
+
         return self.chromosome_map[chrom_name]
 
     def has_chrom(self, chrom_name):
@@ -200,7 +692,8 @@ class BedGraph:
         bool
             Whether the chromosome is in this object
         """
-        return chrom_name in self.chromosome_map
+        return chrom_name in self.chromosome_map or \
+            chrom_name in self.pending_chroms
 
     def load_chrom_data(self, chrom_name):
         """
@@ -209,16 +702,116 @@ class BedGraph:
         chrom_name : str
             Name of chromosome to load index array
         """
-        self.chromosome_map[chrom_name].load_index_array()
+        chrom = self.get_chrom(chrom_name)
+        self.memory_manager.load(chrom, 'index_list', chrom.load_index_array)
+
+    def load_chrom_prefix_sums(self, chrom_name):
+        """
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome to load prefix sums for the exact mean, sum,
+            coverage and std
+        """
+        chrom = self.get_chrom(chrom_name)
+        self.memory_manager.load(chrom, 'prefix_sums', chrom.load_prefix_sums)
+
+    def load_chrom_range_index(self, chrom_name):
+        """
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome to load a range index for the max, min and
+            max_index
+        """
+        chrom = self.get_chrom(chrom_name)
+        self.memory_manager.load(chrom, 'range_index', chrom.load_range_index)
+
+    def load_chrom_quantile_index(self, chrom_name):
+        """
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome to load a quantile index for the median and
+            quantiles
+        """
+        chrom = self.get_chrom(chrom_name)
+        self.memory_manager.load(chrom, 'quantile_index',
+                                 chrom.load_quantile_index)
 
-    def load_chrom_bins(self, chrom_name, max_bins_size):
+    def load_chrom_bins(self, chrom_name, max_bins_size=None, max_error=None,
+                        search_size=DEFAULT_SEARCH_SIZE):
         """
         Parameters
         ----------
         chrom_name : str
             Name of chromosome to load bins
+        max_bins_size : int
+            Size of the smallest bins. Picked from the values of the
+            chromosome if only max_error is given.
+        max_error : float
+            Largest relative error of approx_mean. Searches that could be off
+            by more are found exactly instead. (Default is no limit)
+        search_size : int
+            Typical length of a search, used to pick max_bins_size (Default
+            is DEFAULT_SEARCH_SIZE)
+        """
+        chrom = self.get_chrom(chrom_name)
+        self.memory_manager.load(
+            chrom, 'bins',
+            lambda: chrom.load_bins(max_bins_size, max_error, search_size))
+
+    def load_chrom_zoom(self, chrom_name, zoom_size=None):
+        """
+        Loads the summaries of a zoom level of the bigwig file so approx_mean,
+        approx_max, approx_min and approx_std can be found without building
+        bins. approx_mean uses bins instead when they are loaded.
+
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome to load the zoom level of
+        zoom_size : int
+            Number of base pairs summarized by each record. The largest zoom
+            level that is not larger is used. (Default is the smallest zoom
+            level)
         """
-        self.chromosome_map[chrom_name].load_bins(max_bins_size)
+        if not self.using_bigwig:
+            error_msg = f"{self.data_file_name} is not a bigwig file so it " \
+                        f"has no zoom levels"
+            log.critical(error_msg)
+            raise RuntimeError(error_msg)
+
+        chrom = self.get_chrom(chrom_name)
+        self.memory_manager.load(
+            chrom, 'zoom', lambda: self.read_chrom_zoom(chrom, zoom_size))
+
+    def read_chrom_zoom(self, chrom, zoom_size):
+        """
+        Reads a zoom level of a chromosome from the bigwig file
+
+        Parameters
+        ----------
+        chrom : Chrom_Data
+            Chromosome to read the zoom level of
+        zoom_size : int
+            Number of base pairs summarized by each record, the largest zoom
+            level that is not larger is read (None for the smallest)
+        """
+        with BigWig_Reader(self.data_file_name) as bw:
+            zoom_sizes = bw.get_zoom_sizes()
+            if not zoom_sizes:
+                error_msg = f"{self.data_file_name} has no zoom levels"
+                log.critical(error_msg)
+                raise RuntimeError(error_msg)
+
+            zoom_index = 0
+            if zoom_size is not None:
+                zoom_index = max(np.searchsorted(zoom_sizes, zoom_size,
+                                                 side='right') - 1, 0)
+
+            chrom.set_zoom(zoom_sizes[zoom_index],
+                           bw.read_zoom_records(chrom.name, zoom_index))
 
     def free_chrom_data(self, chrom_name):
         """
@@ -227,7 +820,32 @@ class BedGraph:
         chrom_name : str
             Name of chromosome to free index array memory
         """
-        self.chromosome_map[chrom_name].free_index_list()
+        self.memory_manager.free(chrom_name, 'index_list')
+        self.get_chrom(chrom_name).free_index_list()
+
+    def get_memory_manager_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Number of times a search found its indexes loaded (hits), had to
+            load them again (misses) and indexes freed to stay under the
+            memory budget (evictions), with the bytes used by tracked indexes
+        """
+        return self.memory_manager.get_stats()
+
+    def get_memory_usage(self):
+        """
+        Returns
+        -------
+        dict
+            Keys are chromosome names, values are dictionaries with the number
+            of bytes used by the intervals and each loaded index
+        """
+        return {
+            chrom_name: chrom.get_memory_usage()
+            for chrom_name, chrom in self.chromosome_map.items()
+        }
 
     def get_method(self, chrom_name, stat):
         """
@@ -246,12 +864,24 @@ class BedGraph:
             The function to call that finds the statistic of a given chromosome
         """
 
+        if chrom_name in self.pending_chroms:
+            self.read_pending_chrom(chrom_name)
+
         if chrom_name not in self.chromosome_map:
             log.error(f"{chrom_name} is not a valid chromosome")
             return None
 
         chrom = self.chromosome_map[chrom_name]
 
+        self.memory_manager.use(chrom, stat)
+
+        # statistics found from a zoom level do not search the intervals
+        if chrom.uses_zoom(stat):
+            return chrom.get_method(stat)
+
+        if not chrom.loaded_chrom and self.lazy:
+            self.load_chrom_data(chrom_name)
+
         if not chrom.loaded_chrom:
             log.error(
                 f"{chrom.name} needs to be loaded before it can be searched.")
@@ -259,6 +889,29 @@ class BedGraph:
 
         return chrom.get_method(stat)
 
+    def get_multi_method(self, chrom_name, stats):
+        """
+        Gets the function that finds several statistics at once
+
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome to find the statistics
+        stats : list of str
+            Names of statistics to find
+
+        Returns
+        -------
+        Function
+            The function to call that finds the statistics of a given
+            chromosome as a structured numpy array
+        """
+        for stat in stats:
+            if self.get_method(chrom_name, stat) is None:
+                return None
+
+        return self.chromosome_map[chrom_name].get_multi_method(stats)
+
     @staticmethod
     def change_shape(intervals):
         """
@@ -276,6 +929,11 @@ class BedGraph:
         list
             list of the end indexes of intervals
         """
+        interval_array = np.array(intervals, dtype=object)
+        if interval_array.ndim == 2 and interval_array.shape[1] == 3:
+            return interval_array[:, 1].astype(np.int32), \
+                interval_array[:, 2].astype(np.int32)
+
         num_tests = len(intervals)
         start_list = np.zeros(num_tests, dtype=np.int32)
         end_list = np.zeros(num_tests, dtype=np.int32)
@@ -292,18 +950,117 @@ class BedGraph:
 
         return start_list, end_list
 
+    @staticmethod
+    def get_interval_columns(intervals):
+        """
+        Changes the shape of intervals to be three arrays: chrom_list,
+        start_list, end_list
+
+        Parameters
+        ----------
+        intervals : list of len=3 lists or structured numpy array
+            Intervals to convert. A structured array must have the fields
+            chrom, start and end.
+
+        Returns
+        -------
+        numpy array
+            chromosome names of intervals, None if intervals has an
+            incorrect format
+        numpy array
+            start indexes of intervals
+        numpy array
+            end indexes of intervals
+        """
+        if isinstance(intervals, np.ndarray) and intervals.dtype.names:
+            return intervals['chrom'], intervals['start'].astype(np.int32), \
+                intervals['end'].astype(np.int32)
+
+        interval_array = np.array(intervals, dtype=object)
+        if interval_array.ndim != 2 or interval_array.shape[1] != 3:
+            log.error(
+                f"List given has incorrect formatting. It must be in the format:\n"
+                "[[chr1, 1, 100], [chr1, 101, 200], ...]")
+            return None, None, None
+
+        return interval_array[:, 0].astype(str), \
+            interval_array[:, 1].astype(np.int32), \
+            interval_array[:, 2].astype(np.int32)
+
+    def multi_chrom_stats(self, stat="mean", intervals=None, chrom_list=None,
+                          start_list=None, end_list=None, n_threads=1):
+        """
+        Finds a statistic for intervals spanning any number of chromosomes.
+        Must be given either intervals or (chrom_list, start_list, end_list).
+
+        Parameters
+        ----------
+        stat : str
+            Name of statistic to search for (Default is mean)
+        intervals : list of lists of length=3 or structured numpy array
+            Intervals to search. A structured array must have the fields
+            chrom, start and end.
+        chrom_list : list or numpy array
+            Chromosome names of intervals
+        start_list : list or numpy array
+            Start indexes of intervals
+        end_list : list or numpy array
+            End indexes of intervals
+        n_threads : int
+            Number of threads to search each chromosome with, None uses every
+            core (Default is 1)
+
+        Returns
+        -------
+        numpy array
+            Results of given statistic in the same order as the intervals
+        """
+        if intervals is not None:
+            chrom_list, start_list, end_list = \
+                self.get_interval_columns(intervals)
+
+        if chrom_list is None or start_list is None or end_list is None:
+            log.error(
+                "Must either have intervals or chrom_list, start_list, end_list")
+            return None
+
+        chrom_list = np.asarray(chrom_list)
+        start_list = np.asarray(start_list, dtype=np.int32)
+        end_list = np.asarray(end_list, dtype=np.int32)
+        assert chrom_list.size == start_list.size == end_list.size
+
+        if n_threads is None:
+            n_threads = os.cpu_count()
+
+        if chrom_list.size == 0:
+            return np.zeros(0, dtype=np.float64)
+
+        result = None
+        for chrom_name, rows in group_rows_by_chrom(chrom_list):
+            method_to_call = self.get_method(chrom_name, stat)
+            if method_to_call is None:
+                return None
+
+            chrom_result = run_in_threads(method_to_call, start_list[rows],
+                                          end_list[rows], n_threads)
+            if result is None:
+                result = np.empty(chrom_list.size, dtype=chrom_result.dtype)
+            result[rows] = chrom_result
+
+        return result
+
     def stats(self, stat="mean", intervals=None, start_list=None,
-              end_list=None, chrom_name=None):
+              end_list=None, chrom_name=None, n_threads=1):
         """
-        Finds a statistic for a given chromosome. Can only search one chromosome
-        at a time. Must be given either intervals or (start_list, end_list,
-        chrom_name).
+        Finds a statistic for a given chromosome. Must be given either
+        intervals or (start_list, end_list, chrom_name). Intervals on more than
+        one chromosome are searched with multi_chrom_stats.
 
         Parameters
         ----------
         stat : str
             Name of statistic to search for (Default is mean)
-        intervals : list of lists of length=3
+        intervals : list of lists of length=3 or structured numpy array
             List of intervals to search
         start_list : list
             List of start indexes of intervals
@@ -311,6 +1068,9 @@ class BedGraph:
             List of end indexes of intervals
         chrom_name :
             Name of chromosome to search
+        n_threads : int
+            Number of threads to search with, None uses every core. Results
+            are the same as with a single thread. (Default is 1)
 
         Returns
         -------
@@ -320,8 +1080,20 @@ class BedGraph:
 
         # convert intervals to start_list, end_list
         if intervals is not None:
-            chrom_name = intervals[0][0]
-            start_list, end_list = self.change_shape(intervals)
+            chrom_list, start_list, end_list = \
+                self.get_interval_columns(intervals)
+            if chrom_list is None:
+                return None
+
+            if np.any(chrom_list != chrom_list[0]):
+                return self.multi_chrom_stats(stat, chrom_list=chrom_list,
+                                              start_list=start_list,
+                                              end_list=end_list,
+                                              n_threads=n_threads)
+            chrom_name = chrom_list[0]
+            if isinstance(chrom_name, bytes):
+                chrom_name = chrom_name.decode()
+            chrom_name = str(chrom_name)
 
         if start_list is None or end_list is None or chrom_name is None:
             log.error(
@@ -342,92 +1114,268 @@ class BedGraph:
             return
 
         start_time = time.time()
-        result = method_to_call(start_list, end_list)
+        if n_threads is None:
+            n_threads = os.cpu_count()
+        result = run_in_threads(method_to_call, start_list, end_list,
+                                n_threads)
         # log.info(f"Time for {stat}:", time.time() - start_time)
         return result
 
-    def stats_from_file(self, interval_file, output_to_file=True, stat="mean"):
+    def stats_multi(self, stats, intervals=None, chrom_list=None,
+                    start_list=None, end_list=None, chrom_name=None,
+                    n_threads=1):
         """
-        Reads intervals from a file
+        Finds several statistics for the same intervals at once. Statistics
+        that would each walk over the values of the intervals are found
+        together in a single walk. Must be given either intervals,
+        (chrom_list, start_list, end_list) or (start_list, end_list,
+        chrom_name).
+
+        Parameters
+        ----------
+        stats : list of str
+            Names of statistics to search for
+        intervals : list of lists of length=3 or structured numpy array
+            Intervals to search, on any number of chromosomes
+        chrom_list : list or numpy array
+            Chromosome names of intervals
+        start_list : list or numpy array
+            Start indexes of intervals
+        end_list : list or numpy array
+            End indexes of intervals
+        chrom_name : str
+            Name of chromosome of every interval when there is no chrom_list
+        n_threads : int
+            Number of threads to search each chromosome with, None uses every
+            core (Default is 1)
+
+        Returns
+        -------
+        dict
+            Keys are statistics, values are numpy arrays of results in the
+            same order as the intervals
+        """
+        stats = list(dict.fromkeys(stats))
+
+        if intervals is not None:
+            chrom_list, start_list, end_list = \
+                self.get_interval_columns(intervals)
+        elif chrom_list is None and chrom_name is not None and \
+                start_list is not None:
+            chrom_list = np.full(len(start_list), chrom_name)
+
+        if chrom_list is None or start_list is None or end_list is None:
+            log.error("Must either have intervals, chrom_list, start_list, "
+                      "end_list or start_list, end_list, chrom_name")
+            return None
+
+        chrom_list = np.asarray(chrom_list)
+        start_list = np.asarray(start_list, dtype=np.int32)
+        end_list = np.asarray(end_list, dtype=np.int32)
+        assert chrom_list.size == start_list.size == end_list.size
+
+        if n_threads is None:
+            n_threads = os.cpu_count()
+
+        result = None
+        for chrom_name, rows in group_rows_by_chrom(chrom_list):
+            method_to_call = self.get_multi_method(chrom_name, stats)
+            if method_to_call is None:
+                return None
+
+            chrom_result = run_in_threads(method_to_call, start_list[rows],
+                                          end_list[rows], n_threads)
+            if result is None:
+                result = np.empty(chrom_list.size, dtype=chrom_result.dtype)
+            result[rows] = chrom_result
+
+        if result is None:
+            return {stat: np.zeros(0, dtype=np.float64) for stat in stats}
+
+        return {stat: np.ascontiguousarray(result[stat]) for stat in stats}
+
+    def iter_stats_from_file(self, interval_file, stat="mean", n_threads=1,
+                             chunk_size=READ_CHUNK_SIZE):
+        """
+        Reads intervals from a file in chunks and finds their statistics one
+        chunk at a time, so only one chunk of intervals is held in memory.
 
         Parameters
         ----------
         interval_file : str
             File to read intervals from
-        output_to_file : bool
-            Whether to output to file (Default is True)
-        stat : str
-            Name of statistic to search for (Default is mean)
+        stat : str or list of str
+            Name of statistic to search for, or a list of them (Default is
+            mean)
+        n_threads : int
+            Number of threads to search with, None uses every core
+            (Default is 1)
+        chunk_size : int
+            Number of bytes of interval_file to read at a time (Default is
+            16 MB)
 
         Returns
         -------
-        numpy array
-            list containing results of given statistic
+        generator of tuples
+            Chromosome name, start and end of each interval of a chunk in the
+            order of interval_file, followed by a list with the numpy array of
+            results of each statistic. Raises a SearchError when a chunk has a
+            chromosome that can not be searched.
         """
-        results = {}
-        test_intervals = {}
-
-        with open(interval_file) as in_file:
+        if n_threads is None:
+            n_threads = os.cpu_count()
 
-            current_chrom_name = None
-            current_interval = None
+        stats = [stat] if isinstance(stat, str) else list(stat)
 
-            for line in in_file:
-                interval = line.split()
+        with open(interval_file, 'rb') as in_file:
+            for chunk in read_chunks(in_file, chunk_size):
+                chrom_names, run_starts, start_list, end_list, bad_line = \
+                    parse_interval_chunk(chunk)
 
-                if len(interval) != 3:
+                if bad_line is not None:
                     log.error(
                         f"{interval_file} has incorrect formatting. It must be in the format:\n"
                         "chr1\t100\t401\n"
                         "chr1\t600\t1000\n"
                         "chr2\t0\t1000\n"
                         "...")
-                    log.error(interval)
-                    break
-
-                # change current_chrom if interval wants a different chrom
-                if current_chrom_name is None or current_chrom_name != interval[
-                    0]:
-                    current_chrom_name = interval[0]
-                    if current_chrom_name not in test_intervals:
-                        test_intervals[current_chrom_name] = {}
-                        current_interval = test_intervals[current_chrom_name]
-                        current_interval['start_list'] = []
-                        current_interval['end_list'] = []
-
-                current_interval['start_list'].append(int(interval[1]))
-                current_interval['end_list'].append(int(interval[2]))
-
-        for chrom_name in test_intervals:
-            method_to_call = self.get_method(chrom_name, stat)
+                    log.error(bad_line.decode(errors='replace').split())
+
+                if start_list.size > 0:
+                    chrom_list = np.repeat(np.array(chrom_names, dtype=str),
+                                           np.diff(run_starts))
+
+                    start_time = time.time()
+                    results = self.stats_multi(stats, chrom_list=chrom_list,
+                                               start_list=start_list,
+                                               end_list=end_list,
+                                               n_threads=n_threads)
+                    log.info(f"Time for {stats}: {time.time() - start_time}")
+
+                    if results is None:
+                        error_msg = f"Could not search the intervals of " \
+                                    f"{interval_file}"
+                        log.error(error_msg)
+                        raise SearchError(error_msg)
+                    stat_results = [results[current_stat]
+                                    for current_stat in stats]
+
+                    yield chrom_list, start_list, end_list, stat_results
+
+                if bad_line is not None:
+                    return
+
+    def stats_from_file(self, interval_file, output_to_file=True, stat="mean",
+                        n_threads=1, output_file_name=None,
+                        output_format='bed', chunk_size=READ_CHUNK_SIZE,
+                        keep_results=True):
+        """
+        Reads intervals from a file
 
-            if method_to_call is None:
-                return
-
-            start_time = time.time()
-            result = method_to_call(
-                np.array(test_intervals[chrom_name]['start_list'],
-                         dtype=np.int32),
-                np.array(test_intervals[chrom_name]['end_list'],
-                         dtype=np.int32))
-            log.info(f"Time for {stat}: {time.time() - start_time}")
-
-            results[chrom_name] = result
-            if output_to_file:
-                with open(chrom_name + '_out.txt', 'w') as out_file:
-                    result_counter = 0
+        Parameters
+        ----------
+        interval_file : str
+            File to read intervals from
+        output_to_file : bool
+            Whether to output to file (Default is True). Without an
+            output_file_name each chromosome's results are written to
+            <chrom>_out.txt, one value per line.
+        stat : str or list of str
+            Name of statistic to search for, or a list of them (Default is
+            mean)
+        n_threads : int
+            Number of threads to search with, None uses every core
+            (Default is 1)
+        output_file_name : str
+            File to write rows of chrom, start, end and one column for each
+            statistic to, in the order of interval_file (Default is None)
+        output_format : str
+            'bed' for tab separated rows or 'npy' for a numpy array of only
+            the statistics (Default is 'bed')
+        chunk_size : int
+            Number of bytes of interval_file to read and search at a time
+            (Default is 16 MB)
+        keep_results : bool
+            Whether to keep and return the results (Default is True). Set to
+            False with an output_file_name to stream huge interval files to
+            it, using memory for only one chunk of intervals at a time.
 
-                    output = ''
-                    for value_index in range(result.size):
-                        output += f"{result[value_index]}\n"
-                        result_counter += 1
+        Returns
+        -------
+        dict
+            Keys are chromosome names, values are numpy arrays of results. If
+            stat is a list the values are dictionaries with a numpy array for
+            each statistic. None if keep_results is False or a chromosome
+            could not be searched.
+        """
+        stats = [stat] if isinstance(stat, str) else list(stat)
+
+        if not keep_results and (not output_to_file or
+                                 output_file_name is None):
+            error_msg = "keep_results can only be False when writing to an " \
+                        "output_file_name"
+            log.error(error_msg)
+            raise RuntimeError(error_msg)
+
+        writer = None
+        if output_to_file and output_file_name is not None:
+            writer = Stats_Writer(output_file_name, stats, output_format)
+
+        chunk_results = []
+        try:
+            for chunk_result in self.iter_stats_from_file(
+                    interval_file, stat, n_threads, chunk_size):
+                if writer is not None:
+                    writer.write(*chunk_result)
+                if keep_results:
+                    chunk_results.append(chunk_result)
+        except SearchError:
+            # a chromosome of interval_file could not be searched, so the rows
+            # written so far are not the whole output
+            if writer is not None:
+                writer.close()
+                writer = None
+                os.remove(output_file_name)
+                log.error(f"Removed the incomplete {output_file_name}")
+            return None
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if not keep_results:
+            return
+
+        if not chunk_results:
+            chunk_results.append((np.array([], dtype=str),
+                                  np.array([], dtype=np.int32),
+                                  np.array([], dtype=np.int32),
+                                  [np.array([]) for _ in stats]))
 
-                        if result_counter == BUFFER_COUNTER:
-                            result_counter = 0
-                            out_file.write(output)
-                            output = ""
+        chrom_list = np.concatenate([result[0] for result in chunk_results])
+        stat_results = [
+            np.concatenate([result[3][i] for result in chunk_results])
+            for i in range(len(stats))
+        ]
 
-                    if result_counter > 0:
-                        out_file.write(output)
+        # chromosomes in the order they first appear in interval_file
+        chrom_names, first_rows = np.unique(chrom_list, return_index=True)
+        results = {}
+        for chrom_name in chrom_names[np.argsort(first_rows)]:
+            chrom_rows = chrom_list == chrom_name
+            chrom_name = str(chrom_name)
+
+            if isinstance(stat, str):
+                results[chrom_name] = stat_results[0][chrom_rows]
+            else:
+                results[chrom_name] = {
+                    current_stat: result[chrom_rows]
+                    for current_stat, result in zip(stats, stat_results)
+                }
+
+            if output_to_file and output_file_name is None:
+                columns = [result[chrom_rows].tolist() for result in stat_results]
+                with open(chrom_name + '_out.txt', 'w') as out_file:
+                    out_file.write(''.join(
+                        '\t'.join(map(str, row)) + '\n' for row in zip(*columns)))
 
         return results
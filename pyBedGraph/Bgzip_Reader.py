@@ -0,0 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+import gzip
+import os
+import zlib
+import logging
+
+log = logging.getLogger()
+
+GZIP_MAGIC = b'\x1f\x8b'
+BGZIP_HEADER_SIZE = 18
+BGZIP_BATCH_SIZE = 1 << 24  # 16 MB of compressed blocks decompressed together
+
+
+def is_bgzip_header(header):
+    """
+    Parameters
+    ----------
+    header : bytes
+        First bytes of a file
+
+    Returns
+    -------
+    bool
+        Whether the file starts with a bgzip block, a gzip member holding the
+        size of the block in a BC extra field
+    """
+    return len(header) >= BGZIP_HEADER_SIZE and \
+        header[:2] == GZIP_MAGIC and \
+        header[3] & 4 != 0 and \
+        header[12:14] == b'BC'
+
+
+def get_block_size(header):
+    # BSIZE of the BC extra field is the size of the block minus 1
+    return int.from_bytes(header[16:18], 'little') + 1
+
+
+def decompress_block(block):
+    return zlib.decompress(block, 16 + zlib.MAX_WBITS)
+
+
+def open_data_file(file_name):
+    """
+    Opens a bedgraph file that may be compressed with gzip or bgzip
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the file
+
+    Returns
+    -------
+    file object
+        Binary file object with read and seek that gives the decompressed
+        bytes of the file
+    """
+    with open(file_name, 'rb') as data_file:
+        header = data_file.read(BGZIP_HEADER_SIZE)
+
+    if is_bgzip_header(header):
+        log.info(f"Detected bgzip compressed {file_name}")
+        return Bgzip_Reader(file_name)
+    if header[:2] == GZIP_MAGIC:
+        log.info(f"Detected gzip compressed {file_name}")
+        return gzip.open(file_name, 'rb')
+    return open(file_name, 'rb')
+
+
+class Bgzip_Reader:
+    """
+    Reads a bgzip compressed file. Its blocks can be decompressed on their
+    own, so a batch of them is decompressed by a pool of threads at a time.
+    """
+
+    def __init__(self, file_name, n_threads=None):
+        """
+        Parameters
+        ----------
+        file_name : str
+            Name of the bgzip file to read
+        n_threads : int
+            Number of threads that decompress the blocks (Default is the
+            number of cpus)
+        """
+        if n_threads is None:
+            n_threads = os.cpu_count()
+
+        self.file_name = file_name
+        self.compressed_file = open(file_name, 'rb')
+        self.executor = ThreadPoolExecutor(max_workers=n_threads)
+
+        # compressed bytes of a block that was only partly read
+        self.remainder = b''
+        # decompressed bytes not given out yet start at buffer_start
+        self.buffer = b''
+        self.buffer_start = 0
+
+        # compressed offset and decompressed start of every block, found
+        # the first time the file is seeked
+        self.block_offsets = None
+        self.block_starts = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.compressed_file.close()
+        self.executor.shutdown()
+
+    def fill_buffer(self):
+        """
+        Decompresses the next batch of blocks into the buffer
+
+        Returns
+        -------
+        bool
+            Whether there were blocks left to decompress
+        """
+        compressed = self.remainder + \
+            self.compressed_file.read(BGZIP_BATCH_SIZE)
+        if not compressed:
+            return False
+
+        blocks = []
+        offset = 0
+        view = memoryview(compressed)
+        while offset + BGZIP_HEADER_SIZE <= len(compressed):
+            block_size = get_block_size(compressed[offset:offset +
+                                                  BGZIP_HEADER_SIZE])
+            if offset + block_size > len(compressed):
+                break
+            blocks.append(view[offset:offset + block_size])
+            offset += block_size
+        self.remainder = compressed[offset:]
+
+        if not blocks:
+            error_msg = f"{self.file_name} ends in the middle of a block"
+            log.critical(error_msg)
+            raise RuntimeError(error_msg)
+
+        self.buffer = self.buffer[self.buffer_start:] + \
+            b''.join(self.executor.map(decompress_block, blocks))
+        self.buffer_start = 0
+        return True
+
+    def read(self, size=-1):
+        """
+        Parameters
+        ----------
+        size : int
+            Number of decompressed bytes to read (Default is the rest of the
+            file)
+
+        Returns
+        -------
+        bytes
+            Decompressed bytes, fewer than size only at the end of the file
+        """
+        while size < 0 or len(self.buffer) - self.buffer_start < size:
+            if not self.fill_buffer():
+                break
+
+        if size < 0:
+            size = len(self.buffer) - self.buffer_start
+        data = self.buffer[self.buffer_start:self.buffer_start + size]
+        self.buffer_start += len(data)
+        return data
+
+    def find_blocks(self):
+        """
+        Finds where every block starts in the compressed and decompressed file
+        from the block headers and the decompressed sizes in their trailers
+        """
+        self.block_offsets = []
+        self.block_starts = []
+        offset = 0
+        block_start = 0
+        while True:
+            self.compressed_file.seek(offset)
+            header = self.compressed_file.read(BGZIP_HEADER_SIZE)
+            if len(header) < BGZIP_HEADER_SIZE:
+                break
+
+            # the decompressed size is the last 4 bytes of the block
+            block_size = get_block_size(header)
+            self.compressed_file.seek(offset + block_size - 4)
+            self.block_offsets.append(offset)
+            self.block_starts.append(block_start)
+
+            offset += block_size
+            block_start += int.from_bytes(self.compressed_file.read(4),
+                                          'little')
+
+    def seek(self, position):
+        """
+        Parameters
+        ----------
+        position : int
+            Decompressed byte offset to read from next
+        """
+        if self.block_offsets is None:
+            self.find_blocks()
+
+        block_index = max(bisect.bisect_right(self.block_starts, position) - 1,
+                          0)
+        self.remainder = b''
+        self.buffer = b''
+        self.buffer_start = 0
+        if not self.block_offsets:
+            return
+
+        self.compressed_file.seek(self.block_offsets[block_index])
+        skipped = position - self.block_starts[block_index]
+        while len(self.buffer) < skipped:
+            if not self.fill_buffer():
+                break
+        self.buffer_start = min(skipped, len(self.buffer))
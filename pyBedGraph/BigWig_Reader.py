@@ -0,0 +1,396 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import mmap
+import os
+import zlib
+import logging
+
+log = logging.getLogger()
+
+BIGWIG_MAGIC = 0x888FFC26
+CHROM_TREE_MAGIC = 0x78CA8C91
+R_TREE_MAGIC = 0x2468ACE0
+
+HEADER_SIZE = 64
+ZOOM_HEADER_SIZE = 24
+CHROM_TREE_HEADER_SIZE = 32
+R_TREE_HEADER_SIZE = 48
+NODE_HEADER_SIZE = 4
+
+# types of the sections in a data block
+BEDGRAPH_SECTION = 1
+VARIABLE_STEP_SECTION = 2
+FIXED_STEP_SECTION = 3
+
+# data blocks decompressed together before their intervals are given out
+BLOCKS_PER_BATCH = 256
+
+
+def get_types(byte_order):
+    """
+    Parameters
+    ----------
+    byte_order : str
+        '<' for little endian files, '>' for big endian files
+
+    Returns
+    -------
+    dict
+        Numpy types of each record in a bigwig file with the given byte order
+    """
+    u2 = byte_order + 'u2'
+    u4 = byte_order + 'u4'
+    u8 = byte_order + 'u8'
+    f4 = byte_order + 'f4'
+    f8 = byte_order + 'f8'
+
+    return {
+        'header': np.dtype([
+            ('magic', u4), ('version', u2), ('zoom_levels', u2),
+            ('chrom_tree_offset', u8), ('data_offset', u8),
+            ('index_offset', u8), ('field_count', u2),
+            ('defined_field_count', u2), ('auto_sql_offset', u8),
+            ('total_summary_offset', u8), ('uncompress_buf_size', u4),
+            ('extension_offset', u8)]),
+        'total_summary': np.dtype([
+            ('bases_covered', u8), ('min', f8), ('max', f8), ('sum', f8),
+            ('sum_squares', f8)]),
+        'zoom_header': np.dtype([
+            ('reduction_level', u4), ('reserved', u4), ('data_offset', u8),
+            ('index_offset', u8)]),
+        'chrom_tree_header': np.dtype([
+            ('magic', u4), ('block_size', u4), ('key_size', u4),
+            ('value_size', u4), ('item_count', u8), ('reserved', u8)]),
+        'r_tree_header': np.dtype([
+            ('magic', u4), ('block_size', u4), ('item_count', u8),
+            ('start_chrom_id', u4), ('start_base', u4),
+            ('end_chrom_id', u4), ('end_base', u4), ('end_file_offset', u8),
+            ('items_per_slot', u4), ('reserved', u4)]),
+        'node_header': np.dtype([
+            ('is_leaf', 'u1'), ('reserved', 'u1'), ('count', u2)]),
+        'r_tree_leaf': np.dtype([
+            ('start_chrom_id', u4), ('start_base', u4),
+            ('end_chrom_id', u4), ('end_base', u4), ('data_offset', u8),
+            ('data_size', u8)]),
+        'r_tree_child': np.dtype([
+            ('start_chrom_id', u4), ('start_base', u4),
+            ('end_chrom_id', u4), ('end_base', u4), ('data_offset', u8)]),
+        'section_header': np.dtype([
+            ('chrom_id', u4), ('start', u4), ('end', u4), ('item_step', u4),
+            ('item_span', u4), ('type', 'u1'), ('reserved', 'u1'),
+            ('item_count', u2)]),
+        BEDGRAPH_SECTION: np.dtype([('start', u4), ('end', u4),
+                                    ('value', f4)]),
+        VARIABLE_STEP_SECTION: np.dtype([('start', u4), ('value', f4)]),
+        FIXED_STEP_SECTION: np.dtype(f4),
+        'zoom_record': np.dtype([
+            ('chrom_id', u4), ('start', u4), ('end', u4),
+            ('valid_count', u4), ('min', f4), ('max', f4), ('sum', f4),
+            ('sum_squares', f4)])
+    }
+
+
+class BigWig_Reader:
+    """
+    Reads the intervals of a bigwig file with numpy instead of pyBigWig.
+
+    The chromosome B+ tree is read when the file is opened. The data blocks
+    of a chromosome are found with the R-tree index, decompressed by a pool
+    of threads and decoded straight into numpy arrays.
+    """
+
+    def __init__(self, file_name, n_threads=None):
+        """
+        Parameters
+        ----------
+        file_name : str
+            Name of the bigwig file to read
+        n_threads : int
+            Number of threads that decompress the data blocks (Default is
+            the number of cpus)
+        """
+        self.file_name = file_name
+        if n_threads is None:
+            n_threads = os.cpu_count()
+        self.n_threads = n_threads
+
+        with open(file_name, 'rb') as data_file:
+            self.data = mmap.mmap(data_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+        if int.from_bytes(self.data[:4], 'little') == BIGWIG_MAGIC:
+            self.byte_order = '<'
+        elif int.from_bytes(self.data[:4], 'big') == BIGWIG_MAGIC:
+            self.byte_order = '>'
+        else:
+            self.data.close()
+            error_msg = f"{file_name} is not a bigwig file"
+            log.critical(error_msg)
+            raise RuntimeError(error_msg)
+        self.types = get_types(self.byte_order)
+
+        self.header = self.read_record('header', 0)
+        self.zoom_headers = np.frombuffer(
+            self.data, dtype=self.types['zoom_header'],
+            count=int(self.header['zoom_levels']), offset=HEADER_SIZE).copy()
+
+        # chromosome name -> (id of chromosome in file, size of chromosome)
+        self.chrom_ids = {}
+        self.read_chrom_tree()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def read_record(self, type_name, offset):
+        """
+        Parameters
+        ----------
+        type_name : str
+            Key of self.types for the record
+        offset : int
+            Byte offset of the record in the file
+
+        Returns
+        -------
+        numpy.void
+            Record read from the file
+        """
+        # copied so the file can be closed while the record is still used
+        return np.frombuffer(self.data, dtype=self.types[type_name], count=1,
+                             offset=offset).copy()[0]
+
+    def read_chrom_tree(self):
+        """
+        Reads the names, ids and sizes of every chromosome in the file
+        """
+        offset = int(self.header['chrom_tree_offset'])
+        tree_header = self.read_record('chrom_tree_header', offset)
+        if tree_header['magic'] != CHROM_TREE_MAGIC:
+            error_msg = f"{self.file_name} has a corrupted chromosome tree"
+            log.critical(error_msg)
+            raise RuntimeError(error_msg)
+
+        key_size = int(tree_header['key_size'])
+        leaf_type = np.dtype([('key', f'S{key_size}'),
+                              ('chrom_id', self.byte_order + 'u4'),
+                              ('chrom_size', self.byte_order + 'u4')])
+        child_type = np.dtype([('key', f'S{key_size}'),
+                               ('child_offset', self.byte_order + 'u8')])
+
+        node_offsets = [offset + CHROM_TREE_HEADER_SIZE]
+        while node_offsets:
+            node_offset = node_offsets.pop()
+            node_header = self.read_record('node_header', node_offset)
+            item_type = leaf_type if node_header['is_leaf'] else child_type
+            items = np.frombuffer(self.data, dtype=item_type,
+                                  count=int(node_header['count']),
+                                  offset=node_offset + NODE_HEADER_SIZE)
+
+            if not node_header['is_leaf']:
+                node_offsets.extend(int(x) for x in items['child_offset'])
+                continue
+
+            for key, chrom_id, chrom_size in items:
+                self.chrom_ids[key.decode()] = (int(chrom_id), int(chrom_size))
+
+    def chroms(self):
+        """
+        Returns
+        -------
+        dict
+            Size of each chromosome in the file
+        """
+        return {chrom_name: chrom_size for chrom_name, (_, chrom_size)
+                in self.chrom_ids.items()}
+
+    def find_blocks(self, index_offset, chrom_id):
+        """
+        Searches an R-tree index for the data blocks of a chromosome
+
+        Parameters
+        ----------
+        index_offset : int
+            Byte offset of the R-tree index in the file
+        chrom_id : int
+            Id of the chromosome in the file
+
+        Returns
+        -------
+        list
+            Byte offset and size of each block holding the chromosome, in the
+            order they are in the file
+        """
+        tree_header = self.read_record('r_tree_header', index_offset)
+        if tree_header['magic'] != R_TREE_MAGIC:
+            error_msg = f"{self.file_name} has a corrupted R-tree index"
+            log.critical(error_msg)
+            raise RuntimeError(error_msg)
+
+        blocks = []
+        node_offsets = [index_offset + R_TREE_HEADER_SIZE]
+        while node_offsets:
+            node_offset = node_offsets.pop()
+            node_header = self.read_record('node_header', node_offset)
+            is_leaf = node_header['is_leaf']
+            item_type = 'r_tree_leaf' if is_leaf else 'r_tree_child'
+            items = np.frombuffer(self.data, dtype=self.types[item_type],
+                                  count=int(node_header['count']),
+                                  offset=node_offset + NODE_HEADER_SIZE)
+
+            items = items[(items['start_chrom_id'] <= chrom_id) &
+                          (items['end_chrom_id'] >= chrom_id)]
+            if is_leaf:
+                blocks.extend(zip(items['data_offset'].tolist(),
+                                  items['data_size'].tolist()))
+            else:
+                node_offsets.extend(items['data_offset'].tolist())
+
+        blocks.sort()
+        return blocks
+
+    def read_blocks(self, blocks):
+        """
+        Decompresses data blocks a batch at a time with a pool of threads
+
+        Parameters
+        ----------
+        blocks : list
+            Byte offset and size of each block to read
+
+        Returns
+        -------
+        generator of list
+            Contents of the blocks of each batch
+        """
+        compressed = self.header['uncompress_buf_size'] > 0
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for batch_start in range(0, len(blocks), BLOCKS_PER_BATCH):
+                batch = [self.data[offset:offset + size] for offset, size in
+                         blocks[batch_start:batch_start + BLOCKS_PER_BATCH]]
+
+                if compressed:
+                    batch = list(executor.map(zlib.decompress, batch))
+                yield batch
+
+    def iter_intervals(self, chrom_name):
+        """
+        Reads the intervals of a chromosome in batches
+
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome to read
+
+        Returns
+        -------
+        generator of tuple
+            Start (uint32), end (uint32) and value (float32) arrays of the
+            intervals of each batch of data blocks, in order of start
+        """
+        if chrom_name not in self.chrom_ids:
+            return
+
+        chrom_id = self.chrom_ids[chrom_name][0]
+        blocks = self.find_blocks(int(self.header['index_offset']), chrom_id)
+
+        section_header_type = self.types['section_header']
+        for batch in self.read_blocks(blocks):
+            start_lists = []
+            end_lists = []
+            value_lists = []
+
+            for block in batch:
+                offset = 0
+                while offset < len(block):
+                    section = np.frombuffer(block, dtype=section_header_type,
+                                            count=1, offset=offset)[0]
+                    offset += section_header_type.itemsize
+
+                    section_type = int(section['type'])
+                    item_count = int(section['item_count'])
+                    items = np.frombuffer(block,
+                                          dtype=self.types[section_type],
+                                          count=item_count, offset=offset)
+                    offset += items.nbytes
+
+                    if section['chrom_id'] != chrom_id:
+                        continue
+
+                    if section_type == BEDGRAPH_SECTION:
+                        start_lists.append(items['start'])
+                        end_lists.append(items['end'])
+                        value_lists.append(items['value'])
+                    elif section_type == VARIABLE_STEP_SECTION:
+                        start_lists.append(items['start'])
+                        end_lists.append(items['start'] + section['item_span'])
+                        value_lists.append(items['value'])
+                    elif section_type == FIXED_STEP_SECTION:
+                        start_list = section['start'] + section['item_step'] * \
+                            np.arange(item_count, dtype=np.uint32)
+                        start_lists.append(start_list)
+                        end_lists.append(start_list + section['item_span'])
+                        value_lists.append(items)
+                    else:
+                        error_msg = f"{self.file_name} has a data section " \
+                                    f"of unknown type {section_type}"
+                        log.critical(error_msg)
+                        raise RuntimeError(error_msg)
+
+            if not value_lists:
+                continue
+
+            yield np.concatenate(start_lists).astype(np.uint32), \
+                np.concatenate(end_lists).astype(np.uint32), \
+                np.concatenate(value_lists).astype(np.float32)
+
+    def get_zoom_sizes(self):
+        """
+        Returns
+        -------
+        list
+            Number of base pairs summarized by each record of each zoom level,
+            smallest first
+        """
+        return [int(x) for x in self.zoom_headers['reduction_level']]
+
+    def read_zoom_records(self, chrom_name, zoom_index):
+        """
+        Reads the summaries of a chromosome from a zoom level
+
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome to read
+        zoom_index : int
+            Index of the zoom level in get_zoom_sizes()
+
+        Returns
+        -------
+        numpy array
+            Records of the zoom level in order of start, with fields start,
+            end, valid_count (number of covered base pairs), min, max, sum
+            and sum_squares
+        """
+        zoom_record_type = self.types['zoom_record']
+        records = [np.zeros(0, dtype=zoom_record_type)]
+
+        if chrom_name in self.chrom_ids:
+            chrom_id = self.chrom_ids[chrom_name][0]
+            index_offset = int(self.zoom_headers[zoom_index]['index_offset'])
+            blocks = self.find_blocks(index_offset, chrom_id)
+
+            for batch in self.read_blocks(blocks):
+                for block in batch:
+                    block_records = np.frombuffer(
+                        block, dtype=zoom_record_type,
+                        count=len(block) // zoom_record_type.itemsize)
+                    records.append(
+                        block_records[block_records['chrom_id'] == chrom_id])
+
+        return np.concatenate(records).astype(zoom_record_type.newbyteorder('='))
@@ -0,0 +1,508 @@
+from concurrent.futures import ThreadPoolExecutor
+from .BigWig_Reader import get_types, BIGWIG_MAGIC, CHROM_TREE_MAGIC, \
+    R_TREE_MAGIC, NODE_HEADER_SIZE, BEDGRAPH_SECTION
+from .ignore_missing_bp import load_bin_ranges
+from .util import sum_over_bins
+import numpy as np
+import os
+import zlib
+import logging
+
+log = logging.getLogger()
+
+BIGWIG_VERSION = 4
+ITEMS_PER_SLOT = 1024  # intervals or zoom records in each data block
+BLOCK_SIZE = 256  # children of each node of the index trees
+BLOCKS_PER_BATCH = 256  # data blocks compressed together
+
+TYPES = get_types('<')
+
+
+def get_tree_levels(numb_items):
+    """
+    Parameters
+    ----------
+    numb_items : int
+        Number of items in the leaves of a tree
+
+    Returns
+    -------
+    list
+        Number of children of each node of each level of a tree holding
+        BLOCK_SIZE children in each node, the leaves first and the root last
+    """
+    levels = []
+    numb_children = numb_items
+    while True:
+        numb_nodes = max((numb_children + BLOCK_SIZE - 1) // BLOCK_SIZE, 1)
+        counts = np.full(numb_nodes, BLOCK_SIZE, dtype=np.int64)
+        counts[-1] = numb_children - (numb_nodes - 1) * BLOCK_SIZE
+        levels.append(counts)
+
+        if numb_nodes == 1:
+            return levels
+        numb_children = numb_nodes
+
+
+def get_zoom_bins(chrom_size, zoom_size, start_list, end_list, values):
+    """
+    Parameters
+    ----------
+    chrom_size : int
+        Size of chromosome
+    zoom_size : int
+        Size of each bin
+    start_list : numpy array
+        Start of each interval
+    end_list : numpy array
+        End of each interval
+    values : numpy array
+        Value of each interval
+
+    Returns
+    -------
+    tuple
+        Covered size, sum, sum of squares, min and max of each zoom_size bin
+        from the start of the chromosome. Empty bins have a min of inf and a
+        max of -inf.
+    """
+    covered = sum_over_bins(start_list, end_list, np.ones(values.size),
+                            chrom_size, zoom_size)
+    sums = sum_over_bins(start_list, end_list, values, chrom_size, zoom_size)
+    square_sums = sum_over_bins(start_list, end_list, values * values,
+                                chrom_size, zoom_size)
+    mins, maxs = load_bin_ranges(values, chrom_size, start_list, end_list,
+                                 zoom_size)
+
+    empty = covered == 0
+    mins[empty] = np.inf
+    maxs[empty] = -np.inf
+    return covered, sums, square_sums, mins, maxs
+
+
+def merge_zoom_bins(zoom_bins, factor):
+    """
+    Parameters
+    ----------
+    zoom_bins : tuple
+        Bins from get_zoom_bins
+    factor : int
+        Number of bins to merge into each larger bin
+
+    Returns
+    -------
+    tuple
+        Covered size, sum, sum of squares, min and max of the larger bins
+    """
+    covered, sums, square_sums, mins, maxs = zoom_bins
+    merged_starts = np.arange(0, covered.size, factor)
+    return np.add.reduceat(covered, merged_starts), \
+        np.add.reduceat(sums, merged_starts), \
+        np.add.reduceat(square_sums, merged_starts), \
+        np.minimum.reduceat(mins, merged_starts), \
+        np.maximum.reduceat(maxs, merged_starts)
+
+
+def get_zoom_records(chrom_id, chrom_size, zoom_size, zoom_bins):
+    """
+    Parameters
+    ----------
+    chrom_id : int
+        Id of chromosome
+    chrom_size : int
+        Size of chromosome
+    zoom_size : int
+        Size of each bin
+    zoom_bins : tuple
+        Bins from get_zoom_bins or merge_zoom_bins
+
+    Returns
+    -------
+    numpy array
+        Zoom record of each bin that holds intervals
+    """
+    covered, sums, square_sums, mins, maxs = zoom_bins
+
+    kept = np.flatnonzero(covered > 0)
+    records = np.zeros(kept.size, dtype=TYPES['zoom_record'])
+    records['chrom_id'] = chrom_id
+    records['start'] = kept * zoom_size
+    records['end'] = np.minimum((kept + 1) * zoom_size, chrom_size)
+    records['valid_count'] = np.round(covered[kept])
+    records['min'] = mins[kept]
+    records['max'] = maxs[kept]
+    records['sum'] = sums[kept]
+    records['sum_squares'] = square_sums[kept]
+    return records
+
+
+class BigWig_Writer:
+    """
+    Writes intervals to a bigwig file a chromosome at a time.
+
+    Data blocks are compressed by a pool of threads and written as soon as a
+    chromosome is added. The zoom levels are summed from the intervals the
+    same way as the bins, compressed and kept until the file is closed, when
+    they are written along with the index trees and the header.
+    """
+
+    def __init__(self, file_name, chrom_sizes, zoom_sizes, n_threads=None):
+        """
+        Parameters
+        ----------
+        file_name : str
+            Name of the bigwig file to write
+        chrom_sizes : dict
+            Size of each chromosome to write, in the order they will be added
+        zoom_sizes : list
+            Number of base pairs summarized by each record of each zoom level,
+            smallest first
+        n_threads : int
+            Number of threads that compress the blocks (Default is the number
+            of cpus)
+        """
+        if n_threads is None:
+            n_threads = os.cpu_count()
+
+        self.file_name = file_name
+        self.chrom_sizes = chrom_sizes
+        self.chrom_ids = {chrom_name: chrom_id for chrom_id, chrom_name
+                          in enumerate(chrom_sizes)}
+        self.zoom_sizes = zoom_sizes
+        self.executor = ThreadPoolExecutor(max_workers=n_threads)
+
+        # R-tree leaf of each data block
+        self.data_leaves = []
+        # compressed blocks of each zoom level
+        self.zoom_blocks = [[] for _ in zoom_sizes]
+        self.max_block_size = 0
+
+        self.total_summary = np.zeros(1, dtype=TYPES['total_summary'])
+        self.total_summary['min'] = np.inf
+        self.total_summary['max'] = -np.inf
+
+        # the header, zoom headers and total summary are written once their
+        # offsets are known
+        self.out_file = open(file_name, 'wb')
+        self.out_file.write(bytes(
+            TYPES['header'].itemsize +
+            TYPES['zoom_header'].itemsize * len(zoom_sizes) +
+            TYPES['total_summary'].itemsize))
+
+        self.chrom_tree_offset = self.out_file.tell()
+        self.write_chrom_tree()
+
+        self.data_offset = self.out_file.tell()
+        self.out_file.write(bytes(8))  # number of data blocks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_tree(self, leaf_items, child_type, offset_field,
+                   get_child_items):
+        """
+        Writes the nodes of a tree from the root down to the leaves
+
+        Parameters
+        ----------
+        leaf_items : numpy array
+            Items of the leaves in order
+        child_type : numpy dtype
+            Type of the items of the nodes that are not leaves
+        offset_field : str
+            Field of child_type holding the byte offset of the child
+        get_child_items : Function
+            Given the first and last leaf item under each child, returns the
+            items pointing to the children with their offsets left to fill in
+        """
+        levels = get_tree_levels(leaf_items.size)
+        item_sizes = [leaf_items.dtype.itemsize] + \
+            [child_type.itemsize] * (len(levels) - 1)
+
+        # byte offset of each node when the root is written first
+        node_offsets = []
+        offset = self.out_file.tell()
+        for counts, item_size in reversed(list(zip(levels, item_sizes))):
+            node_sizes = NODE_HEADER_SIZE + counts * item_size
+            node_offsets.append(offset + np.cumsum(node_sizes) - node_sizes)
+            offset += int(node_sizes.sum())
+        node_offsets.reverse()
+
+        node_header = np.zeros(1, dtype=TYPES['node_header'])
+        for level in reversed(range(len(levels))):
+            if level == 0:
+                items = leaf_items
+            else:
+                # number of leaf items under each node of the level below
+                leaves_per_child = BLOCK_SIZE ** level
+                first = np.arange(levels[level - 1].size) * leaves_per_child
+                last = np.minimum(first + leaves_per_child,
+                                  leaf_items.size) - 1
+                items = get_child_items(first, last)
+                items[offset_field] = node_offsets[level - 1]
+
+            item_index = 0
+            node_header['is_leaf'] = level == 0
+            for count in levels[level]:
+                node_header['count'] = count
+                self.out_file.write(node_header.tobytes())
+                self.out_file.write(
+                    items[item_index:item_index + count].tobytes())
+                item_index += count
+
+    def write_chrom_tree(self):
+        """
+        Writes the B+ tree of the names, ids and sizes of the chromosomes
+        """
+        chrom_names = sorted(self.chrom_sizes)
+        encoded_names = [chrom_name.encode() for chrom_name in chrom_names]
+        key_size = max([len(name) for name in encoded_names], default=1)
+
+        leaf_items = np.zeros(len(chrom_names), dtype=[
+            ('key', f'S{key_size}'), ('chrom_id', '<u4'),
+            ('chrom_size', '<u4')])
+        leaf_items['key'] = encoded_names
+        leaf_items['chrom_id'] = [self.chrom_ids[chrom_name]
+                                  for chrom_name in chrom_names]
+        leaf_items['chrom_size'] = [self.chrom_sizes[chrom_name]
+                                    for chrom_name in chrom_names]
+        child_type = np.dtype([('key', f'S{key_size}'),
+                               ('child_offset', '<u8')])
+
+        tree_header = np.zeros(1, dtype=TYPES['chrom_tree_header'])
+        tree_header['magic'] = CHROM_TREE_MAGIC
+        tree_header['block_size'] = BLOCK_SIZE
+        tree_header['key_size'] = key_size
+        tree_header['value_size'] = 8
+        tree_header['item_count'] = len(chrom_names)
+        self.out_file.write(tree_header.tobytes())
+
+        def get_child_items(first, last):
+            child_items = np.zeros(first.size, dtype=child_type)
+            child_items['key'] = leaf_items['key'][first]
+            return child_items
+
+        self.write_tree(leaf_items, child_type, 'child_offset',
+                        get_child_items)
+
+    def write_r_tree(self, leaves, end_file_offset):
+        """
+        Writes the R-tree index of data blocks
+
+        Parameters
+        ----------
+        leaves : list
+            Chromosome id, start, end, byte offset and size of each block in
+            order
+        end_file_offset : int
+            Byte offset of the end of the blocks
+        """
+        leaf_type = TYPES['r_tree_leaf']
+        leaf_items = np.zeros(len(leaves), dtype=leaf_type)
+        if leaves:
+            chrom_ids, starts, ends, offsets, sizes = zip(*leaves)
+            leaf_items['start_chrom_id'] = chrom_ids
+            leaf_items['start_base'] = starts
+            leaf_items['end_chrom_id'] = chrom_ids
+            leaf_items['end_base'] = ends
+            leaf_items['data_offset'] = offsets
+            leaf_items['data_size'] = sizes
+
+        tree_header = np.zeros(1, dtype=TYPES['r_tree_header'])
+        tree_header['magic'] = R_TREE_MAGIC
+        tree_header['block_size'] = BLOCK_SIZE
+        tree_header['item_count'] = len(leaves)
+        if leaves:
+            for field in ['start_chrom_id', 'start_base']:
+                tree_header[field] = leaf_items[field][0]
+            for field in ['end_chrom_id', 'end_base']:
+                tree_header[field] = leaf_items[field][-1]
+        tree_header['end_file_offset'] = end_file_offset
+        tree_header['items_per_slot'] = ITEMS_PER_SLOT
+        self.out_file.write(tree_header.tobytes())
+
+        child_type = TYPES['r_tree_child']
+
+        def get_child_items(first, last):
+            child_items = np.zeros(first.size, dtype=child_type)
+            for field in ['start_chrom_id', 'start_base']:
+                child_items[field] = leaf_items[field][first]
+            for field in ['end_chrom_id', 'end_base']:
+                child_items[field] = leaf_items[field][last]
+            return child_items
+
+        self.write_tree(leaf_items, child_type, 'data_offset', get_child_items)
+
+    def compress_blocks(self, chrom_id, items, start_list, end_list,
+                        section_type=None):
+        """
+        Splits items into blocks of ITEMS_PER_SLOT and compresses them
+
+        Parameters
+        ----------
+        chrom_id : int
+            Id of the chromosome of the items
+        items : numpy array
+            Items to write in order
+        start_list : numpy array
+            Start of each item
+        end_list : numpy array
+            End of each item
+        section_type : int
+            Type of data section to put before the items of each block, None
+            for zoom records that do not have one
+
+        Returns
+        -------
+        generator of list
+            Chromosome id, start, end and compressed bytes of each block of
+            each batch of blocks
+        """
+        block_starts = list(range(0, items.size, ITEMS_PER_SLOT))
+        section_header = np.zeros(1, dtype=TYPES['section_header'])
+        section_header['chrom_id'] = chrom_id
+        section_header['type'] = section_type or 0
+
+        for batch_start in range(0, len(block_starts), BLOCKS_PER_BATCH):
+            blocks = []
+            ranges = []
+            for block_start in \
+                    block_starts[batch_start:batch_start + BLOCKS_PER_BATCH]:
+                block_end = min(block_start + ITEMS_PER_SLOT, items.size)
+                block = items[block_start:block_end].tobytes()
+                ranges.append((int(start_list[block_start]),
+                               int(end_list[block_end - 1])))
+
+                if section_type is not None:
+                    section_header['start'], section_header['end'] = \
+                        ranges[-1]
+                    section_header['item_count'] = block_end - block_start
+                    block = section_header.tobytes() + block
+
+                self.max_block_size = max(self.max_block_size, len(block))
+                blocks.append(block)
+
+            yield [(chrom_id, block_start, block_end, block) for
+                   (block_start, block_end), block in
+                   zip(ranges, self.executor.map(zlib.compress, blocks))]
+
+    def add_chrom(self, chrom_name, start_list, end_list, value_list):
+        """
+        Writes the intervals of a chromosome and sums its zoom levels
+
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome
+        start_list : numpy array
+            Start of each interval, in order
+        end_list : numpy array
+            End of each interval
+        value_list : numpy array
+            Value of each interval
+        """
+        chrom_id = self.chrom_ids[chrom_name]
+        chrom_size = self.chrom_sizes[chrom_name]
+        if value_list.size == 0:
+            return
+
+        items = np.empty(value_list.size, dtype=TYPES[BEDGRAPH_SECTION])
+        items['start'] = start_list
+        items['end'] = end_list
+        items['value'] = value_list
+
+        values = items['value'].astype(np.float64)
+        interval_sizes = end_list.astype(np.int64) - start_list
+        self.total_summary['bases_covered'] += int(interval_sizes.sum())
+        self.total_summary['min'] = min(self.total_summary['min'][0],
+                                        values.min())
+        self.total_summary['max'] = max(self.total_summary['max'][0],
+                                        values.max())
+        self.total_summary['sum'] += np.sum(values * interval_sizes)
+        self.total_summary['sum_squares'] += \
+            np.sum(values * values * interval_sizes)
+
+        for batch in self.compress_blocks(chrom_id, items, start_list,
+                                          end_list, BEDGRAPH_SECTION):
+            for block_chrom_id, block_start, block_end, block in batch:
+                self.data_leaves.append((block_chrom_id, block_start,
+                                         block_end, self.out_file.tell(),
+                                         len(block)))
+                self.out_file.write(block)
+
+        # each zoom level is summed from the level below when its size is a
+        # multiple of it, like the levels of the bin pyramid
+        zoom_bins = None
+        for zoom_index, zoom_size in enumerate(self.zoom_sizes):
+            if zoom_index > 0 and \
+                    zoom_size % self.zoom_sizes[zoom_index - 1] == 0:
+                zoom_bins = merge_zoom_bins(
+                    zoom_bins, zoom_size // self.zoom_sizes[zoom_index - 1])
+            else:
+                zoom_bins = get_zoom_bins(chrom_size, zoom_size,
+                                          items['start'], items['end'],
+                                          values)
+
+            records = get_zoom_records(chrom_id, chrom_size, zoom_size,
+                                       zoom_bins)
+            for batch in self.compress_blocks(chrom_id, records,
+                                              records['start'],
+                                              records['end']):
+                self.zoom_blocks[zoom_index].extend(batch)
+
+    def close(self):
+        """
+        Writes the indexes, the zoom levels and the header
+        """
+        if self.out_file.closed:
+            return
+
+        index_offset = self.out_file.tell()
+        self.out_file.seek(self.data_offset)
+        self.out_file.write(np.uint64(len(self.data_leaves)).tobytes())
+        self.out_file.seek(index_offset)
+        self.write_r_tree(self.data_leaves, index_offset)
+
+        zoom_headers = np.zeros(len(self.zoom_sizes),
+                                dtype=TYPES['zoom_header'])
+        for zoom_index, zoom_size in enumerate(self.zoom_sizes):
+            zoom_headers[zoom_index]['reduction_level'] = zoom_size
+            zoom_headers[zoom_index]['data_offset'] = self.out_file.tell()
+
+            zoom_blocks = self.zoom_blocks[zoom_index]
+            self.out_file.write(np.uint32(len(zoom_blocks)).tobytes())
+            leaves = []
+            for chrom_id, block_start, block_end, block in zoom_blocks:
+                leaves.append((chrom_id, block_start, block_end,
+                               self.out_file.tell(), len(block)))
+                self.out_file.write(block)
+            self.zoom_blocks[zoom_index] = None
+
+            zoom_index_offset = self.out_file.tell()
+            zoom_headers[zoom_index]['index_offset'] = zoom_index_offset
+            self.write_r_tree(leaves, zoom_index_offset)
+
+        header = np.zeros(1, dtype=TYPES['header'])
+        header['magic'] = BIGWIG_MAGIC
+        header['version'] = BIGWIG_VERSION
+        header['zoom_levels'] = len(self.zoom_sizes)
+        header['chrom_tree_offset'] = self.chrom_tree_offset
+        header['data_offset'] = self.data_offset
+        header['index_offset'] = index_offset
+        header['total_summary_offset'] = \
+            header.itemsize + zoom_headers.nbytes
+        header['uncompress_buf_size'] = self.max_block_size
+
+        if self.total_summary['bases_covered'] == 0:
+            self.total_summary['min'] = 0
+            self.total_summary['max'] = 0
+
+        self.out_file.seek(0)
+        self.out_file.write(header.tobytes())
+        self.out_file.write(zoom_headers.tobytes())
+        self.out_file.write(self.total_summary.tobytes())
+        self.out_file.close()
+        self.executor.shutdown()
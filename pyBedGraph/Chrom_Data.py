@@ -1,7 +1,8 @@
 import math
+import os
 import logging
 from .ignore_missing_bp import *
-from .include_missing_bp import get_max_indexes
+from .include_missing_bp import get_max_indexes, get_range_max_indexes
 from .util import *
 
 log = logging.getLogger()
@@ -11,9 +12,89 @@ START_INDEX = -3
 END_INDEX = -2
 VALUE_INDEX = -1
 
-MAX_NUMB_BIN_LIST = 1
 MIN_BIN_SIZE = 2
 
+# length of the searches the bin size is picked for when given a maximum error
+DEFAULT_SEARCH_SIZE = 1000
+
+# number of intervals the buffers can hold before they first need to grow
+INITIAL_CAPACITY = 1024
+
+# approx statistics only found from a bigwig zoom level and their methods
+ZOOM_STATS = {
+    'approx_max': 'get_zoom_maxs',
+    'approx_min': 'get_zoom_mins',
+    'approx_std': 'get_zoom_stds'
+}
+
+# statistics named quantile_<q> find the q quantile, q from 0 to 1
+QUANTILE_PREFIX = 'quantile_'
+
+
+def parse_quantile(stat):
+    """
+    Parameters
+    ----------
+    stat : str
+        Name of statistic
+
+    Returns
+    -------
+    float
+        Quantile found by the statistic, None if it does not find a quantile
+    """
+    if stat == 'median':
+        return 0.5
+
+    if not stat.startswith(QUANTILE_PREFIX):
+        return None
+
+    try:
+        quantile = float(stat[len(QUANTILE_PREFIX):])
+    except ValueError:
+        return None
+
+    if not 0 <= quantile <= 1:
+        return None
+    return quantile
+
+
+def save_array(file_name, array):
+    """
+    Saves an array as a .npy file. The array is written to a temporary file
+    that then replaces file_name, so processes that memory-mapped an older
+    version of the file keep reading complete data.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the .npy file to write
+    array : numpy array
+        Array to save
+    """
+    temp_file_name = f"{file_name}.{os.getpid()}.tmp"
+    with open(temp_file_name, 'wb') as out_file:
+        np.save(out_file, array)
+    os.replace(temp_file_name, file_name)
+
+
+def get_bin_level_offsets(bin_levels):
+    """
+    Parameters
+    ----------
+    bin_levels : list of numpy arrays
+        Bins of each level of the pyramid, the smallest bins first
+
+    Returns
+    -------
+    numpy array
+        Index where each level starts once the levels are concatenated,
+        followed by the total number of bins
+    """
+    bin_level_offsets = np.zeros(len(bin_levels) + 1, dtype=np.int64)
+    np.cumsum([bins.size for bins in bin_levels], out=bin_level_offsets[1:])
+    return bin_level_offsets
+
 
 class Chrom_Data:
     """
@@ -21,7 +102,8 @@ class Chrom_Data:
     missing base pairs when finding statistics.
     """
 
-    def __init__(self, name, size, min_value, debug):
+    def __init__(self, name, size, min_value, debug, sparse_index=False,
+                 value_type='float64'):
         """
         Parameters
         ----------
@@ -32,13 +114,22 @@ class Chrom_Data:
         min_value : int
             Minimum value of interval to keep
         debug : bool
+        sparse_index : bool
+            Whether to binary search the intervals instead of building an
+            index array with an entry for every base pair (Default is False)
+        value_type : str
+            Type to store the values of the intervals as, 'float64' or
+            'float32' (Default is 'float64')
         """
         self.name = name
         self.size = size
         self.min_value = min_value
         self.debug = debug
+        self.sparse_index = sparse_index
+        self.value_type = np.dtype(value_type)
 
-        self.loaded_chrom = False
+        # nothing needs to be loaded to binary search the intervals
+        self.loaded_chrom = sparse_index
         self.index_list = None
         self.total_coverage = 0
         self.num_samples = 0
@@ -47,26 +138,93 @@ class Chrom_Data:
         self.avg_interval_value = -1
         self.avg_interval_size = -1
 
-        # Max possible number of intervals is length of chromosome
-        # starting length is the size of chromosome
-        # later shorten to save memory
-        self.value_map = np.zeros(size, dtype=np.float64)
+        # Number of intervals is not known yet so the buffers double in size
+        # when full and are shortened once all intervals are added
+        self.value_map = np.zeros(INITIAL_CAPACITY, dtype=self.value_type)
         self.intervals = [
-            np.zeros(size, dtype=np.uint32),
-            np.zeros(size, dtype=np.uint32)
+            np.zeros(INITIAL_CAPACITY, dtype=np.uint32),
+            np.zeros(INITIAL_CAPACITY, dtype=np.uint32)
         ]
         self.num_intervals = 0  # number of intervals in bedGraph file
         self.max_index = 0  # end of last interval in bedGraph file
 
+        # cumulative value * size and covered size of the intervals for
+        # constant time sums over a range of intervals, and a table of the
+        # moments of blocks of intervals for their variance
+        self.loaded_prefix_sums = False
+        self.value_sums = None
+        self.length_sums = None
+        self.moment_table = None
+
+        # sparse tables over blocks of value_map for range max and min
+        self.loaded_range_index = False
+        self.max_table = None
+        self.min_table = None
+
+        # wavelet matrix over the ranks of the values for weighted quantiles
+        self.loaded_quantile_index = False
+        self.quantile_values = None
+        self.value_ranks = None
+        self.zeros_before = None
+        self.left_weights = None
+        self.size_sums = None
+
         self.loaded_bins = False
         self.max_bin_size = None
         self.min_bin_size = None
+        # every level of the bin pyramid in one array, the smallest bins first
+        self.bins = None
+        self.bins_coverage = None
+        self.bin_level_offsets = None
+        # smallest and largest value in each of the smallest bins
+        self.bin_mins = None
+        self.bin_maxs = None
+        # approx_mean finds searches exactly when their relative error
+        # could be larger than this
+        self.max_error = None
+
+        # summaries from a zoom level of a bigwig file, the approx statistics
+        # are found from these when bins are not loaded
+        self.loaded_zoom = False
+        self.zoom_size = None
+        self.zoom_starts = None
+        self.zoom_ends = None
+        self.zoom_mins = None
+        self.zoom_maxs = None
+        # cumulative covered size, sum and sum of squares of the records
+        self.zoom_sums = None
         self.bins_list = []
         self.bins_list_coverages = []
         self.bin_list_numb = 0
 
         log.info(f"Reading in {name} ...")
 
+    def reserve(self, num_intervals):
+        """
+        Makes sure the buffers can hold the given number of intervals, at
+        least doubling their size whenever they have to grow.
+
+        Parameters
+        ----------
+        num_intervals : int
+            Number of intervals the buffers need to hold
+        """
+        capacity = self.value_map.size
+        if num_intervals <= capacity:
+            return
+
+        new_capacity = max(num_intervals, 2 * capacity)
+
+        value_map = np.zeros(new_capacity, dtype=self.value_type)
+        value_map[:self.num_intervals] = self.value_map[:self.num_intervals]
+        self.value_map = value_map
+
+        for i in range(2):
+            interval_list = np.zeros(new_capacity, dtype=np.uint32)
+            interval_list[:self.num_intervals] = \
+                self.intervals[i][:self.num_intervals]
+            self.intervals[i] = interval_list
+
     def add_data(self, data):
         """
         Adds the interval to this chromosome.
@@ -85,6 +243,9 @@ class Chrom_Data:
         start = int(data[START_INDEX])
         end = int(data[END_INDEX])
 
+        if self.num_intervals == self.value_map.size:
+            self.reserve(self.num_intervals + 1)
+
         self.intervals[0][self.num_intervals] = start
         self.intervals[1][self.num_intervals] = end
         self.value_map[self.num_intervals] = value
@@ -95,63 +256,57 @@ class Chrom_Data:
             self.num_samples += value * (end - start)
             self.total_coverage += (end - start)
 
-    def add_bigwig_data(self, interval_data_list):
+    def add_data_arrays(self, start_list, end_list, value_list):
         """
-        Adds the intervals from pyBigWig to this chromosome.
+        Adds many intervals to this chromosome at once.
 
         Parameters
         ----------
-        interval_data_list : list of lists of length=3
-            The output from calling pyBigWig.intervals()
-        """
-
-        # value = data[VALUE_INDEX]
-        #
-        # if value < self.min_value:
-        #     return
-        #
-        # start = data[START_INDEX]
-        # end = data[END_INDEX]
-        #
-        # self.intervals[0][self.num_intervals] = start
-        # self.intervals[1][self.num_intervals] = end
-        # self.value_map[self.num_intervals] = value
-        #
-        # self.num_intervals += 1
-        #
-        # if self.debug:
-        #     interval_size = end - start
-        #     self.num_samples += value * interval_size
-        #     self.total_coverage += interval_size
-
-        interval_data_list = np.array(interval_data_list).T
-
-        self.intervals[0] = np.array(interval_data_list[0], dtype=np.uint32)
-        self.intervals[1] = np.array(interval_data_list[1], dtype=np.uint32)
-        self.value_map = np.array(interval_data_list[2], dtype=np.float64)
+        start_list : numpy array
+            Start of each interval
+        end_list : numpy array
+            End of each interval
+        value_list : numpy array
+            Value of each interval
+        """
 
-        self.num_intervals = self.value_map.size
+        too_small = value_list < self.min_value
+        if too_small.any():
+            keep = ~too_small
+            start_list = start_list[keep]
+            end_list = end_list[keep]
+            value_list = value_list[keep]
+
+        new_num_intervals = self.num_intervals + value_list.size
+        self.reserve(new_num_intervals)
+
+        self.intervals[0][self.num_intervals:new_num_intervals] = start_list
+        self.intervals[1][self.num_intervals:new_num_intervals] = end_list
+        self.value_map[self.num_intervals:new_num_intervals] = value_list
+
+        self.num_intervals = new_num_intervals
 
         if self.debug:
-            for i in range(self.num_intervals):
-                interval_size = self.intervals[1][i] - self.intervals[0][i]
-                self.num_samples += self.value_map[i] * interval_size
-                self.total_coverage += interval_size
+            interval_sizes = end_list.astype(np.int64) - start_list
+            self.num_samples += np.sum(value_list * interval_sizes)
+            self.total_coverage += np.sum(interval_sizes)
 
     def trim_extra_space(self):
         """
-        Since the number of intervals is not known at initialization time, a
-        large numpy array was created to contain the max possible number of
-        arrays. This will free unused memory in the arrays.
+        Since the number of intervals is not known at initialization time, the
+        buffers were grown as intervals were added. This will free unused
+        memory in the arrays.
 
         Also records some statistics regarding the chromosome.
 
         Will raise an error if an interval end index is greater than stated
         chromosome size.
         """
-        self.value_map = self.value_map[:self.num_intervals]
-        self.intervals[0] = self.intervals[0][:self.num_intervals]
-        self.intervals[1] = self.intervals[1][:self.num_intervals]
+        # copy so the unused part of the buffers can be freed
+        if self.value_map.size != self.num_intervals:
+            self.value_map = self.value_map[:self.num_intervals].copy()
+            self.intervals[0] = self.intervals[0][:self.num_intervals].copy()
+            self.intervals[1] = self.intervals[1][:self.num_intervals].copy()
 
         self.max_index = self.intervals[1][-1]
 
@@ -192,6 +347,17 @@ class Chrom_Data:
             if self.index_list is not None:
                 self.index_list[start:end] = -1
 
+        # indexes built from the old values are built again from the new ones
+        if self.loaded_prefix_sums:
+            self.free_prefix_sums()
+            self.load_prefix_sums()
+        if self.loaded_range_index:
+            self.free_range_index()
+            self.load_range_index()
+        if self.loaded_quantile_index:
+            self.free_quantile_index()
+            self.load_quantile_index()
+
     # assume that missing space in bedGraph file is different from value of 0
     def initialize_index_array(self):
         """
@@ -208,6 +374,12 @@ class Chrom_Data:
 
         log.info(f"Loading {self.name} ...")
 
+        if self.sparse_index:
+            log.info(f"{self.name} searches its intervals without an index "
+                     f"array")
+            self.loaded_chrom = True
+            return
+
         if self.loaded_chrom:
             log.warning(f"{self.name} is already loaded")
             return
@@ -226,13 +398,335 @@ class Chrom_Data:
         Frees the memory used by the index list for this chromosome
         """
         self.index_list = None
-        self.loaded_chrom = False
+        self.loaded_chrom = self.sparse_index
         log.info(f"Freed memory for {self.name}'s index_list")
 
+    def get_covered_sizes(self):
+        """
+        Returns
+        -------
+        numpy array
+            Number of base pairs each interval adds to the coverage
+        """
+        return self.intervals[1].astype(np.int64) - self.intervals[0]
+
+    def get_value_moments(self):
+        """
+        Returns
+        -------
+        tuple
+            Mean and standard deviation of the values of the covered base
+            pairs
+        """
+        interval_sizes = self.intervals[1].astype(np.int64) - self.intervals[0]
+        if interval_sizes.sum() == 0:
+            return 0, 0
+
+        mean = np.average(self.value_map, weights=interval_sizes)
+        variance = np.average((self.value_map - mean) ** 2,
+                              weights=interval_sizes)
+        return mean, math.sqrt(variance)
+
+    def get_error_bin_size(self, max_error, search_size=DEFAULT_SEARCH_SIZE):
+        """
+        Picks the size of the smallest bins from the values of this chromosome
+        so that approx_mean of searches of search_size base pairs is usually
+        within max_error. Each end of a search is off by at most part of a
+        bin, and the values in a bin usually spread over about a standard
+        deviation on each side of the mean.
+
+        Parameters
+        ----------
+        max_error : float
+            Largest relative error of approx_mean to aim for
+        search_size : int
+            Typical length of a search (Default is DEFAULT_SEARCH_SIZE)
+
+        Returns
+        -------
+        int
+            Power of two size of the smallest bins, at least MIN_BIN_SIZE
+        """
+        mean, std = self.get_value_moments()
+        bin_size = self.size
+        if std > 0:
+            bin_size = max_error * search_size * abs(mean) / (2 * std)
+
+        if bin_size < MIN_BIN_SIZE:
+            return MIN_BIN_SIZE
+        return 1 << int(math.log2(min(bin_size, max(self.size, MIN_BIN_SIZE))))
+
+    def load_prefix_sums(self):
+        """
+        Populate the prefix sums of the intervals so that the exact mean, sum
+        and coverage of a search only need two binary searches, and its std
+        and variance only a few intervals at each end and two table entries
+        """
+
+        log.info(f"Loading prefix sums for {self.name} ...")
+
+        if self.loaded_prefix_sums:
+            log.warning(f"Prefix sums for {self.name} are already loaded")
+            return
+
+        interval_sizes = self.intervals[1].astype(np.int64) - self.intervals[0]
+        weighted_values = self.value_map * interval_sizes
+
+        self.value_sums = np.zeros(self.num_intervals + 1, dtype=np.float64)
+        np.cumsum(weighted_values, out=self.value_sums[1:])
+
+        self.length_sums = np.zeros(self.num_intervals + 1, dtype=np.int64)
+        np.cumsum(self.get_covered_sizes(), out=self.length_sums[1:])
+
+        # differences of the sums of squares lose the variance of values far
+        # from 0, so it is merged from the moments of blocks of intervals
+        self.moment_table = build_moment_table(self.value_map,
+                                               self.intervals[0],
+                                               self.intervals[1])
+
+        self.loaded_prefix_sums = True
+
+    def free_prefix_sums(self):
+        """
+        Frees the memory used by the prefix sums for this chromosome
+        """
+        self.value_sums = None
+        self.length_sums = None
+        self.moment_table = None
+        self.loaded_prefix_sums = False
+        log.info(f"Freed memory for {self.name}'s prefix sums")
+
+    def load_range_index(self):
+        """
+        Populate sparse tables so that the max, min and max_index of a search
+        take constant time no matter how many intervals it covers
+        """
+
+        log.info(f"Loading range index for {self.name} ...")
+
+        if self.loaded_range_index:
+            log.warning(f"Range index for {self.name} is already loaded")
+            return
+
+        self.max_table = build_range_table(self.value_map, True)
+        self.min_table = build_range_table(self.value_map, False)
+
+        self.loaded_range_index = True
+
+    def free_range_index(self):
+        """
+        Frees the memory used by the range index for this chromosome
+        """
+        self.max_table = None
+        self.min_table = None
+        self.loaded_range_index = False
+        log.info(f"Freed memory for {self.name}'s range index")
+
+    def get_quantile_values(self):
+        """
+        Returns
+        -------
+        numpy array
+            Sorted distinct values a quantile can be
+        """
+        return np.unique(self.value_map).astype(np.float64)
+
+    def load_quantile_index(self):
+        """
+        Populate a wavelet matrix over the values of the intervals so that the
+        median and quantiles of a search take time in proportion to the log
+        of the number of distinct values no matter how many intervals it
+        covers. Uses 12 bytes per interval for every bit of the rank of a
+        value.
+        """
+
+        log.info(f"Loading quantile index for {self.name} ...")
+
+        if self.loaded_quantile_index:
+            log.warning(f"Quantile index for {self.name} is already loaded")
+            return
+
+        self.quantile_values = self.get_quantile_values()
+        self.value_ranks = np.searchsorted(self.quantile_values,
+                                           self.value_map).astype(np.int64)
+        numb_levels = max(1, int(self.quantile_values.size - 1).bit_length())
+
+        interval_sizes = self.intervals[1].astype(np.int64) - self.intervals[0]
+        self.zeros_before, self.left_weights = build_quantile_index(
+            self.value_ranks, interval_sizes, numb_levels)
+
+        self.size_sums = np.zeros(self.num_intervals + 1, dtype=np.int64)
+        np.cumsum(interval_sizes, out=self.size_sums[1:])
+
+        self.loaded_quantile_index = True
+
+    def free_quantile_index(self):
+        """
+        Frees the memory used by the quantile index for this chromosome
+        """
+        self.quantile_values = None
+        self.value_ranks = None
+        self.zeros_before = None
+        self.left_weights = None
+        self.size_sums = None
+        self.loaded_quantile_index = False
+        log.info(f"Freed memory for {self.name}'s quantile index")
+
+    def get_memory_usage(self):
+        """
+        Returns
+        -------
+        dict
+            Number of bytes used by the intervals and each loaded index of
+            this chromosome
+        """
+        memory_usage = {
+            'intervals': self.intervals[0].nbytes + self.intervals[1].nbytes +
+                         self.value_map.nbytes,
+            'index_list': 0,
+            'prefix_sums': 0,
+            'range_index': 0,
+            'quantile_index': 0,
+            'bins': 0,
+            'zoom': 0
+        }
+
+        if self.index_list is not None:
+            memory_usage['index_list'] = self.index_list.nbytes
+
+        if self.loaded_prefix_sums:
+            memory_usage['prefix_sums'] = self.value_sums.nbytes + \
+                self.length_sums.nbytes + self.moment_table.nbytes
+
+        if self.loaded_range_index:
+            memory_usage['range_index'] = self.max_table.nbytes + \
+                self.min_table.nbytes
+
+        if self.loaded_quantile_index:
+            memory_usage['quantile_index'] = sum(array.nbytes for array in [
+                self.quantile_values, self.value_ranks, self.zeros_before,
+                self.left_weights, self.size_sums])
+
+        if self.loaded_bins:
+            memory_usage['bins'] = self.bins.nbytes + \
+                self.bin_level_offsets.nbytes + self.bin_mins.nbytes + \
+                self.bin_maxs.nbytes
+            if self.bins_coverage is not None:
+                memory_usage['bins'] += self.bins_coverage.nbytes
+
+        if self.loaded_zoom:
+            memory_usage['zoom'] = sum(array.nbytes for array in [
+                self.zoom_starts, self.zoom_ends, self.zoom_mins,
+                self.zoom_maxs, self.zoom_sums])
+
+        return memory_usage
+
+    def save_cache(self, cache_dir, file_prefix, save_index_list=False,
+                   save_bins=False):
+        """
+        Saves the intervals of this chromosome as .npy files in cache_dir
+
+        Parameters
+        ----------
+        cache_dir : str
+            Directory to save the arrays in
+        file_prefix : str
+            Start of the file name of every saved array
+        save_index_list : bool
+            Whether to also save the index array if it is loaded
+            (Default is False)
+        save_bins : bool
+            Whether to also save the bins if they are loaded (Default is False)
+
+        Returns
+        -------
+        dict
+            Description of this chromosome and its saved files for the cache
+            manifest
+        """
+        arrays = {
+            'start_list': self.intervals[0],
+            'end_list': self.intervals[1],
+            'value_map': self.value_map
+        }
+        chrom_manifest = {
+            'max_index': int(self.max_index),
+            'files': {}
+        }
+
+        if save_index_list and self.index_list is not None:
+            arrays['index_list'] = self.index_list
+
+        if save_bins and self.loaded_bins:
+            chrom_manifest['max_bin_size'] = self.max_bin_size
+            chrom_manifest['min_bin_size'] = self.min_bin_size
+            chrom_manifest['max_error'] = self.max_error
+            arrays['bins'] = self.bins
+            arrays['bin_level_offsets'] = self.bin_level_offsets
+            arrays['bin_mins'] = self.bin_mins
+            arrays['bin_maxs'] = self.bin_maxs
+            if self.bins_coverage is not None:
+                arrays['bins_coverage'] = self.bins_coverage
+
+        for array_name, array in arrays.items():
+            file_name = f"{file_prefix}.{array_name}.npy"
+            save_array(os.path.join(cache_dir, file_name), array)
+            chrom_manifest['files'][array_name] = file_name
+
+        return chrom_manifest
+
+    def load_cache(self, cache_dir, chrom_manifest, load_bins=True):
+        """
+        Memory-maps the arrays saved by save_cache instead of reading in the
+        intervals. The arrays are shared with every other process that maps
+        the same files until they are changed, as by remove_intervals, and
+        changes are never written back to the files.
+
+        Parameters
+        ----------
+        cache_dir : str
+            Directory the arrays were saved in
+        chrom_manifest : dict
+            Description of the saved files returned by save_cache
+        load_bins : bool
+            Whether to use the saved bins (Default is True)
+        """
+        files = chrom_manifest['files']
+
+        def load_array(array_name):
+            return np.load(os.path.join(cache_dir, files[array_name]),
+                           mmap_mode='c')
+
+        self.intervals = [load_array('start_list'), load_array('end_list')]
+        self.value_map = load_array('value_map')
+        self.num_intervals = self.value_map.size
+        self.max_index = chrom_manifest['max_index']
+
+        if 'index_list' in files and not self.sparse_index:
+            self.index_list = load_array('index_list')
+            self.loaded_chrom = True
+
+        if load_bins and 'bins' in files:
+            self.max_bin_size = chrom_manifest['max_bin_size']
+            self.min_bin_size = chrom_manifest['min_bin_size']
+            self.max_error = chrom_manifest['max_error']
+            bins_coverage = None
+            if 'bins_coverage' in files:
+                bins_coverage = load_array('bins_coverage')
+            self.set_bins(load_array('bins'), bins_coverage,
+                          load_array('bin_level_offsets'),
+                          load_array('bin_mins'), load_array('bin_maxs'))
+
     def free_bin_list(self):
         """
         Frees the memory used by the bin list for this chromosome
         """
+        self.bins = None
+        self.bins_coverage = None
+        self.bin_level_offsets = None
+        self.bin_mins = None
+        self.bin_maxs = None
+        self.max_error = None
         self.bins_list.clear()
         if self.bins_list_coverages is not None:
             self.bins_list_coverages.clear()
@@ -242,86 +736,163 @@ class Chrom_Data:
         self.loaded_bins = False
         log.info(f"Freed memory for {self.name}'s bins")
 
-    def load_bins(self, max_bin_size):
+    def load_bins(self, max_bin_size=None, max_error=None,
+                  search_size=DEFAULT_SEARCH_SIZE):
         """
-        Loads bins to approximate mean. Smaller bin is slower but more accurate.
-        Larger bin is faster but less accurate.
+        Loads a pyramid of bins to approximate mean. The smallest bins are
+        max_bin_size long and every larger level of bins is twice as long as
+        the level below, until one bin covers the chromosome. Smaller bin is
+        slower to load but more accurate. Larger bin is faster to load but
+        less accurate.
 
         Parameters
         ----------
         max_bin_size : int
-            Size of the maximum bin to use
+            Size of the smallest bins, which bounds the error at the ends of
+            each search. Picked with get_error_bin_size if only max_error is
+            given.
+        max_error : float
+            Largest relative error of approx_mean. Searches that could be
+            off by more are found exactly instead. (Default is no limit)
+        search_size : int
+            Typical length of a search, used to pick max_bin_size (Default is
+            DEFAULT_SEARCH_SIZE)
         """
 
+        if max_bin_size is None and max_error is not None:
+            max_bin_size = self.get_error_bin_size(max_error, search_size)
+
         if max_bin_size is None:
             log.error("Did not specify max_bin_size")
             return
 
-        if max_bin_size == self.max_bin_size and self.loaded_bins is True:
+        if max_bin_size == self.max_bin_size and \
+                max_error == self.max_error and self.loaded_bins is True:
             log.warning(f"Already loaded bins for: {max_bin_size}")
             return
 
         self.max_bin_size = max_bin_size
-
-        self.bins_list.clear()
-        self.bins_list_coverages.clear()
-
-        # could make more sets of bins by changing constant
-        bin_size = max_bin_size
-        for i in range(MAX_NUMB_BIN_LIST - 1):
-            if bin_size % 2 == 0:
-                bin_size /= 2
-            else:
-                break
-        bin_size = int(bin_size)
-        self.min_bin_size = bin_size
+        self.min_bin_size = max_bin_size
+        self.max_error = max_error
 
         # Loading smallest bins
+        bin_size = max_bin_size
         log.info(f"Loading bins of size: {bin_size} for {self.name} ...")
         log.info(f"Number of bins: {math.ceil(self.size / bin_size)}")
-        prev_bins_list, prev_bins_coverage_list = \
-            load_smallest_bins(self.value_map, self.index_list, self.size,
+        bins, bins_coverage = \
+            load_smallest_bins(self.value_map, self.size,
                                self.intervals[0], self.intervals[1], bin_size)
+        bin_levels = [bins]
+        bin_coverage_levels = [bins_coverage]
 
-        self.bins_list.append(prev_bins_list)
-        self.bins_list_coverages.append(prev_bins_coverage_list)
-        bin_size *= 2
+        # Load larger bins, each one adds up two bins of the level below
+        while bins.size > 1:
+            bin_size *= 2
+            log.debug(f"Loading bins of size: {bin_size} for {self.name} ...")
+            bins, bins_coverage = load_bins(bins, bins_coverage)
+            bin_levels.append(bins)
+            bin_coverage_levels.append(bins_coverage)
+
+        bin_mins, bin_maxs = load_bin_ranges(self.value_map, self.size,
+                                             self.intervals[0],
+                                             self.intervals[1], max_bin_size)
+        self.set_bins(np.concatenate(bin_levels),
+                      np.concatenate(bin_coverage_levels),
+                      get_bin_level_offsets(bin_levels), bin_mins, bin_maxs)
+
+    def set_bins(self, bins, bins_coverage, bin_level_offsets, bin_mins,
+                 bin_maxs):
+        """
+        Uses a loaded pyramid of bins to approximate mean
 
-        # Load larger bins
-        while bin_size <= max_bin_size:
-            log.info(f"Loading bins of size: {bin_size} for {self.name} ...")
-            log.info(f"Number of bins: {math.ceil(self.size / bin_size)}")
+        Parameters
+        ----------
+        bins : numpy array
+            Totals of every level of bins, the smallest bins first
+        bins_coverage : numpy array
+            Covered base pairs of every level of bins, None if coverage is not
+            used
+        bin_level_offsets : numpy array
+            Index in bins where each level starts, followed by the size of bins
+        bin_mins : numpy array
+            Smallest value in each of the smallest bins
+        bin_maxs : numpy array
+            Largest value in each of the smallest bins
+        """
+        self.bins = bins
+        self.bins_coverage = bins_coverage
+        self.bin_level_offsets = bin_level_offsets
+        self.bin_mins = bin_mins
+        self.bin_maxs = bin_maxs
+
+        numb_levels = bin_level_offsets.size - 1
+        self.bins_list = [bins[bin_level_offsets[level]:
+                               bin_level_offsets[level + 1]]
+                          for level in range(numb_levels)]
+        if bins_coverage is not None:
+            self.bins_list_coverages = [
+                bins_coverage[bin_level_offsets[level]:
+                              bin_level_offsets[level + 1]]
+                for level in range(numb_levels)]
+
+        self.bin_list_numb = numb_levels
+        self.loaded_bins = True
 
-            # use the previous bin list to speed up the process
-            bins_list, bins_coverage_list = load_bins(prev_bins_list,
-                                                      prev_bins_coverage_list)
-            prev_bins_list = bins_list
-            prev_bins_coverage_list = bins_coverage_list
+    def set_zoom(self, zoom_size, zoom_records):
+        """
+        Uses the records of a bigwig zoom level to approximate statistics
 
-            self.bins_list.append(bins_list)
-            self.bins_list_coverages.append(bins_coverage_list)
+        Parameters
+        ----------
+        zoom_size : int
+            Number of base pairs summarized by each record
+        zoom_records : numpy array
+            Records in order of start, from BigWig_Reader.read_zoom_records
+        """
+        self.zoom_size = zoom_size
+        self.zoom_starts = zoom_records['start'].astype(np.uint32)
+        self.zoom_ends = zoom_records['end'].astype(np.uint32)
+        self.zoom_mins = zoom_records['min'].astype(np.float32)
+        self.zoom_maxs = zoom_records['max'].astype(np.float32)
 
-            bin_size *= 2
+        self.zoom_sums = np.zeros((zoom_records.size + 1, 3))
+        np.cumsum(zoom_records['valid_count'], out=self.zoom_sums[1:, 0])
+        np.cumsum(zoom_records['sum'], out=self.zoom_sums[1:, 1])
+        np.cumsum(zoom_records['sum_squares'], out=self.zoom_sums[1:, 2])
 
-        self.bin_list_numb = len(self.bins_list)
-        self.loaded_bins = True
+        self.loaded_zoom = True
+        log.info(f"Loaded zoom level of {zoom_size} bp for {self.name}")
 
-        # test if bins were made correctly
-        '''bin_size = self.min_bin_size
-
-        for bin_list_index in range(self.bin_list_numb):
-            bin_list = self.bins_list[bin_list_index]
-            log.info(bin_list_index)
-            for bin_index in range(len(bin_list)):
-                start = bin_index * bin_size
-                end = start + bin_size
-                test_avg = get_bin_value(self.value_map, self.index_list,
-                                          self.intervals[0], self.intervals[1],
-                                          start, end)
-                if (bin_list[bin_index] == -1 and test_avg != -1) or abs(bin_list[bin_index] - test_avg) > 0.0000001:
-                    log.info(bin_index, bin_list[bin_index], test_avg)
-                    exit(-1)
-            bin_size *= 2'''
+    def free_zoom(self):
+        """
+        Frees the memory used by the zoom level for this chromosome
+        """
+        self.zoom_size = None
+        self.zoom_starts = None
+        self.zoom_ends = None
+        self.zoom_mins = None
+        self.zoom_maxs = None
+        self.zoom_sums = None
+        self.loaded_zoom = False
+        log.info(f"Freed memory for {self.name}'s zoom level")
+
+    def uses_zoom(self, stat):
+        """
+        Parameters
+        ----------
+        stat : str
+            Name of statistic
+
+        Returns
+        -------
+        bool
+            Whether the statistic is found from the loaded zoom level instead
+            of searching the intervals
+        """
+        if not self.loaded_zoom:
+            return False
+        return stat in ZOOM_STATS or \
+            (stat == 'approx_mean' and not self.loaded_bins)
 
     def get_method(self, stat):
         """
@@ -340,14 +911,26 @@ class Chrom_Data:
         if stat == "mean":
             return self.get_exact_mean
         elif stat == "approx_mean":
+            if self.loaded_bins:
+                return self.get_approx_mean
+            if self.loaded_zoom:
+                return self.get_zoom_means
+            log.error(f'Bins were not loaded')
+            return None
+        elif stat in ZOOM_STATS:
+            if self.loaded_zoom is False:
+                log.error(f'Zoom level was not loaded')
+                return None
+            return getattr(self, ZOOM_STATS[stat])
+        elif stat == "approx_mean_error":
             if self.loaded_bins is False:
                 log.error(f'Bins were not loaded')
                 return None
-            return self.get_approx_mean
-        elif stat == "median":
-            log.error("Median has not been implemented yet")
-            return None
-            # return self.get_median
+            return self.get_approx_mean_error
+        elif parse_quantile(stat) is not None:
+            quantile = parse_quantile(stat)
+            return lambda start_list, end_list: \
+                self.get_quantile(start_list, end_list, quantile)
         elif stat == "max":
             return self.get_max
         elif stat == "max_index":
@@ -360,55 +943,318 @@ class Chrom_Data:
             return self.get_sum
         elif stat == "std":
             return self.get_std
+        elif stat == "variance":
+            return self.get_variance
         else:
             log.error(f"{stat} is not a valid statistic to search for")
             return None
 
+    def get_multi_method(self, stats):
+        """
+        Get the function that finds several statistics at once. Statistics
+        without a loaded index to search with are found together in a single
+        walk over the intervals.
+
+        Parameters
+        ----------
+        stats : list of str
+            Names of statistics to search for
+
+        Returns
+        -------
+        Function
+            The function to call that returns a structured numpy array with a
+            field for each statistic
+        """
+        methods = [self.get_method(stat) for stat in stats]
+        if None in methods:
+            return None
+
+        def get_stats(start_list, end_list):
+            indexed_stats = []
+            if self.loaded_prefix_sums:
+                indexed_stats += ['mean', 'coverage', 'sum', 'std', 'variance']
+            if self.loaded_range_index:
+                indexed_stats += ['max', 'min']
+
+            walk_result = None
+            columns = []
+            for stat, method in zip(stats, methods):
+                if stat not in MULTI_STATS or stat in indexed_stats:
+                    columns.append(method(start_list, end_list))
+                    continue
+
+                if walk_result is None:
+                    walk_result = self.get_walk_stats(start_list, end_list)
+                columns.append(walk_result[:, MULTI_STATS.index(stat)])
+
+            result = np.empty(start_list.size, dtype=[
+                (stat, column.dtype) for stat, column in zip(stats, columns)])
+            for stat, column in zip(stats, columns):
+                result[stat] = column
+            return result
+
+        return get_stats
+
+    def get_walk_stats(self, start_list, end_list):
+        return get_multi_stats(self.value_map, self.index_list,
+                               self.intervals[0], self.intervals[1],
+                               start_list, end_list)
+
+    def get_bin_means(self, start_list, end_list):
+        return get_approx_means(self.bins, self.bins_coverage,
+                                self.bin_level_offsets, self.min_bin_size,
+                                start_list, end_list)
+
+    def get_bin_mean_errors(self, start_list, end_list, approx_means):
+        return get_approx_mean_errors(self.bins, self.bins_coverage,
+                                      self.bin_level_offsets, self.bin_mins,
+                                      self.bin_maxs, self.min_bin_size,
+                                      self.size, approx_means, start_list,
+                                      end_list)
+
+    def get_approx_means_and_errors(self, start_list, end_list):
+        """
+        Finds approx_mean along with how far it could be from the exact mean
+
+        Parameters
+        ----------
+        start_list : numpy array
+            Start of each search
+        end_list : numpy array
+            End of each search
+
+        Returns
+        -------
+        tuple
+            Approximate mean of each search and the largest difference
+            between it and the exact mean. Searches whose relative error could
+            be larger than max_error are found exactly and have an error of 0.
+        """
+        result = self.get_bin_means(start_list, end_list)
+        errors = self.get_bin_mean_errors(start_list, end_list, result)
+
+        if self.max_error is not None:
+            # relative to the smallest the exact mean could be, which is
+            # errors > max_error * (abs(result) - errors)
+            inexact = errors * (1 + self.max_error) > \
+                self.max_error * np.abs(result)
+            if np.any(inexact):
+                result[inexact] = self.get_exact_mean(start_list[inexact],
+                                                      end_list[inexact])
+                errors[inexact] = 0
+
+        return result, errors
+
     def get_approx_mean(self, start_list, end_list):
-        return get_approx_means(self.bins_list[0], self.bins_list_coverages[0],
-                                self.min_bin_size, start_list, end_list)
+        if self.max_error is None:
+            return self.get_bin_means(start_list, end_list)
+        return self.get_approx_means_and_errors(start_list, end_list)[0]
+
+    def get_approx_mean_error(self, start_list, end_list):
+        return self.get_approx_means_and_errors(start_list, end_list)[1]
+
+    def get_zoom_ranges(self, start_list, end_list):
+        """
+        Parameters
+        ----------
+        start_list : numpy array
+            Start of each search
+        end_list : numpy array
+            End of each search
+
+        Returns
+        -------
+        tuple
+            First zoom record overlapping each search and one past the last,
+            the same if no record overlaps
+        """
+        first = np.searchsorted(self.zoom_ends, start_list, side='right')
+        last = np.searchsorted(self.zoom_starts, end_list, side='left')
+        return first, np.maximum(first, last)
+
+    def get_zoom_totals(self, start_list, end_list):
+        """
+        Adds up the zoom records overlapping each search. Records partly in
+        a search add the same fraction of their totals, as if their values
+        were spread evenly.
+
+        Parameters
+        ----------
+        start_list : numpy array
+            Start of each search
+        end_list : numpy array
+            End of each search
+
+        Returns
+        -------
+        tuple
+            Covered size, sum and sum of squares in each search
+        """
+        start_list = start_list.astype(np.int64)
+        end_list = end_list.astype(np.int64)
+        first, last = self.get_zoom_ranges(start_list, end_list)
+        totals = self.zoom_sums[last] - self.zoom_sums[first]
+
+        overlaps = last > first
+        edge_records = np.stack([first[overlaps], last[overlaps] - 1])
+        record_starts = self.zoom_starts[edge_records]
+        record_ends = self.zoom_ends[edge_records]
+        record_sizes = record_ends - record_starts.astype(np.int64)
+        record_totals = self.zoom_sums[edge_records + 1] - \
+            self.zoom_sums[edge_records]
+
+        # parts of the first and last record outside the search
+        outside = [np.maximum(start_list[overlaps] - record_starts[0], 0),
+                   np.maximum(record_ends[1] - end_list[overlaps], 0)]
+        for i in range(2):
+            totals[overlaps] -= record_totals[i] * \
+                (outside[i] / record_sizes[i])[:, np.newaxis]
+
+        return totals[:, 0], totals[:, 1], totals[:, 2]
+
+    def get_zoom_extremes(self, start_list, end_list):
+        """
+        Parameters
+        ----------
+        start_list : numpy array
+            Start of each search
+        end_list : numpy array
+            End of each search
+
+        Returns
+        -------
+        tuple
+            Smallest and largest value of the zoom records overlapping each
+            search, nan if no record overlaps
+        """
+        first, last = self.get_zoom_ranges(start_list, end_list)
+
+        # in order of first record so the gaps reduceat also goes over between
+        # one search and the next stay short
+        order = np.argsort(first, kind='stable')
+        indexes = np.empty(2 * first.size, dtype=np.int64)
+        indexes[0::2] = first[order]
+        indexes[1::2] = last[order]
+
+        mins = np.full(first.size, np.nan)
+        maxs = np.full(first.size, np.nan)
+        overlaps = first[order] < last[order]
+        if indexes.size > 0:
+            # the extra value keeps an index of one past the last record valid
+            for result, records, ufunc in [(mins, self.zoom_mins, np.minimum),
+                                           (maxs, self.zoom_maxs, np.maximum)]:
+                extremes = ufunc.reduceat(np.append(records, np.nan),
+                                          indexes)[0::2]
+                result[order[overlaps]] = extremes[overlaps]
+
+        return mins, maxs
+
+    def get_zoom_means(self, start_list, end_list):
+        covered, sums, _ = self.get_zoom_totals(start_list, end_list)
+        result = np.full(start_list.size, -1, dtype=np.float64)
+        np.divide(sums, covered, out=result, where=covered > 0)
+        return result
+
+    def get_zoom_stds(self, start_list, end_list):
+        covered, sums, square_sums = self.get_zoom_totals(start_list,
+                                                          end_list)
+        result = np.full(start_list.size, -1, dtype=np.float64)
+        is_covered = covered > 0
+        means = sums[is_covered] / covered[is_covered]
+        variances = square_sums[is_covered] / covered[is_covered] - means ** 2
+        result[is_covered] = np.sqrt(np.maximum(variances, 0))
+        return result
+
+    def get_zoom_maxs(self, start_list, end_list):
+        maxs = self.get_zoom_extremes(start_list, end_list)[1]
+        return np.nan_to_num(maxs, nan=-1)
+
+    def get_zoom_mins(self, start_list, end_list):
+        mins = self.get_zoom_extremes(start_list, end_list)[0]
+        return np.nan_to_num(mins, nan=-1)
 
     def get_exact_mean(self, start_list, end_list):
+        if self.loaded_prefix_sums:
+            return get_prefix_means(self.value_map, self.index_list,
+                                    self.intervals[0], self.intervals[1],
+                                    self.value_sums, self.length_sums,
+                                    start_list, end_list)
         return get_exact_means(self.value_map, self.index_list,
                                self.intervals[0],
                                self.intervals[1], start_list, end_list)
 
-    # slower for now because of usage of numpy instead of implementing O(n)
-    # algorithm in Cython
     def get_median(self, start_list, end_list):
-        """assert len(start_list) == len(end_list)
-        num_tests = len(start_list)
-        results = np.full(num_tests, -1, dtype=np.float64)
-        for i in range(num_tests):
-            start = start_list[i]
-            end = end_list[i]
-            wanted_range = self.value_list[start:end]
-            cleaned_range = wanted_range[wanted_range > -1]
-            results[i] = np.median(cleaned_range)
-        return results"""
-        return None
+        return self.get_quantile(start_list, end_list, 0.5)
+
+    def get_quantile(self, start_list, end_list, quantile):
+        if self.loaded_quantile_index:
+            return get_indexed_quantiles(self.value_map, self.index_list,
+                                         self.intervals[0], self.intervals[1],
+                                         self.quantile_values, self.value_ranks,
+                                         self.zeros_before, self.left_weights,
+                                         self.size_sums, start_list, end_list,
+                                         quantile)
+        return get_quantiles(self.value_map, self.index_list,
+                             self.intervals[0], self.intervals[1],
+                             start_list, end_list, quantile)
 
     def get_coverage(self, start_list, end_list):
+        if self.loaded_prefix_sums:
+            return get_prefix_coverages(self.value_map, self.index_list,
+                                        self.intervals[0], self.intervals[1],
+                                        self.value_sums, self.length_sums,
+                                        start_list, end_list)
         return get_coverages(self.index_list, self.intervals[0],
                              self.intervals[1], start_list, end_list)
 
     def get_max(self, start_list, end_list):
+        if self.loaded_range_index:
+            return get_range_maximums(self.value_map, self.index_list,
+                                      self.intervals[0], self.intervals[1],
+                                      self.max_table, start_list, end_list)
         return get_maximums(self.value_map, self.index_list, self.intervals[0],
                             self.intervals[1], start_list, end_list)
 
     def get_max_indexes(self, start_list, end_list):
+        if self.loaded_range_index:
+            return get_range_max_indexes(self.value_map, self.index_list,
+                                         self.intervals[0], self.intervals[1],
+                                         self.max_table, start_list, end_list)
         return get_max_indexes(self.value_map, self.index_list,
                                self.intervals[0], self.intervals[1],
                                start_list, end_list)
 
     def get_sum(self, start_list, end_list):
+        if self.loaded_prefix_sums:
+            return get_prefix_sums(self.value_map, self.index_list,
+                                   self.intervals[0], self.intervals[1],
+                                   self.value_sums, self.length_sums,
+                                   start_list, end_list)
         return get_sum(self.value_map, self.index_list, self.intervals[0],
                           self.intervals[1], start_list, end_list)
 
     def get_min(self, start_list, end_list):
+        if self.loaded_range_index:
+            return get_range_minimums(self.value_map, self.index_list,
+                                      self.intervals[0], self.intervals[1],
+                                      self.min_table, start_list, end_list)
         return get_minimums(self.value_map, self.index_list, self.intervals[0],
                             self.intervals[1], start_list, end_list)
 
     def get_std(self, start_list, end_list):
+        if self.loaded_prefix_sums:
+            return get_prefix_stds(self.value_map, self.index_list,
+                                   self.intervals[0], self.intervals[1],
+                                   self.moment_table, start_list, end_list)
         return get_stds(self.value_map, self.index_list, self.intervals[0],
                         self.intervals[1], start_list, end_list)
+
+    def get_variance(self, start_list, end_list):
+        if self.loaded_prefix_sums:
+            return get_prefix_variances(self.value_map, self.index_list,
+                                        self.intervals[0], self.intervals[1],
+                                        self.moment_table, start_list, end_list)
+        return get_variances(self.value_map, self.index_list,
+                             self.intervals[0], self.intervals[1],
+                             start_list, end_list)
@@ -1,11 +1,11 @@
-from .Chrom_Data import Chrom_Data
+from .Chrom_Data import Chrom_Data, get_bin_level_offsets, \
+    DEFAULT_SEARCH_SIZE
 from .include_missing_bp import *
 import logging
 import math
 
 log = logging.getLogger()
 
-MAX_NUMB_BIN_LIST = 1
 MIN_BIN_SIZE = 2
 
 
@@ -15,7 +15,8 @@ class Chrom_Data_Complete(Chrom_Data):
     missing base pairs when finding statistics.
     """
 
-    def __init__(self, name, size, min_value, debug):
+    def __init__(self, name, size, min_value, debug, sparse_index=False,
+                 value_type='float64'):
         """
         Parameters
         ----------
@@ -26,114 +27,213 @@ class Chrom_Data_Complete(Chrom_Data):
         min_value : int
             Minimum value of interval to keep
         debug : bool
+        sparse_index : bool
+            Whether to binary search the intervals instead of building an
+            index array with an entry for every base pair (Default is False)
+        value_type : str
+            Type to store the values of the intervals as, 'float64' or
+            'float32' (Default is 'float64')
         """
-        super().__init__(name, size, min_value, debug)
+        super().__init__(name, size, min_value, debug, sparse_index,
+                         value_type)
 
         # coverage is not used in this class
         self.bins_list_coverages = None
 
-    def load_bins(self, max_bin_size):
+    def load_bins(self, max_bin_size=None, max_error=None,
+                  search_size=DEFAULT_SEARCH_SIZE):
         """
-        Loads bins to approximate mean. Smaller bin is slower but more accurate.
-        Larger bin is faster but less accurate.
+        Loads a pyramid of bins to approximate mean. The smallest bins are
+        max_bin_size long and every larger level of bins is twice as long as
+        the level below, until one bin covers the chromosome. Smaller bin is
+        slower to load but more accurate. Larger bin is faster to load but
+        less accurate.
 
         Parameters
         ----------
         max_bin_size : int
-            Size of the maximum bin to use
+            Size of the smallest bins, which bounds the error at the ends of
+            each search. Picked with get_error_bin_size if only max_error is
+            given.
+        max_error : float
+            Largest relative error of approx_mean. Searches that could be
+            off by more are found exactly instead. (Default is no limit)
+        search_size : int
+            Typical length of a search, used to pick max_bin_size (Default is
+            DEFAULT_SEARCH_SIZE)
         """
 
+        if max_bin_size is None and max_error is not None:
+            max_bin_size = self.get_error_bin_size(max_error, search_size)
+
         if max_bin_size is None:
             log.error("Did not specify max_bin_size")
             return
 
-        if max_bin_size == self.max_bin_size and self.loaded_bins is True:
+        if max_bin_size == self.max_bin_size and \
+                max_error == self.max_error and self.loaded_bins is True:
             log.warning(f"Already loaded bins for: {max_bin_size}")
             return
 
         self.max_bin_size = max_bin_size
-
-        self.bins_list.clear()
-
-        # could make more sets of bins by changing constant
-        bin_size = max_bin_size
-        for i in range(MAX_NUMB_BIN_LIST - 1):
-            if bin_size % 2 == 0:
-                bin_size /= 2
-            else:
-                break
-        bin_size = int(bin_size)
-        self.min_bin_size = bin_size
+        self.min_bin_size = max_bin_size
+        self.max_error = max_error
 
         # Loading smallest bins
+        bin_size = max_bin_size
         log.info(f"Loading bins of size: {bin_size} for {self.name} ...")
         log.info(f"Number of bins: {math.ceil(self.size / bin_size)}")
-        prev_bins_list = load_smallest_bins(self.value_map, self.index_list, self.size,
-                           self.intervals[0], self.intervals[1], bin_size)
-        self.bins_list.append(prev_bins_list)
-        bin_size *= 2
-
-        # Load larger bins
-        while bin_size <= max_bin_size:
+        bins = load_smallest_bins(self.value_map, self.size,
+                                  self.intervals[0], self.intervals[1],
+                                  bin_size)
+        bin_levels = [bins]
 
-            log.info(f"Loading bins of size: {bin_size} for {self.name} ...")
-            log.info(f"Number of bins: {math.ceil(self.size / bin_size)}")
+        # Load larger bins, each one adds up two bins of the level below
+        while bins.size > 1:
+            bin_size *= 2
+            log.debug(f"Loading bins of size: {bin_size} for {self.name} ...")
+            bins = load_bins(bins)
+            bin_levels.append(bins)
 
-            # use the previous bin list to speed up the process
-            bins_list = load_bins(prev_bins_list)
-            prev_bins_list = bins_list
+        bin_mins, bin_maxs = load_bin_ranges(self.value_map, self.size,
+                                             self.intervals[0],
+                                             self.intervals[1], max_bin_size)
+        self.set_bins(np.concatenate(bin_levels), None,
+                      get_bin_level_offsets(bin_levels), bin_mins, bin_maxs)
 
-            self.bins_list.append(bins_list)
+    def get_covered_sizes(self):
+        """
+        Returns
+        -------
+        numpy array
+            Number of base pairs each interval adds to the coverage, which only
+            counts intervals with a value above 0
+        """
+        interval_sizes = super().get_covered_sizes()
+        interval_sizes[self.value_map <= 0] = 0
+        return interval_sizes
 
-            bin_size *= 2
+    def get_value_moments(self):
+        """
+        Returns
+        -------
+        tuple
+            Mean and standard deviation of the values of every base pair,
+            where missing base pairs are 0
+        """
+        interval_sizes = self.intervals[1].astype(np.int64) - self.intervals[0]
+        values = np.append(self.value_map, 0)
+        sizes = np.append(interval_sizes, self.size - interval_sizes.sum())
+        if sizes.sum() == 0:
+            return 0, 0
 
-        self.bin_list_numb = len(self.bins_list)
-        self.loaded_bins = True
-
-        # test if bins were made correctly
-        '''for i in range(self.bin_list_numb):
-            bin_size /= 2
-
-        for bin_list_index in range(self.bin_list_numb):
-            bin_list = self.bins_list[bin_list_index]
-            log.info(bin_list_index)
-            for bin_index in range(len(bin_list)):
-                start = bin_index * bin_size
-                end = start + bin_size
-                test_avg = get_bin_mean(self.value_list, start, end)
-                if abs(bin_list[bin_index] - test_avg) > 0.000001:
-                    log.info(bin_index, bin_list[bin_index], test_avg)
-                    exit(-1)
-            bin_size *= 2'''
+        mean = np.average(values, weights=sizes)
+        variance = np.average((values - mean) ** 2, weights=sizes)
+        return mean, math.sqrt(variance)
 
     def get_exact_mean(self, start_list, end_list):
+        if self.loaded_prefix_sums:
+            return get_prefix_means(self.value_map, self.index_list,
+                                    self.intervals[0], self.intervals[1],
+                                    self.value_sums, self.length_sums,
+                                    start_list, end_list)
         return get_exact_means(self.value_map, self.index_list, self.intervals[0],
                                self.intervals[1], start_list, end_list)
 
-    def get_approx_mean(self, start_list, end_list):
-        return get_approx_means(self.bins_list[self.bin_list_numb - 1],
+    def get_walk_stats(self, start_list, end_list):
+        return get_multi_stats(self.value_map, self.index_list,
+                               self.intervals[0], self.intervals[1],
+                               start_list, end_list)
+
+    def get_bin_means(self, start_list, end_list):
+        return get_approx_means(self.bins, self.bin_level_offsets,
                                 self.max_bin_size, start_list, end_list)
 
-    # slower for now because of usage of numpy instead of implementing O(n)
-    # algorithm in Cython
-    def get_median(self, start_list, end_list):
-        """my_results = get_medians(self.value_list, start_list, end_list)
-        return my_results"""
-        log.warning('Not implemented')
-        return None
+    def get_bin_mean_errors(self, start_list, end_list, approx_means):
+        return get_approx_mean_errors(self.bins, self.bin_level_offsets,
+                                      self.bin_mins, self.bin_maxs,
+                                      self.max_bin_size, self.size,
+                                      approx_means, start_list, end_list)
+
+    def get_zoom_means(self, start_list, end_list):
+        sums = self.get_zoom_totals(start_list, end_list)[1]
+        sizes = end_list - start_list
+        result = np.full(start_list.size, -1, dtype=np.float64)
+        np.divide(sums, sizes, out=result, where=sizes > 0)
+        return result
+
+    def get_zoom_stds(self, start_list, end_list):
+        _, sums, square_sums = self.get_zoom_totals(start_list, end_list)
+        sizes = end_list - start_list
+        result = np.full(start_list.size, -1, dtype=np.float64)
+        has_size = sizes > 0
+        means = sums[has_size] / sizes[has_size]
+        variances = square_sums[has_size] / sizes[has_size] - means ** 2
+        result[has_size] = np.sqrt(np.maximum(variances, 0))
+        return result
+
+    def get_zoom_maxs(self, start_list, end_list):
+        maxs = self.get_zoom_extremes(start_list, end_list)[1]
+        return np.nan_to_num(maxs, nan=0)
+
+    def get_zoom_mins(self, start_list, end_list):
+        mins = self.get_zoom_extremes(start_list, end_list)[0]
+        return np.nan_to_num(mins, nan=0)
+
+    def get_quantile_values(self):
+        # base pairs that are not in bedGraph intervals have a value of 0
+        return np.union1d(self.value_map, [0]).astype(np.float64)
+
+    def get_quantile(self, start_list, end_list, quantile):
+        if self.loaded_quantile_index:
+            return get_indexed_quantiles(self.value_map, self.index_list,
+                                         self.intervals[0], self.intervals[1],
+                                         self.quantile_values, self.value_ranks,
+                                         self.zeros_before, self.left_weights,
+                                         self.size_sums, start_list, end_list,
+                                         quantile)
+        return get_quantiles(self.value_map, self.index_list,
+                             self.intervals[0], self.intervals[1],
+                             start_list, end_list, quantile)
 
     def get_coverage(self, start_list, end_list):
+        if self.loaded_prefix_sums:
+            return get_prefix_coverages(self.value_map, self.index_list,
+                                        self.intervals[0], self.intervals[1],
+                                        self.value_sums, self.length_sums,
+                                        start_list, end_list)
         return get_coverages(self.value_map, self.index_list, self.intervals[0],
                              self.intervals[1], start_list, end_list)
 
     def get_max(self, start_list, end_list):
+        if self.loaded_range_index:
+            return get_range_maximums(self.value_map, self.index_list,
+                                      self.intervals[0], self.intervals[1],
+                                      self.max_table, start_list, end_list)
         return get_maximums(self.value_map, self.index_list, self.intervals[0],
                             self.intervals[1], start_list, end_list)
 
     def get_min(self, start_list, end_list):
+        if self.loaded_range_index:
+            return get_range_minimums(self.value_map, self.index_list,
+                                      self.intervals[0], self.intervals[1],
+                                      self.min_table, start_list, end_list)
         return get_minimums(self.value_map, self.index_list, self.intervals[0],
                             self.intervals[1], start_list, end_list)
 
     def get_std(self, start_list, end_list):
+        if self.loaded_prefix_sums:
+            return get_prefix_stds(self.value_map, self.index_list,
+                                   self.intervals[0], self.intervals[1],
+                                   self.moment_table, start_list, end_list)
         return get_stds(self.value_map, self.index_list, self.intervals[0],
                         self.intervals[1], start_list, end_list)
+
+    def get_variance(self, start_list, end_list):
+        if self.loaded_prefix_sums:
+            return get_prefix_variances(self.value_map, self.index_list,
+                                        self.intervals[0], self.intervals[1],
+                                        self.moment_table, start_list, end_list)
+        return get_variances(self.value_map, self.index_list,
+                             self.intervals[0], self.intervals[1],
+                             start_list, end_list)
@@ -0,0 +1,249 @@
+from collections import OrderedDict
+import logging
+
+log = logging.getLogger()
+
+# Chrom_Data method that frees each kind of index
+FREE_METHODS = {
+    'index_list': 'free_index_list',
+    'prefix_sums': 'free_prefix_sums',
+    'range_index': 'free_range_index',
+    'quantile_index': 'free_quantile_index',
+    'bins': 'free_bin_list',
+    'zoom': 'free_zoom'
+}
+
+# indexes each statistic needs or searches with when they are loaded
+STAT_INDEXES = {
+    'mean': ['index_list', 'prefix_sums'],
+    'approx_mean': ['index_list', 'bins', 'zoom'],
+    'approx_max': ['zoom'],
+    'approx_min': ['zoom'],
+    'approx_std': ['zoom'],
+    'approx_mean_error': ['index_list', 'bins'],
+    'max': ['index_list', 'range_index'],
+    'max_index': ['index_list', 'range_index'],
+    'min': ['index_list', 'range_index'],
+    'coverage': ['index_list', 'prefix_sums'],
+    'sum': ['index_list', 'prefix_sums'],
+    'std': ['index_list', 'prefix_sums'],
+    'variance': ['index_list', 'prefix_sums'],
+    'median': ['index_list', 'quantile_index']
+}
+
+# indexes of the statistics named quantile_<q>
+QUANTILE_INDEXES = ['index_list', 'quantile_index']
+
+
+def get_stat_indexes(stat):
+    """
+    Parameters
+    ----------
+    stat : str
+        Name of statistic
+
+    Returns
+    -------
+    list
+        Names of the indexes the statistic needs or searches with
+    """
+    if stat.startswith('quantile_'):
+        return QUANTILE_INDEXES
+    return STAT_INDEXES.get(stat, [])
+
+
+def is_index_loaded(chrom, index_name):
+    """
+    Parameters
+    ----------
+    chrom : Chrom_Data
+        Chromosome to check
+    index_name : str
+        Name of the index to check
+
+    Returns
+    -------
+    bool
+        Whether the index is currently loaded for the chromosome
+    """
+    if index_name == 'index_list':
+        return chrom.loaded_chrom
+    if index_name == 'prefix_sums':
+        return chrom.loaded_prefix_sums
+    if index_name == 'range_index':
+        return chrom.loaded_range_index
+    if index_name == 'quantile_index':
+        return chrom.loaded_quantile_index
+    if index_name == 'zoom':
+        return chrom.loaded_zoom
+    return chrom.loaded_bins
+
+
+class Memory_Manager:
+    """
+    Keeps the memory used by the indexes of every chromosome under a budget by
+    freeing the least recently used ones. Freed indexes are loaded again the
+    next time a search needs them.
+    """
+
+    def __init__(self, memory_budget=None):
+        """
+        Parameters
+        ----------
+        memory_budget : int
+            Number of bytes the indexes can use (Default is no limit)
+        """
+        self.memory_budget = memory_budget
+
+        # (chrom_name, index_name) -> (chrom, number of bytes), least
+        # recently used first
+        self.loaded_indexes = OrderedDict()
+
+        # (chrom_name, index_name) -> function that loads the index
+        self.load_functions = {}
+
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self, chrom, index_name, load_function):
+        """
+        Loads an index and remembers how to load it again if it is freed
+
+        Parameters
+        ----------
+        chrom : Chrom_Data
+            Chromosome to load the index for
+        index_name : str
+            Name of the index, a key of FREE_METHODS
+        load_function : Function
+            Function without arguments that loads the index
+        """
+        key = (chrom.name, index_name)
+        self.load_functions[key] = load_function
+        self.forget(key)
+
+        load_function()
+        self.add(key, chrom)
+        self.free_over_budget([key])
+
+    def use(self, chrom, stat):
+        """
+        Marks the indexes a statistic searches with as recently used and
+        loads again the ones that were freed
+
+        Parameters
+        ----------
+        chrom : Chrom_Data
+            Chromosome being searched
+        stat : str
+            Name of statistic being searched for
+        """
+        used_keys = []
+        for index_name in get_stat_indexes(stat):
+            key = (chrom.name, index_name)
+            if key not in self.load_functions:
+                continue
+
+            if key in self.loaded_indexes:
+                # indexes freed by calling Chrom_Data directly stay freed
+                if not is_index_loaded(chrom, index_name):
+                    self.free(chrom.name, index_name)
+                    continue
+
+                self.hits += 1
+                self.loaded_indexes.move_to_end(key)
+                used_keys.append(key)
+                continue
+
+            self.misses += 1
+            used_keys.append(key)
+            log.info(f"Loading {index_name} of {chrom.name} again")
+            self.load_functions[key]()
+            self.add(key, chrom)
+
+        self.free_over_budget(used_keys)
+
+    def free(self, chrom_name, index_name):
+        """
+        Stops keeping track of an index that is being freed by hand
+
+        Parameters
+        ----------
+        chrom_name : str
+            Name of chromosome of the index
+        index_name : str
+            Name of the index
+        """
+        key = (chrom_name, index_name)
+        self.load_functions.pop(key, None)
+        self.forget(key)
+
+    def add(self, key, chrom):
+        """
+        Starts keeping track of a loaded index as the most recently used
+
+        Parameters
+        ----------
+        key : tuple
+            Name of chromosome and name of index
+        chrom : Chrom_Data
+            Chromosome of the index
+        """
+        numb_bytes = chrom.get_memory_usage()[key[1]]
+        self.loaded_indexes[key] = (chrom, numb_bytes)
+        self.used_bytes += numb_bytes
+
+    def forget(self, key):
+        """
+        Stops keeping track of a loaded index without freeing it
+
+        Parameters
+        ----------
+        key : tuple
+            Name of chromosome and name of index
+        """
+        if key in self.loaded_indexes:
+            self.used_bytes -= self.loaded_indexes.pop(key)[1]
+
+    def free_over_budget(self, used_keys):
+        """
+        Frees the least recently used indexes until the budget is met
+
+        Parameters
+        ----------
+        used_keys : list
+            Indexes needed by the current search that must not be freed
+        """
+        if self.memory_budget is None:
+            return
+
+        for key in list(self.loaded_indexes):
+            if self.used_bytes <= self.memory_budget:
+                break
+            if key in used_keys:
+                continue
+
+            chrom, numb_bytes = self.loaded_indexes[key]
+            log.info(f"Freeing {key[1]} of {key[0]} to stay under the memory "
+                     f"budget")
+            getattr(chrom, FREE_METHODS[key[1]])()
+            self.forget(key)
+            self.evictions += 1
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Number of hits, misses and evictions along with the bytes used by
+            the indexes and the memory budget
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'used_bytes': self.used_bytes,
+            'memory_budget': self.memory_budget
+        }
@@ -0,0 +1,108 @@
+from .util import format_bed_rows
+import numpy as np
+import logging
+
+log = logging.getLogger()
+
+OUTPUT_FORMATS = ['bed', 'npy']
+
+
+class Stats_Writer:
+    """
+    Writes the statistics of intervals to a file as they are found, in the
+    order the intervals were given.
+
+    The 'bed' format writes tab separated rows of chrom, start, end and one
+    column for each statistic. The 'npy' format writes a numpy array with one
+    row for each interval and one float64 column for each statistic.
+    """
+
+    def __init__(self, file_name, stats, output_format='bed'):
+        """
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write
+        stats : list
+            Names of the statistics, one column each
+        output_format : str
+            'bed' or 'npy' (Default is 'bed')
+        """
+        if output_format not in OUTPUT_FORMATS:
+            error_msg = f"{output_format} is not a valid output format. It " \
+                        f"must be one of {OUTPUT_FORMATS}"
+            log.critical(error_msg)
+            raise RuntimeError(error_msg)
+
+        self.file_name = file_name
+        self.stats = stats
+        self.output_format = output_format
+        self.numb_rows = 0
+
+        self.out_file = open(file_name, 'wb')
+        if output_format == 'npy':
+            # the number of rows is filled in once every row is written
+            self.write_npy_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_npy_header(self):
+        """
+        Writes the header of the npy file for the rows written so far. The
+        header always takes the same number of bytes so it can be rewritten.
+        """
+        np.lib.format.write_array_header_1_0(self.out_file, {
+            'descr': np.lib.format.dtype_to_descr(np.dtype(np.float64)),
+            'fortran_order': False,
+            'shape': (self.numb_rows, len(self.stats))
+        })
+
+    def write(self, chrom_list, start_list, end_list, results):
+        """
+        Writes the statistics of the next intervals
+
+        Parameters
+        ----------
+        chrom_list : numpy array
+            Chromosome name of each interval
+        start_list : numpy array
+            Start of each interval
+        end_list : numpy array
+            End of each interval
+        results : list of numpy arrays
+            Results of each statistic for the intervals, in the same order as
+            stats
+        """
+        columns = np.empty((len(start_list), len(self.stats)),
+                           dtype=np.float64)
+        for column, result in enumerate(results):
+            columns[:, column] = result
+
+        if self.output_format == 'npy':
+            self.out_file.write(columns.tobytes())
+        else:
+            chrom_names, chrom_indexes = np.unique(chrom_list,
+                                                   return_inverse=True)
+            self.out_file.write(format_bed_rows(
+                [str(chrom_name) for chrom_name in chrom_names],
+                chrom_indexes.ravel().astype(np.int64),
+                np.asarray(start_list, dtype=np.int64),
+                np.asarray(end_list, dtype=np.int64), columns))
+
+        self.numb_rows += columns.shape[0]
+
+    def close(self):
+        """
+        Finishes writing the file
+        """
+        if self.out_file.closed:
+            return
+
+        if self.output_format == 'npy':
+            self.out_file.seek(0)
+            self.write_npy_header()
+        self.out_file.close()
@@ -2,7 +2,7 @@ from .include_missing_bp import *
 from .ignore_missing_bp import *
 from .Chrom_Data import Chrom_Data
 from .Chrom_Data_Complete import Chrom_Data_Complete
-from .BedGraph import BedGraph
+from .BedGraph import BedGraph, SearchError
 
 '''
 NUM_TESTS = 10000
@@ -1,39 +1,36 @@
 import numpy as np
 import cython
+from pyBedGraph.util import sum_over_bins
 from libc.float cimport DBL_MAX
-from libc.math cimport ceil, sqrt
-
-def load_smallest_bins(double[:] value_map, int[:] index_list, unsigned int size,
-                       unsigned int[:] interval_start, unsigned int[:] interval_end,
+from libc.math cimport ceil, sqrt, fmax, INFINITY
+from libc.stdlib cimport malloc, free
+from pyBedGraph.interval_search cimport (value_type, find_first_interval, find_interval_range,
+                                         find_range_best, sum_interval_range,
+                                         sum_moment_range,
+                                         MEAN_COLUMN, MAX_COLUMN, MIN_COLUMN,
+                                         COVERAGE_COLUMN, SUM_COLUMN, STD_COLUMN,
+                                         VARIANCE_COLUMN, NUMB_MULTI_STATS,
+                                         add_weighted_value, select_weighted_value,
+                                         select_indexed_rank, reserve_weighted_values,
+                                         clipped_size, sum_bin_range,
+                                         count_bin_range)
+
+# statistics found by get_multi_stats, one column each
+MULTI_STATS = ['mean', 'max', 'min', 'coverage', 'sum', 'std', 'variance']
+
+def load_smallest_bins(const value_type[:] value_map, unsigned int size,
+                       const unsigned int[:] interval_start, const unsigned int[:] interval_end,
                        unsigned int bin_size):
-    cdef size_t bin_index
-
-    cdef unsigned int numb_bins = <int>ceil(size / bin_size)
-
-    bins = np.full(numb_bins, -1, dtype=np.float64)
-    bins_coverage = np.zeros(numb_bins, dtype=np.uint32)
-    cdef double[:] bins_view = bins
-    cdef unsigned int[:] bins_coverage_view = bins_coverage
-
-    cdef unsigned int start, end, coverage
-    cdef double value
-
-    for bin_index in range(numb_bins):
-        start = bin_index * bin_size
-        end = start + bin_size
-
-        if end > size:
-            end = size
-
-        value, coverage = get_values(value_map, index_list, interval_start,
-                                     interval_end, start, end)
-        if coverage > 0:
-            bins_view[bin_index] = value
-            bins_coverage_view[bin_index] = coverage
+    # uncovered bins have a total and coverage of 0
+    bins = sum_over_bins(interval_start, interval_end, value_map, size,
+                         bin_size)
+    bins_coverage = sum_over_bins(interval_start, interval_end,
+                                  np.ones(value_map.shape[0]), size,
+                                  bin_size).astype(np.uint32)
 
     return bins, bins_coverage
 
-def load_bins(double[:] prev_bin_level_mean, unsigned int[:] prev_bin_level_coverage):
+def load_bins(const double[:] prev_bin_level_mean, const unsigned int[:] prev_bin_level_coverage):
 
     assert tuple(prev_bin_level_mean.shape) == tuple(prev_bin_level_coverage.shape)
 
@@ -45,7 +42,7 @@ def load_bins(double[:] prev_bin_level_mean, unsigned int[:] prev_bin_level_cove
 
     cdef unsigned int numb_bins = <int>ceil(prev_bin_level_size / bin_size)
 
-    bins = np.full(numb_bins, -1, dtype=np.float64)
+    bins = np.zeros(numb_bins, dtype=np.float64)
     bins_coverage = np.zeros(numb_bins, dtype=np.uint32)
     cdef double[:] bins_view = bins
     cdef unsigned int[:] bins_coverage_view = bins_coverage
@@ -69,46 +66,14 @@ def load_bins(double[:] prev_bin_level_mean, unsigned int[:] prev_bin_level_cove
 
     return bins, bins_coverage
 
-def get_values(double[:] value_map, int[:] index_list,
-                unsigned int[:] interval_start, unsigned int[:] interval_end,
-                unsigned int start, unsigned int end):
-
-    cdef double total = 0, value
-    cdef unsigned int coverage = 0, value_index, temp_end, interval_size
-    cdef size_t i, numb_intervals = interval_start.size
-
-    # get to an interval
-    while start < end and index_list[start] == -1:
-        start += 1
-
-    if start == end:
-        return total, coverage
-
-    value_index = index_list[start]
-    while start < end and start < interval_end[value_index]:
-        temp_end = interval_end[value_index]
-        if temp_end > end:
-            temp_end = end
-        interval_size = temp_end - start
-
-        total += value_map[value_index] * interval_size
-        coverage += interval_size
-
-        value_index += 1
-        if value_index == numb_intervals:
-            break
-        start = interval_start[value_index]
-
-    return total, coverage
-
-
-def get_sum(double[:] value_map, int[:] index_list,
-            unsigned int[:] interval_start, unsigned int[:] interval_end,
-            int[:] start_list, int[:] end_list):
+def get_sum(const value_type[:] value_map, const int[:] index_list,
+            const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+            const int[:] start_list, const int[:] end_list):
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t i, num_tests = start_list.size, start, end, value_index
+    cdef Py_ssize_t first_index
     cdef size_t numb_intervals = interval_start.size
     cdef double sum
     cdef unsigned int temp_end, interval_size
@@ -116,39 +81,44 @@ def get_sum(double[:] value_map, int[:] index_list,
     result = np.full(num_tests, 0, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        sum = 0
-        start = start_list[i]
-        end = end_list[i]
-
-        # get to an interval
-        while start < end and index_list[start] == -1:
-            start += 1
+    with nogil:
+        for i in range(num_tests):
+            sum = 0
+            start = start_list[i]
+            end = end_list[i]
 
-        if start == end:
-            continue
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index == -1:
+                continue
 
-        value_index = index_list[start]
-        while start < end and start < interval_end[value_index]:
-            temp_end = interval_end[value_index]
-            if temp_end > end:
-                temp_end = end
-            interval_size = temp_end - start
-            sum += value_map[value_index] * interval_size
+            value_index = first_index
+            if start < interval_start[value_index]:
+                start = interval_start[value_index]
+            while start < end and start < interval_end[value_index]:
+                temp_end = interval_end[value_index]
+                if temp_end > end:
+                    temp_end = end
+                interval_size = temp_end - start
+                sum += value_map[value_index] * interval_size
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-            start = interval_start[value_index]
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
+                start = interval_start[value_index]
 
-        result_view[i] = sum
+            result_view[i] = sum
 
     return result
 
 @cython.cdivision(True)
 @cython.boundscheck(False)
-def get_approx_means(double[:] bin_list, unsigned int[:] bin_coverage_list,
-                     int max_bin_size, int[:] start_list, int[:] end_list):
+def get_approx_means(const double[:] bins, const unsigned int[:] bin_coverages,
+                     const long long[:] bin_level_offsets, int max_bin_size,
+                     const int[:] start_list, const int[:] end_list):
+    # the smallest bins are max_bin_size long, the bins fully inside each
+    # search are summed from the coarsest levels of the pyramid that fit
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
@@ -160,279 +130,842 @@ def get_approx_means(double[:] bin_list, unsigned int[:] bin_coverage_list,
     result = np.full(num_tests, -1, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        start = start_list[i]
-        end = end_list[i]
+    with nogil:
+        for i in range(num_tests):
+            start = start_list[i]
+            end = end_list[i]
 
-        bin_index = <unsigned int>(start / max_bin_size)
-        bin_end = <unsigned int>((end - 1) / max_bin_size)
+            bin_index = <unsigned int>(start / max_bin_size)
+            bin_end = <unsigned int>((end - 1) / max_bin_size)
 
-        # special case where interval is within a single bin
-        if bin_index == bin_end:
-            if bin_coverage_list[bin_index] == 0:
+            # special case where interval is within a single bin
+            if bin_index == bin_end:
+                if bin_coverages[bin_index] == 0:
+                    continue
+                result_view[i] = bins[bin_index] / bin_coverages[bin_index]
                 continue
-            result_view[i] = bin_list[bin_index] / bin_coverage_list[bin_index]
-            continue
-
-        total = 0
-        numb_value = 0
-
-        # first bin
-        weight = bin_coverage_list[bin_index]
-        if weight > 0:
-            fraction = <double>(max_bin_size - start % max_bin_size) / max_bin_size
-            total += bin_list[bin_index] * fraction
-            numb_value += weight * fraction
-        bin_index += 1
-
-        # middle bins
-        while bin_index < bin_end:
-            weight = bin_coverage_list[bin_index]
+
+            total = 0
+            numb_value = 0
+
+            # first bin
+            weight = bin_coverages[bin_index]
             if weight > 0:
-                total += bin_list[bin_index]
-                numb_value += weight
+                fraction = <double>(max_bin_size - start % max_bin_size) / max_bin_size
+                total += bins[bin_index] * fraction
+                numb_value += weight * fraction
+
+            # middle bins
+            total += sum_bin_range(bins, bin_level_offsets, bin_index + 1,
+                                   bin_end)
+            numb_value += count_bin_range(bin_coverages, bin_level_offsets,
+                                          bin_index + 1, bin_end)
+
+            # last bin
+            weight = bin_coverages[bin_end]
+            if weight > 0:
+                fraction = <double>(end % max_bin_size) / max_bin_size
+                if fraction == 0:
+                    fraction = 1
+                total += bins[bin_end] * fraction
+                numb_value += weight * fraction
 
-            bin_index += 1
+            if numb_value == 0:
+                continue
 
-        # last bin
-        weight = bin_coverage_list[bin_index]
-        if weight > 0:
-            fraction = <double>(end % max_bin_size) / max_bin_size
-            if fraction == 0:
-                fraction = 1
-            total += bin_list[bin_index] * fraction
-            numb_value += weight * fraction
+            result_view[i] = total / numb_value
 
-        if numb_value == 0:
-            continue
+    return result
 
-        result_view[i] = total / numb_value
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def load_bin_ranges(const value_type[:] value_map, unsigned int size,
+                    const unsigned int[:] interval_start,
+                    const unsigned int[:] interval_end, unsigned int bin_size):
+    # smallest and largest value in each bin, 0 for bins without values
+    cdef size_t numb_bins = (<size_t>size + bin_size - 1) // bin_size
+    cdef size_t value_index, bin_index, first_bin, last_bin
+    cdef double value
+
+    bin_mins = np.full(numb_bins, DBL_MAX, dtype=np.float64)
+    bin_maxs = np.full(numb_bins, -DBL_MAX, dtype=np.float64)
+    cdef double[:] bin_mins_view = bin_mins
+    cdef double[:] bin_maxs_view = bin_maxs
+
+    with nogil:
+        for value_index in range(interval_start.shape[0]):
+            if interval_end[value_index] <= interval_start[value_index]:
+                continue
+
+            value = value_map[value_index]
+            first_bin = interval_start[value_index] / bin_size
+            last_bin = (interval_end[value_index] - 1) / bin_size
+            if last_bin >= numb_bins:
+                last_bin = numb_bins - 1
+
+            for bin_index in range(first_bin, last_bin + 1):
+                if value < bin_mins_view[bin_index]:
+                    bin_mins_view[bin_index] = value
+                if value > bin_maxs_view[bin_index]:
+                    bin_maxs_view[bin_index] = value
+
+    bin_mins[bin_mins == DBL_MAX] = 0
+    bin_maxs[bin_maxs == -DBL_MAX] = 0
+    return bin_mins, bin_maxs
+
+cdef inline void edge_coverage_range(unsigned int bin_coverage,
+                                     size_t bin_length, size_t inside_length,
+                                     double* low, double* high) nogil:
+    # fewest and most covered base pairs of a bin that can be inside a search
+    # which holds inside_length of its bin_length base pairs
+    cdef size_t outside_length = bin_length - inside_length
+
+    low[0] = 0
+    if bin_coverage > outside_length:
+        low[0] = bin_coverage - outside_length
+
+    high[0] = inside_length
+    if bin_coverage < inside_length:
+        high[0] = bin_coverage
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def get_approx_mean_errors(const double[:] bins, const unsigned int[:] bin_coverages,
+                           const long long[:] bin_level_offsets,
+                           const double[:] bin_mins, const double[:] bin_maxs,
+                           int max_bin_size, unsigned int size,
+                           const double[:] approx_means,
+                           const int[:] start_list, const int[:] end_list):
+    # largest difference between each approximate mean and the true mean
+    # the bins fully inside a search are exact, so the true mean only depends
+    # on how much of the two bins at the ends is covered inside the search and
+    # on their values, which are between the smallest and largest of each bin
+    # the mean is largest (or smallest) at one of the four ends of the ranges
+    # of covered base pairs, with every value at the largest (or smallest)
+    # the error is infinite when the search might not cover any base pairs
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+    assert tuple(start_list.shape) == tuple(approx_means.shape)
+
+    cdef size_t i, start, end, bin_end, bin_index, bin_start, bin_length
+    cdef size_t num_tests = start_list.size
+    cdef double approx, inner_total, inner_coverage, coverage, mean
+    cdef double lower, upper, first_coverage, last_coverage
+    cdef double coverage_ranges[4]
+    cdef int first_end, last_end
+
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            approx = approx_means[i]
+            if approx == -1:
+                continue
+
+            start = start_list[i]
+            end = end_list[i]
+
+            bin_index = <unsigned int>(start / max_bin_size)
+            bin_end = <unsigned int>((end - 1) / max_bin_size)
+
+            # the mean of part of a bin is between its smallest and largest
+            if bin_index == bin_end:
+                bin_start = bin_index * max_bin_size
+                bin_length = size - bin_start
+                if bin_length > <size_t>max_bin_size:
+                    bin_length = max_bin_size
+                if end > size:
+                    end = size
+                edge_coverage_range(bin_coverages[bin_index], bin_length,
+                                    end - start, &coverage_ranges[0],
+                                    &coverage_ranges[1])
+                if coverage_ranges[0] == 0:
+                    result_view[i] = INFINITY
+                else:
+                    result_view[i] = fmax(approx - bin_mins[bin_index],
+                                          bin_maxs[bin_index] - approx)
+                continue
+
+            inner_total = sum_bin_range(bins, bin_level_offsets,
+                                        bin_index + 1, bin_end)
+            inner_coverage = count_bin_range(bin_coverages, bin_level_offsets,
+                                             bin_index + 1, bin_end)
+
+            # first bin
+            bin_start = bin_index * max_bin_size
+            bin_length = size - bin_start
+            if bin_length > <size_t>max_bin_size:
+                bin_length = max_bin_size
+            edge_coverage_range(bin_coverages[bin_index], bin_length,
+                                bin_start + bin_length - start,
+                                &coverage_ranges[0], &coverage_ranges[1])
+
+            # last bin
+            bin_start = bin_end * max_bin_size
+            bin_length = size - bin_start
+            if bin_length > <size_t>max_bin_size:
+                bin_length = max_bin_size
+            if end > size:
+                end = size
+            edge_coverage_range(bin_coverages[bin_end], bin_length,
+                                end - bin_start,
+                                &coverage_ranges[2], &coverage_ranges[3])
+
+            lower = DBL_MAX
+            upper = -DBL_MAX
+            for first_end in range(2):
+                first_coverage = coverage_ranges[first_end]
+                for last_end in range(2, 4):
+                    last_coverage = coverage_ranges[last_end]
+                    coverage = inner_coverage + first_coverage + last_coverage
+                    if coverage == 0:
+                        continue
+
+                    mean = (inner_total + first_coverage * bin_maxs[bin_index] +
+                            last_coverage * bin_maxs[bin_end]) / coverage
+                    if mean > upper:
+                        upper = mean
+                    mean = (inner_total + first_coverage * bin_mins[bin_index] +
+                            last_coverage * bin_mins[bin_end]) / coverage
+                    if mean < lower:
+                        lower = mean
+
+            # the search might not cover any base pairs, so has no mean
+            if inner_coverage + coverage_ranges[0] + coverage_ranges[2] == 0:
+                result_view[i] = INFINITY
+            elif lower <= upper:
+                result_view[i] = fmax(upper - approx, approx - lower)
 
     return result
 
 @cython.cdivision(True)
 @cython.boundscheck(False)
-cpdef get_exact_means(double[:] value_map, int[:] index_list,
-                 unsigned int[:] interval_start, unsigned int[:] interval_end,
-                 int[:] start_list, int[:] end_list):
+cpdef get_exact_means(const value_type[:] value_map, const int[:] index_list,
+                 const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                 const int[:] start_list, const int[:] end_list):
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t i, num_tests = start_list.size, start, end, value_index
+    cdef Py_ssize_t first_index
     cdef unsigned int numb_value, temp_end, interval_size, numb_intervals = interval_start.size
     cdef double total
 
     result = np.full(num_tests, -1, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        total = 0
-        numb_value = 0
-        start = start_list[i]
-        end = end_list[i]
-
-        # get to an interval
-        while start < end and index_list[start] == -1:
-            start += 1
-
-        if start == end:
-            continue
+    with nogil:
+        for i in range(num_tests):
+            total = 0
+            numb_value = 0
+            start = start_list[i]
+            end = end_list[i]
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index == -1:
+                continue
 
-        value_index = index_list[start]
-        while start < end:
-            temp_end = interval_end[value_index]
-            if temp_end > end:
-                temp_end = end
-            interval_size = temp_end - start
+            value_index = first_index
+            if start < interval_start[value_index]:
+                start = interval_start[value_index]
+            while start < end:
+                temp_end = interval_end[value_index]
+                if temp_end > end:
+                    temp_end = end
+                interval_size = temp_end - start
 
-            total += value_map[value_index] * interval_size
-            numb_value += interval_size
+                total += value_map[value_index] * interval_size
+                numb_value += interval_size
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-            start = interval_start[value_index]
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
+                start = interval_start[value_index]
 
-        if numb_value != 0:
-            result_view[i] = total / numb_value
+            if numb_value != 0:
+                result_view[i] = total / numb_value
 
     return result
 
-def get_minimums(double[:] value_map, int[:] index_list,
-                 unsigned int[:] interval_start, unsigned int[:] interval_end,
-                 int[:] start_list, int[:] end_list):
+def get_minimums(const value_type[:] value_map, const int[:] index_list,
+                 const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                 const int[:] start_list, const int[:] end_list):
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t i, num_tests = start_list.size, start, end, value_index
+    cdef Py_ssize_t first_index
     cdef size_t numb_intervals = interval_start.size
     cdef double minimum
 
     result = np.full(num_tests, -1, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        minimum = DBL_MAX
-        start = start_list[i]
-        end = end_list[i]
-
-        # get to an interval
-        while start < end and index_list[start] == -1:
-            start += 1
+    with nogil:
+        for i in range(num_tests):
+            minimum = DBL_MAX
+            start = start_list[i]
+            end = end_list[i]
 
-        if start == end:
-            continue
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index == -1:
+                continue
 
-        value_index = index_list[start]
-        while interval_start[value_index] < end:
-            if value_map[value_index] < minimum:
-                minimum = value_map[value_index]
+            value_index = first_index
+            while interval_start[value_index] < end:
+                if value_map[value_index] < minimum:
+                    minimum = value_map[value_index]
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
 
-        if minimum != DBL_MAX:
-            result_view[i] = minimum
+            if minimum != DBL_MAX:
+                result_view[i] = minimum
 
     return result
 
-def get_maximums(double[:] value_map, int[:] index_list,
-                 unsigned int[:] interval_start, unsigned int[:] interval_end,
-                 int[:] start_list, int[:] end_list):
+def get_maximums(const value_type[:] value_map, const int[:] index_list,
+                 const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                 const int[:] start_list, const int[:] end_list):
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t i, num_tests = start_list.size, start, end, value_index
+    cdef Py_ssize_t first_index
     cdef size_t numb_intervals = interval_start.size
     cdef double maximum, value
 
     result = np.full(num_tests, -1, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        maximum = -1
-        start = start_list[i]
-        end = end_list[i]
+    with nogil:
+        for i in range(num_tests):
+            maximum = -1
+            start = start_list[i]
+            end = end_list[i]
 
-        # get to an interval
-        while start < end and index_list[start] == -1:
-            start += 1
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index == -1:
+                continue
 
-        if start == end:
-            continue
+            value_index = first_index
+            while interval_start[value_index] < end:
+                value = value_map[value_index]
+                if value > maximum:
+                    maximum = value
 
-        value_index = index_list[start]
-        while interval_start[value_index] < end:
-            value = value_map[value_index]
-            if value > maximum:
-                maximum = value
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-
-        if maximum != -1:
-            result_view[i] = maximum
+            if maximum != -1:
+                result_view[i] = maximum
 
     return result
 
-def get_coverages(int[:] index_list, unsigned int[:] interval_start,
-                  unsigned int[:] interval_end, int[:] start_list, int[:] end_list):
+def get_coverages(const int[:] index_list, const unsigned int[:] interval_start,
+                  const unsigned int[:] interval_end, const int[:] start_list, const int[:] end_list):
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t i, num_tests = start_list.size, start, end, current_start
+    cdef Py_ssize_t first_index
     cdef size_t numb_intervals = interval_start.size
     cdef unsigned int numb_covered, temp_end, value_index
 
     result = np.zeros(num_tests, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        numb_covered = 0
-        start = start_list[i]
-        end = end_list[i]
-        current_start = start
+    with nogil:
+        for i in range(num_tests):
+            numb_covered = 0
+            start = start_list[i]
+            end = end_list[i]
+            current_start = start
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, current_start, end)
+            if first_index == -1:
+                continue
 
-        # get to an interval
-        while current_start < end and index_list[current_start] == -1:
-            current_start += 1
+            value_index = first_index
+            if current_start < interval_start[value_index]:
+                current_start = interval_start[value_index]
+            while current_start < end:
+                temp_end = interval_end[value_index]
+                if temp_end > end:
+                    temp_end = end
+                numb_covered += (temp_end - current_start)
 
-        if current_start == end:
-            continue
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
+                current_start = interval_start[value_index]
 
-        value_index = index_list[current_start]
-        while current_start < end:
-            temp_end = interval_end[value_index]
-            if temp_end > end:
-                temp_end = end
-            numb_covered += (temp_end - current_start)
+            if numb_covered > 0:
+                result_view[i] = <double>numb_covered / (end - start)
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-            current_start = interval_start[value_index]
+    return result
 
-        if numb_covered > 0:
-            result_view[i] = <double>numb_covered / (end - start)
+@cython.cdivision(True)
+def get_variances(const value_type[:] value_map, const int[:] index_list,
+                  const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                  const int[:] start_list, const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size, start, end, value_index
+    cdef Py_ssize_t first_index
+    cdef size_t numb_intervals = interval_start.size
+    cdef unsigned int temp_end
+    cdef double numb_value, mean, squares, shift
+
+    result = np.full(num_tests, -1, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            start = start_list[i]
+            end = end_list[i]
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index == -1:
+                continue
+
+            numb_value = 0
+            mean = 0
+            squares = 0
+
+            # values are shifted by the first one so the differences between
+            # them are exact and the mean stays small
+            shift = value_map[first_index]
+
+            value_index = first_index
+            if start < interval_start[value_index]:
+                start = interval_start[value_index]
+            while start < end:
+                temp_end = interval_end[value_index]
+                if temp_end > end:
+                    temp_end = end
+
+                add_weighted_value(value_map[value_index] - shift,
+                                   temp_end - start, &numb_value, &mean,
+                                   &squares)
+
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
+                start = interval_start[value_index]
+
+            if numb_value != 0:
+                result_view[i] = squares / numb_value
 
     return result
 
-def get_stds(double[:] value_map, int[:] index_list,
-                 unsigned int[:] interval_start, unsigned int[:] interval_end,
-                 int[:] start_list, int[:] end_list):
+def get_stds(const value_type[:] value_map, const int[:] index_list,
+             const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+             const int[:] start_list, const int[:] end_list):
+    result = get_variances(value_map, index_list, interval_start, interval_end,
+                           start_list, end_list)
+    np.sqrt(result, out=result, where=result > 0)
+    return result
 
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def get_multi_stats(const value_type[:] value_map, const int[:] index_list,
+                    const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                    const int[:] start_list, const int[:] end_list):
+    # every statistic of MULTI_STATS from a single walk over the intervals
+    # overlapping each search
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
-    cdef size_t i, num_tests = start_list.size, start, end, j
+    cdef size_t i, num_tests = start_list.size, start, end, current_start
+    cdef Py_ssize_t first_index
+    cdef size_t value_index, numb_intervals = interval_start.size
+    cdef unsigned int numb_value, temp_end, interval_size
+    cdef double total, weight, running_mean, squares, shift, value
+    cdef double maximum, minimum, mean
+
+    result = np.empty((num_tests, NUMB_MULTI_STATS), dtype=np.float64)
+    cdef double[:, :] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            total = 0
+            weight = 0
+            running_mean = 0
+            squares = 0
+            numb_value = 0
+            maximum = -1
+            minimum = DBL_MAX
+            start = start_list[i]
+            end = end_list[i]
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index != -1:
+                # values are shifted by the first one so the differences
+                # between them are exact and the mean stays small
+                shift = value_map[first_index]
+
+                value_index = first_index
+                current_start = start
+                if current_start < interval_start[value_index]:
+                    current_start = interval_start[value_index]
+                while current_start < end:
+                    temp_end = interval_end[value_index]
+                    if temp_end > end:
+                        temp_end = end
+                    interval_size = temp_end - current_start
+
+                    value = value_map[value_index]
+                    total += value * interval_size
+                    numb_value += interval_size
+                    add_weighted_value(value - shift, interval_size, &weight,
+                                       &running_mean, &squares)
+                    if value > maximum:
+                        maximum = value
+                    if value < minimum:
+                        minimum = value
+
+                    value_index += 1
+                    if value_index == numb_intervals:
+                        break
+                    current_start = interval_start[value_index]
+
+            mean = -1
+            result_view[i, VARIANCE_COLUMN] = -1
+            result_view[i, STD_COLUMN] = -1
+            result_view[i, COVERAGE_COLUMN] = 0
+            if numb_value != 0:
+                mean = total / numb_value
+                result_view[i, COVERAGE_COLUMN] = <double>numb_value / (end - start)
+                result_view[i, VARIANCE_COLUMN] = squares / weight
+                result_view[i, STD_COLUMN] = sqrt(squares / weight)
+
+            result_view[i, MEAN_COLUMN] = mean
+            result_view[i, MAX_COLUMN] = maximum
+            result_view[i, MIN_COLUMN] = minimum if minimum != DBL_MAX else -1
+            result_view[i, SUM_COLUMN] = total
+
+    return result
+
+@cython.cdivision(True)
+def get_prefix_means(const value_type[:] value_map, const int[:] index_list,
+                     const unsigned int[:] interval_start,
+                     const unsigned int[:] interval_end, const double[:] value_sums,
+                     const long long[:] length_sums, const int[:] start_list,
+                     const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size
+    cdef double total
+    cdef long long numb_covered
 
     result = np.full(num_tests, -1, dtype=np.float64)
     cdef double[:] result_view = result
-    cdef double std, difference, value
-    cdef unsigned int numb_value, interval_size, value_index, temp_end
-    cdef size_t numb_intervals = interval_start.size
 
-    cdef double[:] means = get_exact_means(value_map, index_list, interval_start,
-                            interval_end, start_list, end_list)
+    with nogil:
+        for i in range(num_tests):
+            sum_interval_range(value_map, index_list, interval_start, interval_end,
+                               value_sums, length_sums, start_list[i],
+                               end_list[i], &total, &numb_covered)
+
+            if numb_covered != 0:
+                result_view[i] = total / numb_covered
+
+    return result
+
+def get_prefix_sums(const value_type[:] value_map, const int[:] index_list,
+                    const unsigned int[:] interval_start,
+                    const unsigned int[:] interval_end, const double[:] value_sums,
+                    const long long[:] length_sums, const int[:] start_list,
+                    const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size
+    cdef double total
+    cdef long long numb_covered
+
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            sum_interval_range(value_map, index_list, interval_start, interval_end,
+                               value_sums, length_sums, start_list[i],
+                               end_list[i], &total, &numb_covered)
+
+            result_view[i] = total
+
+    return result
+
+@cython.cdivision(True)
+def get_prefix_coverages(const value_type[:] value_map, const int[:] index_list,
+                         const unsigned int[:] interval_start,
+                         const unsigned int[:] interval_end, const double[:] value_sums,
+                         const long long[:] length_sums, const int[:] start_list,
+                         const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size
+    cdef double total
+    cdef long long numb_covered
+
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            sum_interval_range(value_map, index_list, interval_start, interval_end,
+                               value_sums, length_sums, start_list[i],
+                               end_list[i], &total, &numb_covered)
+
+            if numb_covered > 0:
+                result_view[i] = <double>numb_covered / (end_list[i] - start_list[i])
+
+    return result
+
+@cython.cdivision(True)
+def get_prefix_variances(const value_type[:] value_map, const int[:] index_list,
+                         const unsigned int[:] interval_start,
+                         const unsigned int[:] interval_end,
+                         const double[:, :, :] moment_table,
+                         const int[:] start_list, const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size
+    cdef double weight, mean, squares, shift
+
+    result = np.full(num_tests, -1, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            sum_moment_range(value_map, index_list, interval_start, interval_end,
+                             moment_table, start_list[i], end_list[i],
+                             &weight, &mean, &squares, &shift)
+
+            if weight == 0:
+                continue
+
+            result_view[i] = squares / weight
+
+    return result
+
+def get_prefix_stds(const value_type[:] value_map, const int[:] index_list,
+                    const unsigned int[:] interval_start,
+                    const unsigned int[:] interval_end,
+                    const double[:, :, :] moment_table,
+                    const int[:] start_list, const int[:] end_list):
+    result = get_prefix_variances(value_map, index_list, interval_start,
+                                  interval_end, moment_table, start_list,
+                                  end_list)
+    np.sqrt(result, out=result, where=result > 0)
+    return result
 
-    for i in range(num_tests):
-        mean = means[i]
-        if mean == -1:
-            continue
+def get_range_maximums(const value_type[:] value_map, const int[:] index_list,
+                       const unsigned int[:] interval_start,
+                       const unsigned int[:] interval_end, const int[:, :] max_table,
+                       const int[:] start_list, const int[:] end_list):
 
-        start = start_list[i]
-        end = end_list[i]
+    assert tuple(start_list.shape) == tuple(end_list.shape)
 
-        # get to an interval
-        while start < end and index_list[start] == -1:
-            start += 1
+    cdef size_t i, num_tests = start_list.size
+    cdef Py_ssize_t first_index, last_index
+    cdef double maximum
 
-        if start == end:
-            continue
+    result = np.full(num_tests, -1, dtype=np.float64)
+    cdef double[:] result_view = result
 
-        std = 0
-        numb_value = 0
+    with nogil:
+        for i in range(num_tests):
+            first_index = find_interval_range(index_list, interval_start,
+                                              interval_end, start_list[i],
+                                              end_list[i], &last_index)
+            if first_index >= last_index:
+                continue
 
-        value_index = index_list[start]
-        while start < end:
-            temp_end = interval_end[value_index]
-            if temp_end > end:
-                temp_end = end
+            maximum = value_map[find_range_best(value_map, max_table, first_index,
+                                                last_index, True)]
+            if maximum > -1:
+                result_view[i] = maximum
 
-            interval_size = temp_end - start
-            difference = value_map[value_index] - mean
-            std += difference * difference * interval_size
-            numb_value += interval_size
+    return result
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-            start = interval_start[value_index]
+def get_range_minimums(const value_type[:] value_map, const int[:] index_list,
+                       const unsigned int[:] interval_start,
+                       const unsigned int[:] interval_end, const int[:, :] min_table,
+                       const int[:] start_list, const int[:] end_list):
 
-        if numb_value == 0:
-            continue
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size
+    cdef Py_ssize_t first_index, last_index
+
+    result = np.full(num_tests, -1, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            first_index = find_interval_range(index_list, interval_start,
+                                              interval_end, start_list[i],
+                                              end_list[i], &last_index)
+            if first_index >= last_index:
+                continue
+
+            result_view[i] = value_map[find_range_best(value_map, min_table,
+                                                       first_index, last_index,
+                                                       False)]
+
+    return result
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def get_quantiles(const value_type[:] value_map, const int[:] index_list,
+                  const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                  const int[:] start_list, const int[:] end_list, double quantile):
+    # weighted quantile of the values of the base pairs of each search, found by
+    # selecting from the intervals it overlaps
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size, start, end
+    cdef Py_ssize_t first_index, last_index, value_index, numb_values
+    cdef Py_ssize_t capacity = 1024
+    cdef double total
+    cdef bint enough_memory = True
+
+    result = np.full(num_tests, -1, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    cdef double* values = <double*>malloc(capacity * sizeof(double))
+    cdef double* weights = <double*>malloc(capacity * sizeof(double))
+
+    try:
+        if values == NULL or weights == NULL:
+            raise MemoryError()
+
+        with nogil:
+            for i in range(num_tests):
+                start = start_list[i]
+                end = end_list[i]
+
+                first_index = find_interval_range(index_list, interval_start,
+                                                  interval_end, start, end,
+                                                  &last_index)
+
+                # room for every interval
+                if not reserve_weighted_values(&values, &weights, &capacity,
+                                               last_index - first_index + 1):
+                    enough_memory = False
+                    break
+
+                numb_values = 0
+                total = 0
+                for value_index in range(first_index, last_index):
+                    weights[numb_values] = clipped_size(
+                        interval_start, interval_end, value_index, start, end)
+                    if weights[numb_values] == 0:
+                        continue
+
+                    values[numb_values] = value_map[value_index]
+                    total += weights[numb_values]
+                    numb_values += 1
+
+                if numb_values == 0:
+                    continue
+
+                result_view[i] = select_weighted_value(values, weights,
+                                                       numb_values,
+                                                       quantile * total)
+
+        if not enough_memory:
+            raise MemoryError()
+    finally:
+        free(values)
+        free(weights)
+
+    return result
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def get_indexed_quantiles(const value_type[:] value_map, const int[:] index_list,
+                          const unsigned int[:] interval_start,
+                          const unsigned int[:] interval_end,
+                          const double[:] quantile_values, const long long[:] value_ranks,
+                          const int[:, :] zeros_before, const long long[:, :] left_weights,
+                          const long long[:] size_sums,
+                          const int[:] start_list, const int[:] end_list, double quantile):
+    # weighted quantile of the values of the base pairs of each search from the
+    # quantile index, with the clipped first and last intervals as extra values
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size, start, end
+    cdef Py_ssize_t first_index, last_index
+    cdef double total
+    cdef int numb_extra
+    cdef long long extra_ranks[2]
+    cdef double extra_weights[2]
+
+    result = np.full(num_tests, -1, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            start = start_list[i]
+            end = end_list[i]
+
+            first_index = find_interval_range(index_list, interval_start,
+                                              interval_end, start, end,
+                                              &last_index)
+            if first_index >= last_index:
+                continue
 
-        std /= (numb_value)
-        result_view[i] = sqrt(std)
+            # the first and last intervals only count their base pairs inside
+            # the search
+            numb_extra = 0
+            total = 0
+            if first_index < last_index:
+                extra_ranks[0] = value_ranks[first_index]
+                extra_weights[0] = clipped_size(interval_start, interval_end,
+                                                first_index, start, end)
+                total += extra_weights[0]
+                numb_extra = 1
+            if last_index - first_index > 1:
+                extra_ranks[1] = value_ranks[last_index - 1]
+                extra_weights[1] = clipped_size(interval_start, interval_end,
+                                                last_index - 1, start, end)
+                total += extra_weights[1]
+                numb_extra = 2
+
+            # the intervals between are counted whole by the index
+            if last_index - first_index > 2:
+                first_index += 1
+                last_index -= 1
+                total += size_sums[last_index] - size_sums[first_index]
+            else:
+                first_index = 0
+                last_index = 0
+
+            result_view[i] = quantile_values[select_indexed_rank(
+                zeros_before, left_weights, first_index, last_index,
+                extra_ranks, extra_weights, numb_extra, quantile * total)]
 
     return result
@@ -1,39 +1,33 @@
 import numpy as np
 cimport cython
+from pyBedGraph.util import sum_over_bins
 from libc.float cimport DBL_MAX
-from libc.math cimport ceil, sqrt
+from libc.math cimport ceil, sqrt, fabs, fmax
+from libc.stdlib cimport malloc, free
+from pyBedGraph.interval_search cimport (value_type, find_first_interval, find_interval_range,
+                                         find_range_best, sum_interval_range,
+                                         sum_moment_range,
+                                         MEAN_COLUMN, MAX_COLUMN, MIN_COLUMN,
+                                         COVERAGE_COLUMN, SUM_COLUMN, STD_COLUMN,
+                                         VARIANCE_COLUMN, NUMB_MULTI_STATS,
+                                         add_weighted_value, select_weighted_value,
+                                         select_indexed_rank, reserve_weighted_values,
+                                         clipped_size, sum_bin_range)
+
+# statistics found by get_multi_stats, one column each
+MULTI_STATS = ['mean', 'max', 'min', 'coverage', 'sum', 'std', 'variance']
 
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing.
 
-def load_smallest_bins(double[:] value_map, int[:] index_list, unsigned int size,
-                       unsigned int[:] interval_start, unsigned int[:] interval_end,
+def load_smallest_bins(const value_type[:] value_map, unsigned int size,
+                       const unsigned int[:] interval_start, const unsigned int[:] interval_end,
                        unsigned int bin_size):
-    cdef size_t bin_index
-
-    cdef unsigned int numb_bins = <int>ceil(size / bin_size)
-
-    bins = np.zeros(numb_bins, dtype=np.float64)
-    cdef double[:] bins_view = bins
+    # bins keep their signed totals so the bins inside a search are exact
+    return sum_over_bins(interval_start, interval_end, value_map, size,
+                         bin_size)
 
-    cdef unsigned int start, end
-    cdef double value
-
-    for bin_index in range(numb_bins):
-        start = bin_index * bin_size
-        end = start + bin_size
-
-        if end > size:
-            end = size
-
-        value = get_total(value_map, index_list, interval_start,
-                                     interval_end, start, end)
-        if value > 0:
-            bins_view[bin_index] = value
-
-    return bins
-
-def load_bins(double[:] prev_bin_level_mean):
+def load_bins(const double[:] prev_bin_level_mean):
 
     cdef size_t prev_bin_level_size = prev_bin_level_mean.size
     cdef size_t bin_index
@@ -57,392 +51,916 @@ def load_bins(double[:] prev_bin_level_mean):
         if prev_bin_index + 1 < prev_bin_level_size:
             value += prev_bin_level_mean[prev_bin_index + 1]
 
-        if value > 0:
-            bins_view[bin_index] = value
+        bins_view[bin_index] = value
 
     return bins
 
-cdef get_total(double[:] value_map, int[:] index_list,
-                unsigned int[:] interval_start, unsigned int[:] interval_end,
-                unsigned int start, unsigned int end):
+# contiguous array
+#def mean(const double[::1] values, const int[::1] start_list, const int[::1] end_list):
+cpdef get_exact_means(const value_type[:] value_map, const int[:] index_list,
+                 const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                 const int[:] start_list, const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, start, end, bin_end, bin_index
+    cdef Py_ssize_t first_index
+    cdef size_t num_tests = start_list.size, numb_intervals = interval_start.size
+    cdef double total, value
+    cdef unsigned int numb_value, interval_size, temp_end, value_index, curr_start
 
-    cdef double total = 0, value
-    cdef unsigned int value_index, temp_end, interval_size
-    cdef size_t i, numb_intervals = interval_start.size
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
 
-    # get to an interval
-    while start < end and index_list[start] == -1:
-        start += 1
+    with nogil:
+        for i in range(num_tests):
+            total = 0
+            start = start_list[i]
+            end = end_list[i]
+            curr_start = start
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, curr_start, end)
+            if first_index == -1:
+                continue
 
-    if start == end:
-        return total
+            value_index = first_index
+            if curr_start < interval_start[value_index]:
+                curr_start = interval_start[value_index]
+            while curr_start < end:
+                temp_end = interval_end[value_index]
+                if temp_end > end:
+                    temp_end = end
+                interval_size = temp_end - curr_start
 
-    value_index = index_list[start]
-    while start < end and start < interval_end[value_index]:
-        temp_end = interval_end[value_index]
-        if temp_end > end:
-            temp_end = end
-        interval_size = temp_end - start
+                total += value_map[value_index] * interval_size
 
-        total += value_map[value_index] * interval_size
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
+                curr_start = interval_start[value_index]
 
-        value_index += 1
-        if value_index == numb_intervals:
-            break
-        start = interval_start[value_index]
+            if total != 0:
+                result_view[i] = total / (end - start)
 
-    return total
+    return result
 
-# contiguous array
-#def mean(double[::1] values, int[::1] start_list, int[::1] end_list):
-cpdef get_exact_means(double[:] value_map, int[:] index_list,
-                 unsigned int[:] interval_start, unsigned int[:] interval_end,
-                 int[:] start_list, int[:] end_list):
+def get_approx_means(const double[:] bins, const long long[:] bin_level_offsets,
+                     int max_bin_size, const int[:] start_list,
+                     const int[:] end_list):
+    # the smallest bins are max_bin_size long, the bins fully inside each
+    # search are summed from the coarsest levels of the pyramid that fit
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t i, start, end, bin_end, bin_index
-    cdef size_t num_tests = start_list.size, numb_intervals = interval_start.size
-    cdef double total, value
-    cdef unsigned int numb_value, interval_size, temp_end, value_index, curr_start
+    cdef size_t num_tests = start_list.size
+    cdef double total, fraction
 
     result = np.zeros(num_tests, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        total = 0
-        start = start_list[i]
-        end = end_list[i]
-        curr_start = start
+    with nogil:
+        for i in range(num_tests):
+            start = start_list[i]
+            end = end_list[i]
 
-        # get to an interval
-        while curr_start < end and index_list[curr_start] == -1:
-            curr_start += 1
+            bin_index = <unsigned int>(start / max_bin_size)
+            bin_end = <unsigned int>((end - 1) / max_bin_size)
 
-        if curr_start == end:
-            continue
+            # special case where interval is within a single bin
+            if bin_index == bin_end:
+                result_view[i] = bins[bin_index] / (end - start)
+                continue
 
-        value_index = index_list[curr_start]
-        while curr_start < end:
-            temp_end = interval_end[value_index]
-            if temp_end > end:
-                temp_end = end
-            interval_size = temp_end - curr_start
+            # first bin
+            fraction = <double>(max_bin_size - start % max_bin_size) / max_bin_size
+            total = bins[bin_index] * fraction
 
-            total += value_map[value_index] * interval_size
+            # middle bins
+            total += sum_bin_range(bins, bin_level_offsets, bin_index + 1,
+                                   bin_end)
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-            curr_start = interval_start[value_index]
+            # last bin
+            fraction = <double>(end % max_bin_size) / max_bin_size
+            if fraction == 0:
+                fraction = 1
+            total += bins[bin_end] * fraction
 
-        if total != 0:
             result_view[i] = total / (end - start)
 
     return result
 
-def get_approx_means(double[:] bin_list, int max_bin_size, int[:] start_list,
-                    int[:] end_list):
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def load_bin_ranges(const value_type[:] value_map, unsigned int size,
+                    const unsigned int[:] interval_start,
+                    const unsigned int[:] interval_end, unsigned int bin_size):
+    # smallest and largest value in each bin, where missing base pairs are 0
+    cdef size_t numb_bins = (<size_t>size + bin_size - 1) // bin_size
+    cdef size_t value_index, bin_index, first_bin, last_bin
+    cdef size_t bin_start, bin_end, temp_start, temp_end
+    cdef double value
+
+    bin_mins = np.full(numb_bins, DBL_MAX, dtype=np.float64)
+    bin_maxs = np.full(numb_bins, -DBL_MAX, dtype=np.float64)
+    bin_coverage = np.zeros(numb_bins, dtype=np.int64)
+    cdef double[:] bin_mins_view = bin_mins
+    cdef double[:] bin_maxs_view = bin_maxs
+    cdef long long[:] bin_coverage_view = bin_coverage
+
+    with nogil:
+        for value_index in range(interval_start.shape[0]):
+            if interval_end[value_index] <= interval_start[value_index]:
+                continue
+
+            value = value_map[value_index]
+            first_bin = interval_start[value_index] / bin_size
+            last_bin = (interval_end[value_index] - 1) / bin_size
+            if last_bin >= numb_bins:
+                last_bin = numb_bins - 1
+
+            for bin_index in range(first_bin, last_bin + 1):
+                if value < bin_mins_view[bin_index]:
+                    bin_mins_view[bin_index] = value
+                if value > bin_maxs_view[bin_index]:
+                    bin_maxs_view[bin_index] = value
+
+                bin_start = bin_index * bin_size
+                bin_end = bin_start + bin_size
+                temp_start = interval_start[value_index]
+                if temp_start < bin_start:
+                    temp_start = bin_start
+                temp_end = interval_end[value_index]
+                if temp_end > bin_end:
+                    temp_end = bin_end
+                bin_coverage_view[bin_index] += temp_end - temp_start
+
+    # bins with missing base pairs also hold the value 0
+    bin_lengths = np.minimum(bin_size, size - np.arange(numb_bins) * bin_size)
+    missing = bin_coverage < bin_lengths
+    bin_mins[missing] = np.minimum(bin_mins[missing], 0)
+    bin_maxs[missing] = np.maximum(bin_maxs[missing], 0)
+    return bin_mins, bin_maxs
+
+cdef inline double edge_error(double approx_total, size_t inside_length,
+                              double bin_min, double bin_max) nogil:
+    # largest difference between the approximate total of the part of a bin
+    # inside a search and its true total, which is between inside_length
+    # times the smallest and largest value of the bin
+    return fmax(fabs(approx_total - inside_length * bin_min),
+                fabs(inside_length * bin_max - approx_total))
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def get_approx_mean_errors(const double[:] bins, const long long[:] bin_level_offsets,
+                           const double[:] bin_mins, const double[:] bin_maxs,
+                           int max_bin_size, unsigned int size,
+                           const double[:] approx_means,
+                           const int[:] start_list, const int[:] end_list):
+    # largest difference between each approximate mean and the true mean
+    # the bins fully inside a search are exact, so only the parts of the two
+    # bins at the ends add to the error
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
+    assert tuple(start_list.shape) == tuple(approx_means.shape)
 
-    cdef size_t i, start, end, bin_end, bin_index
+    cdef size_t i, start, end, bin_end, bin_index, bin_start, inside_end
     cdef size_t num_tests = start_list.size
-    cdef double total, numb_value, fraction, value
+    cdef double approx, fraction, error
 
     result = np.zeros(num_tests, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        start = start_list[i]
-        end = end_list[i]
+    with nogil:
+        for i in range(num_tests):
+            start = start_list[i]
+            end = end_list[i]
 
-        bin_index = <unsigned int>(start / max_bin_size)
-        bin_end = <unsigned int>((end - 1) / max_bin_size)
+            bin_index = <unsigned int>(start / max_bin_size)
+            bin_end = <unsigned int>((end - 1) / max_bin_size)
 
-        # special case where interval is within a single bin
-        if bin_index == bin_end:
-            if bin_list[bin_index] == 0:
+            # the mean of part of a bin is between its smallest and largest
+            if bin_index == bin_end:
+                approx = approx_means[i]
+                result_view[i] = fmax(fabs(approx - bin_mins[bin_index]),
+                                      fabs(bin_maxs[bin_index] - approx))
                 continue
-            result_view[i] = bin_list[bin_index] / (end - start)
-            continue
 
-        total = 0
-        numb_value = 0
-
-        # first bin
-        value = bin_list[bin_index]
-        if value > 0:
+            # first bin
             fraction = <double>(max_bin_size - start % max_bin_size) / max_bin_size
-            total += bin_list[bin_index] * fraction
-            numb_value += max_bin_size * fraction
-        bin_index += 1
-
-        # middle bins
-        while bin_index < bin_end:
-            value = bin_list[bin_index]
-            if value > 0:
-                total += bin_list[bin_index]
-                numb_value += max_bin_size
-
-            bin_index += 1
-
-        # last bin
-        value = bin_list[bin_index]
-        if value > 0:
+            inside_end = (bin_index + 1) * max_bin_size
+            if inside_end > size:
+                inside_end = size
+            error = edge_error(bins[bin_index] * fraction, inside_end - start,
+                               bin_mins[bin_index], bin_maxs[bin_index])
+
+            # last bin
             fraction = <double>(end % max_bin_size) / max_bin_size
             if fraction == 0:
                 fraction = 1
-            total += bin_list[bin_index] * fraction
-            numb_value += max_bin_size * fraction
-
-        if numb_value == 0:
-            continue
+            bin_start = bin_end * max_bin_size
+            inside_end = end
+            if inside_end > size:
+                inside_end = size
+            error += edge_error(bins[bin_end] * fraction, inside_end - bin_start,
+                                bin_mins[bin_end], bin_maxs[bin_end])
 
-        result_view[i] = total / (end - start)
+            result_view[i] = error / (end - start)
 
     return result
 
-def get_minimums(double[:] value_map, int[:] index_list,
-                 unsigned int[:] interval_start, unsigned int[:] interval_end,
-                 int[:] start_list, int[:] end_list):
+def get_minimums(const value_type[:] value_map, const int[:] index_list,
+                 const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                 const int[:] start_list, const int[:] end_list):
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t i, num_tests = start_list.size, start, end, value_index
+    cdef Py_ssize_t first_index
     cdef size_t numb_intervals = interval_start.size
     cdef double minimum
 
     result = np.zeros(num_tests, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        minimum = DBL_MAX
-        start = start_list[i]
-        end = end_list[i]
-
-        # get to an interval
-        while start < end and index_list[start] == -1:
-            minimum = 0
-            start += 1
+    with nogil:
+        for i in range(num_tests):
+            minimum = DBL_MAX
+            start = start_list[i]
+            end = end_list[i]
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index == -1 or interval_start[first_index] > start:
+                minimum = 0
+            if first_index == -1:
+                continue
 
-        if start == end:
-            continue
+            value_index = first_index
+            while interval_start[value_index] < end:
+                if value_map[value_index] < minimum:
+                    minimum = value_map[value_index]
 
-        value_index = index_list[start]
-        while interval_start[value_index] < end:
-            if value_map[value_index] < minimum:
-                minimum = value_map[value_index]
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-
-        if minimum != DBL_MAX:
-            result_view[i] = minimum
+            if minimum != DBL_MAX:
+                result_view[i] = minimum
 
     return result
 
-def get_maximums(double[:] value_map, int[:] index_list,
-                 unsigned int[:] interval_start, unsigned int[:] interval_end,
-                 int[:] start_list, int[:] end_list):
+def get_maximums(const value_type[:] value_map, const int[:] index_list,
+                 const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                 const int[:] start_list, const int[:] end_list):
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t i, num_tests = start_list.size, start, end, value_index
+    cdef Py_ssize_t first_index
     cdef size_t numb_intervals = interval_start.size
     cdef double maximum, value
 
     result = np.zeros(num_tests, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        maximum = 0
-        start = start_list[i]
-        end = end_list[i]
+    with nogil:
+        for i in range(num_tests):
+            maximum = 0
+            start = start_list[i]
+            end = end_list[i]
 
-        # get to an interval
-        while start < end and index_list[start] == -1:
-            start += 1
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index == -1:
+                continue
 
-        if start == end:
-            continue
+            value_index = first_index
+            while interval_start[value_index] < end:
+                value = value_map[value_index]
+                if value > maximum:
+                    maximum = value
 
-        value_index = index_list[start]
-        while interval_start[value_index] < end:
-            value = value_map[value_index]
-            if value > maximum:
-                maximum = value
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-
-        if maximum != 0:
-            result_view[i] = maximum
+            if maximum != 0:
+                result_view[i] = maximum
 
     return result
 
-def get_max_indexes(double[:] value_map, int[:] index_list,
-                    unsigned int[:] interval_start, unsigned int[:] interval_end,
-                    int[:] start_list, int[:] end_list):
+def get_max_indexes(const value_type[:] value_map, const int[:] index_list,
+                    const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                    const int[:] start_list, const int[:] end_list):
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t i, num_tests = start_list.size, start, end, value_index
+    cdef Py_ssize_t first_index
     cdef size_t numb_intervals = interval_start.size, orig_start, orig_end
     cdef double maximum, value
-    cdef unsigned int max_index
+    cdef Py_ssize_t max_index
 
     result = np.full(num_tests, -1, dtype=np.int32)
     cdef int[:] result_view = result
 
-    for i in range(num_tests):
-        maximum = 0
-        max_index = -1
-        orig_start = start_list[i]
-        orig_end = end_list[i]
+    with nogil:
+        for i in range(num_tests):
+            maximum = 0
+            max_index = -1
+            orig_start = start_list[i]
+            orig_end = end_list[i]
+
+            start = orig_start
+            end = orig_end
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index == -1:
+                result_view[i] = <int>((orig_start + orig_start) / 2)
+                continue
 
-        start = orig_start
-        end = orig_end
+            value_index = first_index
+            while interval_start[value_index] < end:
+                value = value_map[value_index]
+                if value > maximum:
+                    maximum = value
+                    max_index = value_index
 
-        # get to an interval
-        while start < end and index_list[start] == -1:
-            start += 1
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
 
-        if start == end:
-            result_view[i] = <int>((orig_start + orig_start) / 2)
-            continue
+            start = orig_start
+            end = orig_end
+            if max_index != -1:
+                # make sure returned index is not outside search interval
+                if end > interval_end[max_index]:
+                    end = interval_end[max_index]
+                if start < interval_start[max_index]:
+                    start = interval_start[max_index]
 
-        value_index = index_list[start]
-        while interval_start[value_index] < end:
-            value = value_map[value_index]
-            if value > maximum:
-                maximum = value
-                max_index = value_index
+            result_view[i] = <int>((start + end) / 2)
+
+    return result
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
+def get_coverages(const value_type[:] value_map, const int[:] index_list, const unsigned int[:] interval_start,
+                  const unsigned int[:] interval_end, const int[:] start_list, const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
 
-        start = orig_start
-        end = orig_end
-        if max_index != -1:
-            # make sure returned index is not outside search interval
-            if end > interval_end[max_index]:
-                end = interval_end[max_index]
-            if start < interval_start[max_index]:
-                start = interval_start[max_index]
+    cdef size_t i, num_tests = start_list.size, start, end, current_start
+    cdef Py_ssize_t first_index
+    cdef unsigned int numb_covered, temp_end, value_index
+    cdef size_t numb_intervals = interval_start.size
 
-        result_view[i] = <int>((start + end) / 2)
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            numb_covered = 0
+            start = start_list[i]
+            end = end_list[i]
+            current_start = start
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, current_start, end)
+            if first_index == -1:
+                continue
+
+            value_index = first_index
+            if current_start < interval_start[value_index]:
+                current_start = interval_start[value_index]
+            while current_start < end:
+                temp_end = interval_end[value_index]
+                if temp_end > end:
+                    temp_end = end
+
+                if value_map[value_index] > 0:
+                    numb_covered += (temp_end - current_start)
+
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
+                current_start = interval_start[value_index]
+
+            if numb_covered > 0:
+                result_view[i] = numb_covered / (end - start)
 
     return result
 
-def get_coverages(double[:] value_map, int[:] index_list, unsigned int[:] interval_start,
-                  unsigned int[:] interval_end, int[:] start_list, int[:] end_list):
+@cython.cdivision(True)
+def get_variances(const value_type[:] value_map, const int[:] index_list,
+                  const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                  const int[:] start_list, const int[:] end_list):
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
+    cdef size_t i, num_tests = start_list.size, start, end, curr_start
+    cdef Py_ssize_t first_index
+    cdef size_t value_index, numb_intervals = interval_start.size
+    cdef unsigned int temp_end
+    cdef double numb_value, mean, squares, shift
+
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            start = start_list[i]
+            end = end_list[i]
+            curr_start = start
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, curr_start, end)
+            if first_index == -1:
+                continue
+
+            numb_value = 0
+            mean = 0
+            squares = 0
+
+            # values are shifted by the first one so the differences between
+            # them are exact and the mean stays small
+            shift = value_map[first_index]
+
+            value_index = first_index
+            if curr_start < interval_start[value_index]:
+                curr_start = interval_start[value_index]
+            while curr_start < end:
+                temp_end = interval_end[value_index]
+                if temp_end > end:
+                    temp_end = end
+
+                add_weighted_value(value_map[value_index] - shift,
+                                   temp_end - curr_start, &numb_value, &mean,
+                                   &squares)
+
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
+                curr_start = interval_start[value_index]
+
+            # base pairs that are not in bedGraph intervals have a value of 0
+            add_weighted_value(-shift, end - start - numb_value, &numb_value,
+                               &mean, &squares)
+
+            result_view[i] = squares / numb_value
+
+    return result
+
+def get_stds(const value_type[:] value_map, const int[:] index_list,
+             const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+             const int[:] start_list, const int[:] end_list):
+    result = get_variances(value_map, index_list, interval_start, interval_end,
+                           start_list, end_list)
+    np.sqrt(result, out=result, where=result > 0)
+    return result
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def get_multi_stats(const value_type[:] value_map, const int[:] index_list,
+                    const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                    const int[:] start_list, const int[:] end_list):
+    # every statistic of MULTI_STATS from a single walk over the intervals
+    # overlapping each search, base pairs outside of intervals count as 0
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
     cdef size_t i, num_tests = start_list.size, start, end, current_start
-    cdef unsigned int numb_covered, temp_end, value_index
-    cdef size_t numb_intervals = interval_start.size
+    cdef Py_ssize_t first_index
+    cdef size_t value_index, numb_intervals = interval_start.size
+    cdef unsigned int numb_value, numb_covered, temp_end, interval_size
+    cdef double total, weight, running_mean, squares, shift, value
+    cdef double maximum, minimum, search_size
+
+    result = np.zeros((num_tests, NUMB_MULTI_STATS), dtype=np.float64)
+    cdef double[:, :] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            total = 0
+            weight = 0
+            running_mean = 0
+            squares = 0
+            numb_value = 0
+            numb_covered = 0
+            maximum = 0
+            start = start_list[i]
+            end = end_list[i]
+
+            # get to an interval
+            first_index = find_first_interval(index_list, interval_start,
+                                              interval_end, start, end)
+            if first_index == -1:
+                continue
+
+            minimum = DBL_MAX
+            if interval_start[first_index] > start:
+                minimum = 0
+
+            # values are shifted by the first one so the differences between
+            # them are exact and the mean stays small
+            shift = value_map[first_index]
+
+            value_index = first_index
+            current_start = start
+            if current_start < interval_start[value_index]:
+                current_start = interval_start[value_index]
+            while current_start < end:
+                temp_end = interval_end[value_index]
+                if temp_end > end:
+                    temp_end = end
+                interval_size = temp_end - current_start
+
+                value = value_map[value_index]
+                total += value * interval_size
+                numb_value += interval_size
+                if value > 0:
+                    numb_covered += interval_size
+                add_weighted_value(value - shift, interval_size, &weight,
+                                   &running_mean, &squares)
+                if value > maximum:
+                    maximum = value
+                if value < minimum:
+                    minimum = value
+
+                value_index += 1
+                if value_index == numb_intervals:
+                    break
+                current_start = interval_start[value_index]
+
+            # base pairs that are not in bedGraph intervals have a value of 0
+            search_size = end - start
+            add_weighted_value(-shift, search_size - numb_value, &weight,
+                               &running_mean, &squares)
+
+            result_view[i, MEAN_COLUMN] = total / search_size
+            result_view[i, MAX_COLUMN] = maximum
+            result_view[i, MIN_COLUMN] = minimum if minimum != DBL_MAX else 0
+            result_view[i, COVERAGE_COLUMN] = numb_covered / search_size
+            result_view[i, SUM_COLUMN] = total
+            result_view[i, VARIANCE_COLUMN] = squares / weight
+            result_view[i, STD_COLUMN] = sqrt(squares / weight)
+
+    return result
+
+@cython.cdivision(True)
+def get_prefix_means(const value_type[:] value_map, const int[:] index_list,
+                     const unsigned int[:] interval_start,
+                     const unsigned int[:] interval_end, const double[:] value_sums,
+                     const long long[:] length_sums, const int[:] start_list,
+                     const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size
+    cdef double total
+    cdef long long numb_covered
 
     result = np.zeros(num_tests, dtype=np.float64)
     cdef double[:] result_view = result
 
-    for i in range(num_tests):
-        numb_covered = 0
-        start = start_list[i]
-        end = end_list[i]
-        current_start = start
+    with nogil:
+        for i in range(num_tests):
+            sum_interval_range(value_map, index_list, interval_start, interval_end,
+                               value_sums, length_sums, start_list[i],
+                               end_list[i], &total, &numb_covered)
 
-        # get to an interval
-        while current_start < end and index_list[current_start] == -1:
-            current_start += 1
+            if total != 0:
+                result_view[i] = total / (end_list[i] - start_list[i])
 
-        if current_start == end:
-            continue
+    return result
+
+@cython.cdivision(True)
+def get_prefix_coverages(const value_type[:] value_map, const int[:] index_list,
+                         const unsigned int[:] interval_start,
+                         const unsigned int[:] interval_end, const double[:] value_sums,
+                         const long long[:] length_sums, const int[:] start_list,
+                         const int[:] end_list):
 
-        value_index = index_list[current_start]
-        while current_start < end:
-            temp_end = interval_end[value_index]
-            if temp_end > end:
-                temp_end = end
+    assert tuple(start_list.shape) == tuple(end_list.shape)
 
-            if value_map[value_index] > 0:
-                numb_covered += (temp_end - current_start)
+    cdef size_t i, num_tests = start_list.size
+    cdef double total
+    cdef long long numb_covered
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-            current_start = interval_start[value_index]
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
 
-        if numb_covered > 0:
-            result_view[i] = numb_covered / (end - start)
+    with nogil:
+        for i in range(num_tests):
+            sum_interval_range(value_map, index_list, interval_start, interval_end,
+                               value_sums, length_sums, start_list[i],
+                               end_list[i], &total, &numb_covered)
+
+            if numb_covered > 0:
+                result_view[i] = <double>numb_covered / (end_list[i] - start_list[i])
 
     return result
 
-def get_stds(double[:] value_map, int[:] index_list,
-                 unsigned int[:] interval_start, unsigned int[:] interval_end,
-                 int[:] start_list, int[:] end_list):
+@cython.cdivision(True)
+def get_prefix_variances(const value_type[:] value_map, const int[:] index_list,
+                         const unsigned int[:] interval_start,
+                         const unsigned int[:] interval_end,
+                         const double[:, :, :] moment_table,
+                         const int[:] start_list, const int[:] end_list):
 
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
-    cdef size_t i, num_tests = start_list.size, start, end, j
+    cdef size_t i, num_tests = start_list.size, size
+    cdef double weight, mean, squares, shift
 
     result = np.zeros(num_tests, dtype=np.float64)
     cdef double[:] result_view = result
-    cdef double std, difference, value
-    cdef unsigned int numb_value, interval_size, value_index, temp_end, curr_start
-    cdef size_t numb_intervals = interval_start.size
 
-    cdef double[:] means = get_exact_means(value_map, index_list, interval_start,
-                            interval_end, start_list, end_list)
+    with nogil:
+        for i in range(num_tests):
+            sum_moment_range(value_map, index_list, interval_start, interval_end,
+                             moment_table, start_list[i], end_list[i],
+                             &weight, &mean, &squares, &shift)
+
+            if weight == 0:
+                continue
+
+            # base pairs that are not in bedGraph intervals have a value of 0,
+            # which is -shift once shifted
+            size = end_list[i] - start_list[i]
+            add_weighted_value(-shift, size - weight, &weight, &mean, &squares)
+            result_view[i] = squares / size
+
+    return result
+
+def get_prefix_stds(const value_type[:] value_map, const int[:] index_list,
+                    const unsigned int[:] interval_start,
+                    const unsigned int[:] interval_end,
+                    const double[:, :, :] moment_table,
+                    const int[:] start_list, const int[:] end_list):
+    result = get_prefix_variances(value_map, index_list, interval_start,
+                                  interval_end, moment_table, start_list,
+                                  end_list)
+    np.sqrt(result, out=result, where=result > 0)
+    return result
+
+def get_range_maximums(const value_type[:] value_map, const int[:] index_list,
+                       const unsigned int[:] interval_start,
+                       const unsigned int[:] interval_end, const int[:, :] max_table,
+                       const int[:] start_list, const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size
+    cdef Py_ssize_t first_index, last_index
+    cdef double maximum
+
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            first_index = find_interval_range(index_list, interval_start,
+                                              interval_end, start_list[i],
+                                              end_list[i], &last_index)
+            if first_index >= last_index:
+                continue
+
+            maximum = value_map[find_range_best(value_map, max_table, first_index,
+                                                last_index, True)]
+            if maximum > 0:
+                result_view[i] = maximum
+
+    return result
 
-    for i in range(num_tests):
-        mean = means[i]
-        if mean == 0:
-            continue
+def get_range_minimums(const value_type[:] value_map, const int[:] index_list,
+                       const unsigned int[:] interval_start,
+                       const unsigned int[:] interval_end, const int[:, :] min_table,
+                       const int[:] start_list, const int[:] end_list):
 
-        start = start_list[i]
-        end = end_list[i]
-        curr_start = start
+    assert tuple(start_list.shape) == tuple(end_list.shape)
 
-        # get to an interval
-        while curr_start < end and index_list[curr_start] == -1:
-            curr_start += 1
+    cdef size_t i, num_tests = start_list.size
+    cdef Py_ssize_t first_index, last_index
+    cdef double minimum
 
-        if curr_start == end:
-            continue
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
 
-        std = 0
-        numb_value = 0
+    with nogil:
+        for i in range(num_tests):
+            first_index = find_interval_range(index_list, interval_start,
+                                              interval_end, start_list[i],
+                                              end_list[i], &last_index)
+            if first_index >= last_index:
+                continue
 
-        value_index = index_list[curr_start]
-        while curr_start < end:
-            temp_end = interval_end[value_index]
-            if temp_end > end:
-                temp_end = end
+            minimum = value_map[find_range_best(value_map, min_table, first_index,
+                                                last_index, False)]
+
+            # missing base pairs before the first interval have a value of 0
+            if interval_start[first_index] > start_list[i] and minimum > 0:
+                minimum = 0
+
+            result_view[i] = minimum
+
+    return result
+
+def get_range_max_indexes(const value_type[:] value_map, const int[:] index_list,
+                          const unsigned int[:] interval_start,
+                          const unsigned int[:] interval_end, const int[:, :] max_table,
+                          const int[:] start_list, const int[:] end_list):
+
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size, start, end
+    cdef Py_ssize_t first_index, last_index, max_index
+
+    result = np.full(num_tests, -1, dtype=np.int32)
+    cdef int[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            start = start_list[i]
+            end = end_list[i]
+
+            first_index = find_interval_range(index_list, interval_start,
+                                              interval_end, start, end,
+                                              &last_index)
+            if first_index >= last_index:
+                result_view[i] = <int>((start + start) / 2)
+                continue
 
-            interval_size = temp_end - curr_start
-            difference = value_map[value_index] - mean
-            std += difference * difference * interval_size
-            numb_value += interval_size
+            max_index = find_range_best(value_map, max_table, first_index,
+                                        last_index, True)
 
-            value_index += 1
-            if value_index == numb_intervals:
-                break
-            curr_start = interval_start[value_index]
+            if value_map[max_index] > 0:
+                # make sure returned index is not outside search interval
+                if end > interval_end[max_index]:
+                    end = interval_end[max_index]
+                if start < interval_start[max_index]:
+                    start = interval_start[max_index]
 
-        if numb_value == 0: # ???
-            print("why?")
-            continue
+            result_view[i] = <int>((start + end) / 2)
 
-        # get base pairs that are not in bedGraph intervals
-        difference = mean
-        std += difference * difference * (end - start - numb_value)
+    return result
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def get_quantiles(const value_type[:] value_map, const int[:] index_list,
+                  const unsigned int[:] interval_start, const unsigned int[:] interval_end,
+                  const int[:] start_list, const int[:] end_list, double quantile):
+    # weighted quantile of the values of the base pairs of each search, found by
+    # selecting from the intervals it overlaps, base pairs outside of
+    # intervals count as 0
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size, start, end
+    cdef Py_ssize_t first_index, last_index, value_index, numb_values
+    cdef Py_ssize_t capacity = 1024
+    cdef double total
+    cdef bint enough_memory = True
+
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    cdef double* values = <double*>malloc(capacity * sizeof(double))
+    cdef double* weights = <double*>malloc(capacity * sizeof(double))
+
+    try:
+        if values == NULL or weights == NULL:
+            raise MemoryError()
+
+        with nogil:
+            for i in range(num_tests):
+                start = start_list[i]
+                end = end_list[i]
+
+                first_index = find_interval_range(index_list, interval_start,
+                                                  interval_end, start, end,
+                                                  &last_index)
+
+                # room for every interval and the missing base pairs
+                if not reserve_weighted_values(&values, &weights, &capacity,
+                                               last_index - first_index + 1):
+                    enough_memory = False
+                    break
+
+                numb_values = 0
+                total = 0
+                for value_index in range(first_index, last_index):
+                    weights[numb_values] = clipped_size(
+                        interval_start, interval_end, value_index, start, end)
+                    if weights[numb_values] == 0:
+                        continue
+
+                    values[numb_values] = value_map[value_index]
+                    total += weights[numb_values]
+                    numb_values += 1
+
+                # base pairs that are not in bedGraph intervals have a value of 0
+                if end > start + total:
+                    values[numb_values] = 0
+                    weights[numb_values] = end - start - total
+                    numb_values += 1
+                    total = end - start
+
+                if numb_values == 0:
+                    continue
+
+                result_view[i] = select_weighted_value(values, weights,
+                                                       numb_values,
+                                                       quantile * total)
+
+        if not enough_memory:
+            raise MemoryError()
+    finally:
+        free(values)
+        free(weights)
+
+    return result
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def get_indexed_quantiles(const value_type[:] value_map, const int[:] index_list,
+                          const unsigned int[:] interval_start,
+                          const unsigned int[:] interval_end,
+                          const double[:] quantile_values, const long long[:] value_ranks,
+                          const int[:, :] zeros_before, const long long[:, :] left_weights,
+                          const long long[:] size_sums,
+                          const int[:] start_list, const int[:] end_list, double quantile):
+    # weighted quantile of the values of the base pairs of each search from the
+    # quantile index, with the clipped first and last intervals and the base
+    # pairs outside of intervals as extra values
+    assert tuple(start_list.shape) == tuple(end_list.shape)
+
+    cdef size_t i, num_tests = start_list.size, start, end
+    cdef Py_ssize_t first_index, last_index
+    cdef double total
+    cdef int numb_extra
+    cdef long long extra_ranks[3]
+    cdef double extra_weights[3]
+
+    # 0 is always one of the values of the quantile index
+    cdef long long zero_rank = np.searchsorted(quantile_values, 0)
+
+    result = np.zeros(num_tests, dtype=np.float64)
+    cdef double[:] result_view = result
+
+    with nogil:
+        for i in range(num_tests):
+            start = start_list[i]
+            end = end_list[i]
+
+            first_index = find_interval_range(index_list, interval_start,
+                                              interval_end, start, end,
+                                              &last_index)
+            if end <= start:
+                continue
 
-        std /= (end - start)
-        result_view[i] = sqrt(std)
+            # the first and last intervals only count their base pairs inside
+            # the search
+            numb_extra = 0
+            total = 0
+            if first_index < last_index:
+                extra_ranks[0] = value_ranks[first_index]
+                extra_weights[0] = clipped_size(interval_start, interval_end,
+                                                first_index, start, end)
+                total += extra_weights[0]
+                numb_extra = 1
+            if last_index - first_index > 1:
+                extra_ranks[1] = value_ranks[last_index - 1]
+                extra_weights[1] = clipped_size(interval_start, interval_end,
+                                                last_index - 1, start, end)
+                total += extra_weights[1]
+                numb_extra = 2
+
+            # the intervals between are counted whole by the index
+            if last_index - first_index > 2:
+                first_index += 1
+                last_index -= 1
+                total += size_sums[last_index] - size_sums[first_index]
+            else:
+                first_index = 0
+                last_index = 0
+
+            # base pairs that are not in bedGraph intervals have a value of 0
+            if end > start + total:
+                extra_ranks[numb_extra] = zero_rank
+                extra_weights[numb_extra] = end - start - total
+                numb_extra += 1
+                total = end - start
+
+            result_view[i] = quantile_values[select_indexed_rank(
+                zeros_before, left_weights, first_index, last_index,
+                extra_ranks, extra_weights, numb_extra, quantile * total)]
 
     return result
@@ -0,0 +1,504 @@
+from libc.stdlib cimport realloc
+
+# types value_map can be stored as, float halves its memory
+ctypedef fused value_type:
+    double
+    float
+
+cdef inline Py_ssize_t bisect_intervals(const unsigned int[:] interval_end,
+                                       size_t position) nogil:
+    # index of the first interval that ends after position
+    cdef Py_ssize_t low = 0, high = interval_end.shape[0], middle
+
+    while low < high:
+        middle = (low + high) >> 1
+        if interval_end[middle] <= position:
+            low = middle + 1
+        else:
+            high = middle
+
+    return low
+
+cdef inline Py_ssize_t find_first_interval(const int[:] index_list,
+                                          const unsigned int[:] interval_start,
+                                          const unsigned int[:] interval_end,
+                                          size_t start, size_t end) nogil:
+    # index of the first interval overlapping start -> end, -1 if there is none
+    # index_list is used when start is covered, otherwise the intervals are
+    # binary searched so a search starting in a long gap does not step
+    # through its base pairs
+    cdef Py_ssize_t value_index
+
+    if start >= end:
+        return -1
+
+    if index_list is not None and index_list[start] != -1:
+        return index_list[start]
+
+    value_index = bisect_intervals(interval_end, start)
+    if value_index == interval_end.shape[0] or \
+            interval_start[value_index] >= end:
+        return -1
+    return value_index
+
+cdef inline Py_ssize_t find_interval_range(const int[:] index_list,
+                                          const unsigned int[:] interval_start,
+                                          const unsigned int[:] interval_end,
+                                          size_t start, size_t end,
+                                          Py_ssize_t* last_index) nogil:
+    # indexes of the first and one past the last interval overlapping
+    # start -> end, the range is empty if there is none
+    # index_list is used for the lookups when it is loaded
+    cdef Py_ssize_t first_index
+
+    if start >= end:
+        last_index[0] = 0
+        return 0
+
+    if index_list is not None and index_list[start] != -1:
+        first_index = index_list[start]
+    else:
+        first_index = bisect_intervals(interval_end, start)
+
+    if index_list is not None and index_list[end - 1] != -1:
+        last_index[0] = index_list[end - 1] + 1
+    else:
+        last_index[0] = bisect_intervals(interval_start, end - 1)
+
+    return first_index
+
+# searches over at most this many intervals are summed directly, which avoids
+# the rounding error of subtracting large prefix sums
+cdef enum:
+    DIRECT_SUM_RANGE = 16
+
+cdef inline void sum_interval_range(const value_type[:] value_map, const int[:] index_list,
+                                    const unsigned int[:] interval_start,
+                                    const unsigned int[:] interval_end,
+                                    const double[:] value_sums,
+                                    const long long[:] length_sums,
+                                    size_t start, size_t end, double* total,
+                                    long long* numb_covered) nogil:
+    # sums of value * size and covered size for start -> end from the prefix
+    # sums of the intervals, a length of 0 in length_sums means the interval
+    # is not counted as covered
+    cdef Py_ssize_t first_index, last_index, value_index
+    cdef double value
+    cdef long long clipped_size, interval_size
+    cdef size_t temp_start, temp_end
+
+    total[0] = 0
+    numb_covered[0] = 0
+
+    first_index = find_interval_range(index_list, interval_start,
+                                      interval_end, start, end, &last_index)
+    if first_index >= last_index:
+        return
+
+    if last_index - first_index <= DIRECT_SUM_RANGE:
+        for value_index in range(first_index, last_index):
+            temp_start = interval_start[value_index]
+            if temp_start < start:
+                temp_start = start
+            temp_end = interval_end[value_index]
+            if temp_end > end:
+                temp_end = end
+
+            value = value_map[value_index]
+            interval_size = temp_end - temp_start
+            total[0] += value * interval_size
+            if length_sums[value_index + 1] > length_sums[value_index]:
+                numb_covered[0] += interval_size
+        return
+
+    total[0] = value_sums[last_index] - value_sums[first_index]
+    numb_covered[0] = length_sums[last_index] - length_sums[first_index]
+
+    # remove the parts of the first and last intervals outside start -> end
+    if interval_start[first_index] < start:
+        value = value_map[first_index]
+        clipped_size = start - interval_start[first_index]
+        total[0] -= value * clipped_size
+        if length_sums[first_index + 1] > length_sums[first_index]:
+            numb_covered[0] -= clipped_size
+
+    if interval_end[last_index - 1] > end:
+        value = value_map[last_index - 1]
+        clipped_size = interval_end[last_index - 1] - end
+        total[0] -= value * clipped_size
+        if length_sums[last_index] > length_sums[last_index - 1]:
+            numb_covered[0] -= clipped_size
+
+cdef inline void add_weighted_value(double value, double weight,
+                                   double* total_weight, double* mean,
+                                   double* squares) nogil:
+    # weighted form of Welford's update of a running mean and sum of squared
+    # differences from it, found in a single pass over the values
+    cdef double difference
+
+    if weight == 0:
+        return
+
+    total_weight[0] += weight
+    difference = value - mean[0]
+    mean[0] += difference * (weight / total_weight[0])
+    squares[0] += weight * difference * (value - mean[0])
+
+cdef inline void add_moments(double weight, double mean, double squares,
+                             double* total_weight, double* total_mean,
+                             double* total_squares) nogil:
+    # Chan's merge of the weight, mean and sum of squared differences from
+    # the mean of a group of values into the running ones
+    cdef double new_weight, difference
+
+    if weight == 0:
+        return
+
+    new_weight = total_weight[0] + weight
+    difference = mean - total_mean[0]
+    total_mean[0] += difference * (weight / new_weight)
+    total_squares[0] += squares + difference * difference * \
+        (total_weight[0] * (weight / new_weight))
+    total_weight[0] = new_weight
+
+# number of intervals added one at a time at each end of a range variance
+cdef enum:
+    MOMENT_BLOCK_SIZE = 16
+
+cdef inline void add_interval_moments(const value_type[:] value_map,
+                                      const unsigned int[:] interval_start,
+                                      const unsigned int[:] interval_end,
+                                      Py_ssize_t first_index,
+                                      Py_ssize_t last_index, size_t start,
+                                      size_t end, double shift,
+                                      double* weight, double* mean,
+                                      double* squares) nogil:
+    # adds the parts inside start -> end of intervals first_index ->
+    # last_index (exclusive) to the running moments of value - shift
+    cdef Py_ssize_t value_index
+
+    for value_index in range(first_index, last_index):
+        add_weighted_value(value_map[value_index] - shift,
+                           clipped_size(interval_start, interval_end,
+                                        value_index, start, end),
+                           weight, mean, squares)
+
+cdef inline void sum_moment_range(const value_type[:] value_map, const int[:] index_list,
+                                  const unsigned int[:] interval_start,
+                                  const unsigned int[:] interval_end,
+                                  const double[:, :, :] moment_table,
+                                  size_t start, size_t end, double* weight,
+                                  double* mean, double* squares,
+                                  double* shift) nogil:
+    # weight, mean and sum of squared differences from the mean of the values
+    # of the intervals in start -> end, with the mean relative to shift, the
+    # value of the first interval
+    # intervals are added one at a time at each end and the full blocks in
+    # between from moment_table, where [0][block] holds the moments of a
+    # block and [level + 1][block] those of the blocks from block to the
+    # middle of its 2^(level + 1) blocks, so no large sums are subtracted
+    # table means are relative to the first value of the first block of the
+    # entry so they keep the precision of the differences between values
+    cdef Py_ssize_t first_index, last_index, first_block, last_block
+    cdef Py_ssize_t level, middle
+    cdef size_t differing_bits
+
+    weight[0] = 0
+    mean[0] = 0
+    squares[0] = 0
+    shift[0] = 0
+
+    first_index = find_interval_range(index_list, interval_start,
+                                      interval_end, start, end, &last_index)
+    if first_index >= last_index:
+        return
+
+    # values are shifted by the first one so the differences between them
+    # are exact and the mean stays small
+    shift[0] = value_map[first_index]
+
+    # the first and last intervals may be clipped, so they are always added
+    # one at a time
+    first_block = first_index // MOMENT_BLOCK_SIZE + 1
+    last_block = (last_index - 1) // MOMENT_BLOCK_SIZE
+
+    if first_block >= last_block:
+        add_interval_moments(value_map, interval_start, interval_end,
+                             first_index, last_index, start, end, shift[0],
+                             weight, mean, squares)
+        return
+
+    add_interval_moments(value_map, interval_start, interval_end, first_index,
+                         first_block * MOMENT_BLOCK_SIZE, start, end, shift[0],
+                         weight, mean, squares)
+
+    last_block -= 1
+    if first_block == last_block:
+        level = 0
+    else:
+        differing_bits = first_block ^ last_block
+        level = 1
+        while differing_bits > 1:
+            differing_bits >>= 1
+            level += 1
+    add_moments(moment_table[level, first_block, 0],
+                moment_table[level, first_block, 1] +
+                (value_map[first_block * MOMENT_BLOCK_SIZE] - shift[0]),
+                moment_table[level, first_block, 2], weight, mean, squares)
+    if first_block != last_block:
+        middle = (last_block >> (level - 1)) << (level - 1)
+        add_moments(moment_table[level, last_block, 0],
+                    moment_table[level, last_block, 1] +
+                    (value_map[middle * MOMENT_BLOCK_SIZE] - shift[0]),
+                    moment_table[level, last_block, 2], weight, mean, squares)
+    last_block += 1
+
+    add_interval_moments(value_map, interval_start, interval_end,
+                         last_block * MOMENT_BLOCK_SIZE, last_index, start, end,
+                         shift[0], weight, mean, squares)
+
+# number of values scanned directly at each end of a range maximum or minimum
+cdef enum:
+    RANGE_BLOCK_SIZE = 16
+
+cdef inline bint is_better(const value_type[:] value_map, Py_ssize_t new_index,
+                           Py_ssize_t best_index, bint find_max) nogil:
+    # new_index is right of best_index so ties keep the leftmost value
+    if find_max:
+        return value_map[new_index] > value_map[best_index]
+    return value_map[new_index] < value_map[best_index]
+
+cdef inline Py_ssize_t find_range_best(const value_type[:] value_map, const int[:, :] range_table,
+                                       Py_ssize_t first_index,
+                                       Py_ssize_t last_index,
+                                       bint find_max) nogil:
+    # index of the leftmost maximum (or minimum) of value_map from first_index
+    # to last_index (exclusive), which must not be empty
+    # range_table[level][block] holds the index of the best value of the
+    # 2^level blocks starting at block
+    cdef Py_ssize_t best_index = first_index, value_index
+    cdef Py_ssize_t first_block, last_block, level, block_range, candidate
+
+    first_block = (first_index + RANGE_BLOCK_SIZE - 1) // RANGE_BLOCK_SIZE
+    last_block = last_index // RANGE_BLOCK_SIZE
+
+    if first_block >= last_block:
+        for value_index in range(first_index + 1, last_index):
+            if is_better(value_map, value_index, best_index, find_max):
+                best_index = value_index
+        return best_index
+
+    # values before the first full block
+    for value_index in range(first_index + 1, first_block * RANGE_BLOCK_SIZE):
+        if is_better(value_map, value_index, best_index, find_max):
+            best_index = value_index
+
+    # full blocks from two overlapping ranges of 2^level blocks
+    block_range = last_block - first_block
+    level = 0
+    while (2 << level) <= block_range:
+        level += 1
+
+    candidate = range_table[level, first_block]
+    if is_better(value_map, candidate, best_index, find_max):
+        best_index = candidate
+    candidate = range_table[level, last_block - (1 << level)]
+    if is_better(value_map, candidate, best_index, find_max):
+        best_index = candidate
+
+    # values after the last full block
+    for value_index in range(last_block * RANGE_BLOCK_SIZE, last_index):
+        if is_better(value_map, value_index, best_index, find_max):
+            best_index = value_index
+
+    return best_index
+
+# columns of the results of get_multi_stats, in the order of MULTI_STATS
+cdef enum:
+    MEAN_COLUMN = 0
+    MAX_COLUMN = 1
+    MIN_COLUMN = 2
+    COVERAGE_COLUMN = 3
+    SUM_COLUMN = 4
+    STD_COLUMN = 5
+    VARIANCE_COLUMN = 6
+    NUMB_MULTI_STATS = 7
+
+cdef inline void swap_weighted_values(double* values, double* weights,
+                                      Py_ssize_t first, Py_ssize_t second) nogil:
+    cdef double temp = values[first]
+    values[first] = values[second]
+    values[second] = temp
+    temp = weights[first]
+    weights[first] = weights[second]
+    weights[second] = temp
+
+cdef inline double select_weighted_value(double* values, double* weights,
+                                         Py_ssize_t numb_values,
+                                         double target) nogil:
+    # smallest value where the weights of it and every smaller value add up to
+    # at least target (and more than 0), weights must be above 0
+    # quickselect with a three way partition, values and weights are
+    # reordered in place
+    cdef Py_ssize_t low = 0, high = numb_values, i, less_end, greater_start
+    cdef double pivot, less_weight, equal_weight
+
+    while high - low > 1:
+        pivot = values[low + (high - low) // 2]
+        less_weight = 0
+        equal_weight = 0
+        less_end = low
+        greater_start = high
+        i = low
+        while i < greater_start:
+            if values[i] < pivot:
+                less_weight += weights[i]
+                swap_weighted_values(values, weights, i, less_end)
+                less_end += 1
+                i += 1
+            elif values[i] > pivot:
+                greater_start -= 1
+                swap_weighted_values(values, weights, i, greater_start)
+            else:
+                equal_weight += weights[i]
+                i += 1
+
+        if target <= less_weight and less_weight > 0:
+            high = less_end
+        elif target <= less_weight + equal_weight or greater_start == high:
+            return pivot
+        else:
+            target -= less_weight + equal_weight
+            low = greater_start
+
+    return values[low]
+
+cdef inline Py_ssize_t select_indexed_rank(const int[:, :] zeros_before,
+                                           const long long[:, :] left_weights,
+                                           Py_ssize_t first_index,
+                                           Py_ssize_t last_index,
+                                           const long long* extra_ranks,
+                                           const double* extra_weights,
+                                           int numb_extra, double target) nogil:
+    # rank of the smallest value where the weights of it and every smaller
+    # value add up to at least target, from the values of intervals
+    # first_index -> last_index (exclusive) and the extra values
+    # descends a wavelet matrix over the ranks of the values, where level
+    # splits by one bit of the rank starting with the highest and
+    # zeros_before[level][i] and left_weights[level][i] count the values and
+    # sum the weights of the first i values of the level with that bit unset
+    cdef Py_ssize_t numb_levels = zeros_before.shape[0]
+    cdef Py_ssize_t numb_values = zeros_before.shape[1] - 1
+    cdef Py_ssize_t level, numb_zeros, rank = 0
+    cdef double weight
+    cdef int bit, extra
+
+    for level in range(numb_levels):
+        bit = numb_levels - 1 - level
+        numb_zeros = zeros_before[level, numb_values]
+
+        weight = left_weights[level, last_index] - \
+            left_weights[level, first_index]
+        for extra in range(numb_extra):
+            # extra values still in the same part as the rank found so far
+            if extra_ranks[extra] >> (bit + 1) == rank >> (bit + 1) and \
+                    (extra_ranks[extra] >> bit) & 1 == 0:
+                weight += extra_weights[extra]
+
+        if target <= weight and weight > 0:
+            first_index = zeros_before[level, first_index]
+            last_index = zeros_before[level, last_index]
+        else:
+            target -= weight
+            first_index = numb_zeros + first_index - \
+                zeros_before[level, first_index]
+            last_index = numb_zeros + last_index - \
+                zeros_before[level, last_index]
+            rank |= <Py_ssize_t>1 << bit
+
+    return rank
+
+cdef inline bint reserve_weighted_values(double** values, double** weights,
+                                         Py_ssize_t* capacity,
+                                         Py_ssize_t numb_values) nogil:
+    # grows the buffers of values and weights to hold numb_values, returns
+    # False if there is not enough memory
+    cdef double* new_values
+    cdef double* new_weights
+
+    if numb_values <= capacity[0]:
+        return True
+
+    while capacity[0] < numb_values:
+        capacity[0] *= 2
+
+    new_values = <double*>realloc(values[0], capacity[0] * sizeof(double))
+    if new_values == NULL:
+        return False
+    values[0] = new_values
+
+    new_weights = <double*>realloc(weights[0], capacity[0] * sizeof(double))
+    if new_weights == NULL:
+        return False
+    weights[0] = new_weights
+
+    return True
+
+cdef inline double clipped_size(const unsigned int[:] interval_start,
+                                const unsigned int[:] interval_end,
+                                Py_ssize_t value_index, size_t start,
+                                size_t end) nogil:
+    # number of base pairs of an interval inside start -> end
+    cdef size_t temp_start = interval_start[value_index]
+    cdef size_t temp_end = interval_end[value_index]
+
+    if temp_start < start:
+        temp_start = start
+    if temp_end > end:
+        temp_end = end
+    if temp_end <= temp_start:
+        return 0
+    return temp_end - temp_start
+
+cdef inline double sum_bin_range(const double[:] bins,
+                                 const long long[:] bin_level_offsets,
+                                 size_t first_bin, size_t last_bin) nogil:
+    # sum of the smallest bins first_bin -> last_bin (exclusive) from the
+    # fewest bins of the pyramid, where each bin of a level sums two bins of
+    # the level below and bin_level_offsets[level] is where the level starts
+    cdef double total = 0
+    cdef Py_ssize_t level = 0
+
+    while first_bin < last_bin:
+        if first_bin & 1:
+            total += bins[bin_level_offsets[level] + first_bin]
+            first_bin += 1
+        if last_bin & 1:
+            last_bin -= 1
+            total += bins[bin_level_offsets[level] + last_bin]
+        first_bin >>= 1
+        last_bin >>= 1
+        level += 1
+
+    return total
+
+cdef inline long long count_bin_range(const unsigned int[:] bin_coverages,
+                                      const long long[:] bin_level_offsets,
+                                      size_t first_bin, size_t last_bin) nogil:
+    # coverage of the smallest bins first_bin -> last_bin (exclusive), found
+    # the same way as sum_bin_range
+    cdef long long coverage = 0
+    cdef Py_ssize_t level = 0
+
+    while first_bin < last_bin:
+        if first_bin & 1:
+            coverage += bin_coverages[bin_level_offsets[level] + first_bin]
+            first_bin += 1
+        if last_bin & 1:
+            last_bin -= 1
+            coverage += bin_coverages[bin_level_offsets[level] + last_bin]
+        first_bin >>= 1
+        last_bin >>= 1
+        level += 1
+
+    return coverage
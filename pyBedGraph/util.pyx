@@ -1,5 +1,14 @@
-def fill_value_array(unsigned int[:] start_list, unsigned int[:] end_list,
-                    double[:] value_map, double[:] value_list):
+import numpy as np
+cimport cython
+from libc.limits cimport INT_MAX, UINT_MAX
+from libc.stdlib cimport strtod
+from libc.string cimport memchr, memcmp, memcpy, strlen
+from pyBedGraph.interval_search cimport (value_type, RANGE_BLOCK_SIZE, is_better,
+                                         find_first_interval, MOMENT_BLOCK_SIZE,
+                                         add_interval_moments, add_moments)
+
+def fill_value_array(const unsigned int[:] start_list, const unsigned int[:] end_list,
+                    const value_type[:] value_map, double[:] value_list):
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t size = start_list.size, i, start, end
@@ -9,8 +18,8 @@ def fill_value_array(unsigned int[:] start_list, unsigned int[:] end_list,
         end = end_list[i]
         value_list[start:end] = value_map[i]
 
-def fill_index_array(unsigned int[:] start_list, unsigned int[:] end_list,
-                    double[:] value_map, int[:] index_list):
+def fill_index_array(const unsigned int[:] start_list, const unsigned int[:] end_list,
+                    const value_type[:] value_map, int[:] index_list):
     assert tuple(start_list.shape) == tuple(end_list.shape)
 
     cdef size_t size = start_list.size, i, start, end
@@ -20,11 +29,230 @@ def fill_index_array(unsigned int[:] start_list, unsigned int[:] end_list,
         end = end_list[i]
         index_list[start:end]= i
 
-cpdef get_bin_value(double[:] value_map, int[:] index_list,
-                 unsigned int[:] interval_start, unsigned int[:] interval_end,
+def build_range_table(const value_type[:] value_map, bint find_max):
+    """
+    Builds a sparse table over blocks of value_map to find the leftmost
+    maximum or minimum of a range of intervals.
+
+    Returns
+    -------
+    numpy array
+        2D array where [level, block] holds the index of the best value of the
+        2^level blocks starting at block
+    """
+    cdef Py_ssize_t numb_blocks = value_map.shape[0] // RANGE_BLOCK_SIZE
+    cdef Py_ssize_t numb_levels = 1, level, block, value_index, best_index
+    cdef Py_ssize_t half_range, candidate
+
+    while (2 << (numb_levels - 1)) <= numb_blocks:
+        numb_levels += 1
+
+    range_table = np.zeros((numb_levels, numb_blocks), dtype=np.int32)
+    cdef int[:, :] table_view = range_table
+
+    for block in range(numb_blocks):
+        best_index = block * RANGE_BLOCK_SIZE
+        for value_index in range(best_index + 1, best_index + RANGE_BLOCK_SIZE):
+            if is_better(value_map, value_index, best_index, find_max):
+                best_index = value_index
+        table_view[0, block] = best_index
+
+    for level in range(1, numb_levels):
+        half_range = 1 << (level - 1)
+        for block in range(numb_blocks - (1 << level) + 1):
+            best_index = table_view[level - 1, block]
+            candidate = table_view[level - 1, block + half_range]
+            if is_better(value_map, candidate, best_index, find_max):
+                best_index = candidate
+            table_view[level, block] = best_index
+
+    return range_table
+
+def build_moment_table(const value_type[:] value_map,
+                       const unsigned int[:] interval_start,
+                       const unsigned int[:] interval_end):
+    """
+    Builds a disjoint sparse table over blocks of the intervals to find the
+    weight, mean and sum of squared differences from the mean of the values
+    of a range of intervals by merging at most two entries.
+
+    Returns
+    -------
+    numpy array
+        3D array where [0][block] holds the moments of a block and
+        [level + 1][block] those of the blocks from block to the middle of its
+        2^(level + 1) blocks, for the blocks on either side of the middle. Means
+        are relative to the value of the first interval of the first block
+    """
+    cdef Py_ssize_t numb_blocks = value_map.shape[0] // MOMENT_BLOCK_SIZE
+    cdef Py_ssize_t numb_levels = 1, level, block, middle, segment_end
+    cdef Py_ssize_t half_range
+    cdef double weight, mean, squares, block_shift
+
+    while (1 << (numb_levels - 1)) < numb_blocks:
+        numb_levels += 1
+
+    moment_table = np.zeros((numb_levels, numb_blocks, 3), dtype=np.float64)
+    cdef double[:, :, :] table_view = moment_table
+
+    for block in range(numb_blocks):
+        weight = mean = squares = 0
+        add_interval_moments(value_map, interval_start, interval_end,
+                             block * MOMENT_BLOCK_SIZE,
+                             (block + 1) * MOMENT_BLOCK_SIZE, 0,
+                             interval_end[(block + 1) * MOMENT_BLOCK_SIZE - 1],
+                             value_map[block * MOMENT_BLOCK_SIZE],
+                             &weight, &mean, &squares)
+        table_view[0, block, 0] = weight
+        table_view[0, block, 1] = mean
+        table_view[0, block, 2] = squares
+
+    for level in range(1, numb_levels):
+        half_range = 1 << (level - 1)
+        for middle in range(half_range, numb_blocks, 2 * half_range):
+            # blocks left of the middle hold the moments up to it
+            weight = mean = squares = 0
+            for block in range(middle - 1, middle - half_range - 1, -1):
+                # move the mean so far to be relative to this block
+                mean += (<double>value_map[(block + 1) * MOMENT_BLOCK_SIZE] -
+                         <double>value_map[block * MOMENT_BLOCK_SIZE])
+                add_moments(table_view[0, block, 0], table_view[0, block, 1],
+                            table_view[0, block, 2], &weight, &mean, &squares)
+                table_view[level, block, 0] = weight
+                table_view[level, block, 1] = mean
+                table_view[level, block, 2] = squares
+
+            # blocks right of the middle hold the moments from it
+            weight = mean = squares = 0
+            segment_end = min(middle + half_range, numb_blocks)
+            for block in range(middle, segment_end):
+                block_shift = (<double>value_map[block * MOMENT_BLOCK_SIZE] -
+                               <double>value_map[middle * MOMENT_BLOCK_SIZE])
+                add_moments(table_view[0, block, 0],
+                            table_view[0, block, 1] + block_shift,
+                            table_view[0, block, 2], &weight, &mean, &squares)
+                table_view[level, block, 0] = weight
+                table_view[level, block, 1] = mean
+                table_view[level, block, 2] = squares
+
+    return moment_table
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def build_quantile_index(const long long[:] value_ranks,
+                         const long long[:] weights, int numb_levels):
+    """
+    Builds a wavelet matrix over the ranks of the values of the intervals to
+    find the weighted quantiles of a range of intervals.
+
+    Returns
+    -------
+    numpy array
+        2D array where [level, i] is the number of the first i values of the
+        level that go to the lower half
+    numpy array
+        2D array where [level, i] is the sum of the weights of the first i
+        values of the level that go to the lower half
+    """
+    cdef Py_ssize_t numb_values = value_ranks.shape[0], level, i
+    cdef Py_ssize_t numb_zeros, zero_index, one_index
+    cdef int bit
+
+    zeros_before = np.zeros((numb_levels, numb_values + 1), dtype=np.int32)
+    left_weights = np.zeros((numb_levels, numb_values + 1), dtype=np.int64)
+    cdef int[:, :] zeros_view = zeros_before
+    cdef long long[:, :] weights_view = left_weights
+
+    # ranks and weights in the order of the current level
+    level_ranks = np.array(value_ranks, dtype=np.int64)
+    level_weights = np.array(weights, dtype=np.int64)
+    next_ranks = np.empty_like(level_ranks)
+    next_weights = np.empty_like(level_weights)
+    cdef long long[:] ranks_view = level_ranks, level_weights_view = level_weights
+    cdef long long[:] next_ranks_view = next_ranks
+    cdef long long[:] next_weights_view = next_weights
+
+    for level in range(numb_levels):
+        bit = numb_levels - 1 - level
+
+        for i in range(numb_values):
+            zeros_view[level, i + 1] = zeros_view[level, i]
+            weights_view[level, i + 1] = weights_view[level, i]
+            if (ranks_view[i] >> bit) & 1 == 0:
+                zeros_view[level, i + 1] += 1
+                weights_view[level, i + 1] += level_weights_view[i]
+
+        # stable partition into the lower then the upper half for the next level
+        numb_zeros = zeros_view[level, numb_values]
+        zero_index = 0
+        one_index = numb_zeros
+        for i in range(numb_values):
+            if (ranks_view[i] >> bit) & 1 == 0:
+                next_ranks_view[zero_index] = ranks_view[i]
+                next_weights_view[zero_index] = level_weights_view[i]
+                zero_index += 1
+            else:
+                next_ranks_view[one_index] = ranks_view[i]
+                next_weights_view[one_index] = level_weights_view[i]
+                one_index += 1
+
+        ranks_view, next_ranks_view = next_ranks_view, ranks_view
+        level_weights_view, next_weights_view = \
+            next_weights_view, level_weights_view
+
+    return zeros_before, left_weights
+
+def sum_over_bins(interval_start, interval_end, weights, size, bin_size):
+    # sum of weight * overlap of the intervals with each bin_size bin from 0
+    # to size, scatter-added from the intervals so it takes time in
+    # proportion to the number of intervals and bins instead of base pairs
+    numb_bins = (size + bin_size - 1) // bin_size
+
+    start_list = np.asarray(interval_start, dtype=np.int64)
+    end_list = np.minimum(np.asarray(interval_end, dtype=np.int64), size)
+    weights = np.asarray(weights, dtype=np.float64)
+    kept = start_list < end_list
+    start_list, end_list, weights = \
+        start_list[kept], end_list[kept], weights[kept]
+
+    first_bins = start_list // bin_size
+    last_bins = (end_list - 1) // bin_size
+
+    # part of each interval in its first bin, all of it if it ends there
+    first_bin_ends = np.minimum(end_list, (first_bins + 1) * bin_size)
+    totals = np.bincount(first_bins, minlength=numb_bins,
+                         weights=weights * (first_bin_ends - start_list))
+
+    # part of each interval in its last bin when that is another bin
+    spans = last_bins > first_bins
+    totals += np.bincount(last_bins[spans], minlength=numb_bins,
+                          weights=weights[spans] *
+                          (end_list[spans] - last_bins[spans] * bin_size))
+
+    # whole bins in between hold the value of the interval over their whole
+    # size, which is a cumulative sum of the values added where each run of
+    # whole bins starts and taken away where it ends. The intervals do not
+    # overlap, so this is correct up to rounding, and the rounding left over
+    # in bins outside of every run is cleared with a count of the runs.
+    spans = last_bins > first_bins + 1
+    value_changes = np.bincount(first_bins[spans] + 1, minlength=numb_bins + 1,
+                                weights=weights[spans])
+    value_changes -= np.bincount(last_bins[spans], minlength=numb_bins + 1,
+                                 weights=weights[spans])
+    run_changes = np.bincount(first_bins[spans] + 1, minlength=numb_bins + 1)
+    run_changes -= np.bincount(last_bins[spans], minlength=numb_bins + 1)
+    whole_bin_values = np.cumsum(value_changes[:numb_bins])
+    whole_bin_values[np.cumsum(run_changes[:numb_bins]) == 0] = 0
+    totals += whole_bin_values * bin_size
+
+    return totals
+
+cpdef get_bin_value(const value_type[:] value_map, const int[:] index_list,
+                 const unsigned int[:] interval_start, const unsigned int[:] interval_end,
                  int start, int end):
 
     cdef size_t i, value_index
+    cdef Py_ssize_t first_index
     cdef unsigned int numb_value, temp_end, interval_size, numb_intervals = interval_start.size
     cdef double total
 
@@ -32,13 +260,14 @@ cpdef get_bin_value(double[:] value_map, int[:] index_list,
     numb_value = 0
 
     # get to an interval
-    while start < index_list.size and index_list[start] == -1 and start < end:
-        start += 1
-
-    if start == end or start == index_list.size:
+    first_index = find_first_interval(index_list, interval_start,
+                                      interval_end, start, end)
+    if first_index == -1:
         return -1
 
-    value_index = index_list[start]
+    value_index = first_index
+    if start < interval_start[value_index]:
+        start = interval_start[value_index]
     while start < end:
         temp_end = interval_end[value_index]
         if temp_end > end:
@@ -54,3 +283,523 @@ cpdef get_bin_value(double[:] value_map, int[:] index_list,
         start = interval_start[value_index]
 
     return total
+
+cdef double[23] EXACT_POWERS_OF_TEN = [
+    1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12, 1e13,
+    1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22
+]
+
+cdef inline bint is_blank(char c) nogil:
+    return c == c' ' or c == c'\t' or c == c'\r'
+
+cdef inline bint is_field_end(char c) nogil:
+    return is_blank(c) or c == c'\n' or c == 0
+
+cdef inline double parse_double(const char* text, const char** parse_end) nogil:
+    # Plain decimals with few digits can be parsed exactly with a single
+    # division, everything else is left to strtod
+    cdef const char* pos = text
+    cdef unsigned long long mantissa = 0
+    cdef int numb_digits = 0, numb_decimals = 0
+    cdef bint negative = False
+
+    if pos[0] == c'-':
+        negative = True
+        pos += 1
+    elif pos[0] == c'+':
+        pos += 1
+
+    while c'0' <= pos[0] <= c'9':
+        mantissa = mantissa * 10 + (pos[0] - c'0')
+        numb_digits += 1
+        pos += 1
+
+    if pos[0] == c'.':
+        pos += 1
+        while c'0' <= pos[0] <= c'9':
+            mantissa = mantissa * 10 + (pos[0] - c'0')
+            numb_digits += 1
+            numb_decimals += 1
+            pos += 1
+
+    if numb_digits == 0 or numb_digits > 15 or not is_field_end(pos[0]):
+        return strtod(text, <char**>parse_end)
+
+    parse_end[0] = pos
+    if negative:
+        return -(<double>mantissa / EXACT_POWERS_OF_TEN[numb_decimals])
+    return <double>mantissa / EXACT_POWERS_OF_TEN[numb_decimals]
+
+cdef inline unsigned long long parse_unsigned(const char* text,
+                                              const char** parse_end) nogil:
+    # numbers too large for an unsigned int stop growing instead of wrapping
+    # around, so they can be told apart from coordinates
+    cdef const char* pos = text
+    cdef unsigned long long number = 0
+
+    while c'0' <= pos[0] <= c'9':
+        if number <= UINT_MAX:
+            number = number * 10 + (pos[0] - c'0')
+        pos += 1
+
+    parse_end[0] = pos
+    return number
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def parse_bedgraph_chunk(bytes chunk):
+    """
+    Parses a chunk of complete bedGraph lines into columnar arrays.
+
+    Lines that do not hold a chromosome name followed by a start, end and
+    value are skipped and counted.
+
+    Returns
+    -------
+    list
+        Name of the chromosome of each run of consecutive lines
+    numpy array
+        Index of the first interval of each run, followed by the total number
+        of intervals
+    numpy array
+        Start of each interval
+    numpy array
+        End of each interval
+    numpy array
+        Value of each interval
+    int
+        Number of skipped lines
+    """
+    cdef const char* text = chunk
+    cdef size_t length = len(chunk)
+    cdef size_t max_numb_lines = chunk.count(b'\n') + 1
+
+    start_list = np.empty(max_numb_lines, dtype=np.uint32)
+    end_list = np.empty(max_numb_lines, dtype=np.uint32)
+    value_list = np.empty(max_numb_lines, dtype=np.float64)
+    cdef unsigned int[:] start_view = start_list
+    cdef unsigned int[:] end_view = end_list
+    cdef double[:] value_view = value_list
+
+    chrom_names = []
+    run_starts = []
+
+    cdef size_t pos = 0, line_end, name_start, name_end, field_start
+    cdef size_t prev_name_start = 0, prev_name_end = 0
+    cdef size_t numb_intervals = 0, numb_skipped = 0
+    cdef size_t[3] fields
+    cdef int numb_fields
+    cdef unsigned long long start, end
+    cdef double value
+    cdef const char* parse_end
+    cdef const char* line_pointer
+
+    while pos < length:
+        line_pointer = <const char*>memchr(text + pos, c'\n', length - pos)
+        if line_pointer == NULL:
+            line_end = length
+        else:
+            line_end = line_pointer - text
+
+        # chromosome name
+        while pos < line_end and is_blank(text[pos]):
+            pos += 1
+        name_start = pos
+        while pos < line_end and not is_blank(text[pos]):
+            pos += 1
+        name_end = pos
+
+        # remember where the last three fields start
+        numb_fields = 0
+        while pos < line_end:
+            while pos < line_end and is_blank(text[pos]):
+                pos += 1
+            if pos == line_end:
+                break
+            fields[numb_fields % 3] = pos
+            numb_fields += 1
+            while pos < line_end and not is_blank(text[pos]):
+                pos += 1
+
+        if name_start == name_end or numb_fields < 3:
+            if name_start != name_end:
+                numb_skipped += 1
+            pos = line_end + 1
+            continue
+
+        start = parse_unsigned(text + fields[numb_fields % 3], &parse_end)
+        if parse_end == text + fields[numb_fields % 3] or \
+                not is_blank(parse_end[0]) or start > UINT_MAX:
+            numb_skipped += 1
+            pos = line_end + 1
+            continue
+        end = parse_unsigned(text + fields[(numb_fields + 1) % 3], &parse_end)
+        if parse_end == text + fields[(numb_fields + 1) % 3] or \
+                not is_blank(parse_end[0]) or end > UINT_MAX:
+            numb_skipped += 1
+            pos = line_end + 1
+            continue
+        value = parse_double(text + fields[(numb_fields + 2) % 3], &parse_end)
+        if parse_end == text + fields[(numb_fields + 2) % 3] or \
+                not is_field_end(parse_end[0]):
+            numb_skipped += 1
+            pos = line_end + 1
+            continue
+
+        # start a new run whenever the chromosome changes
+        if numb_intervals == 0 or \
+                name_end - name_start != prev_name_end - prev_name_start or \
+                memcmp(text + name_start, text + prev_name_start,
+                       name_end - name_start) != 0:
+            chrom_names.append(
+                chunk[name_start:name_end].decode())
+            run_starts.append(numb_intervals)
+            prev_name_start = name_start
+            prev_name_end = name_end
+
+        start_view[numb_intervals] = start
+        end_view[numb_intervals] = end
+        value_view[numb_intervals] = value
+        numb_intervals += 1
+
+        pos = line_end + 1
+
+    run_starts.append(numb_intervals)
+
+    return chrom_names, np.array(run_starts, dtype=np.int64), \
+        start_list[:numb_intervals], end_list[:numb_intervals], \
+        value_list[:numb_intervals], numb_skipped
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def parse_interval_chunk(bytes chunk):
+    """
+    Parses a chunk of complete lines holding a chromosome name, start and end
+    into columnar arrays. Parsing stops at the first line with a different
+    format. Blank lines are skipped.
+
+    Returns
+    -------
+    list
+        Name of the chromosome of each run of consecutive lines
+    numpy array
+        Index of the first interval of each run, followed by the total number
+        of intervals
+    numpy array
+        Start of each interval
+    numpy array
+        End of each interval
+    bytes
+        The first line with an incorrect format, None if there is none
+    """
+    cdef const char* text = chunk
+    cdef size_t length = len(chunk)
+    cdef size_t max_numb_lines = chunk.count(b'\n') + 1
+
+    start_list = np.empty(max_numb_lines, dtype=np.int32)
+    end_list = np.empty(max_numb_lines, dtype=np.int32)
+    cdef int[:] start_view = start_list
+    cdef int[:] end_view = end_list
+
+    chrom_names = []
+    run_starts = []
+    bad_line = None
+
+    cdef size_t pos = 0, line_start, line_end, name_start, name_end
+    cdef size_t prev_name_start = 0, prev_name_end = 0
+    cdef size_t numb_intervals = 0
+    cdef size_t[2] fields
+    cdef int numb_fields
+    cdef unsigned long long start, end
+    cdef const char* parse_end
+    cdef const char* line_pointer
+
+    while pos < length:
+        line_start = pos
+        line_pointer = <const char*>memchr(text + pos, c'\n', length - pos)
+        if line_pointer == NULL:
+            line_end = length
+        else:
+            line_end = line_pointer - text
+
+        # chromosome name
+        while pos < line_end and is_blank(text[pos]):
+            pos += 1
+        name_start = pos
+        while pos < line_end and not is_blank(text[pos]):
+            pos += 1
+        name_end = pos
+
+        if name_start == name_end:
+            pos = line_end + 1
+            continue
+
+        numb_fields = 0
+        while pos < line_end:
+            while pos < line_end and is_blank(text[pos]):
+                pos += 1
+            if pos == line_end:
+                break
+            if numb_fields < 2:
+                fields[numb_fields] = pos
+            numb_fields += 1
+            while pos < line_end and not is_blank(text[pos]):
+                pos += 1
+
+        if numb_fields == 2:
+            start = parse_unsigned(text + fields[0], &parse_end)
+            if parse_end == text + fields[0] or not is_blank(parse_end[0]):
+                numb_fields = -1
+            end = parse_unsigned(text + fields[1], &parse_end)
+            if parse_end == text + fields[1] or \
+                    not is_field_end(parse_end[0]):
+                numb_fields = -1
+
+            # searches are stored as ints
+            if start > INT_MAX or end > INT_MAX:
+                numb_fields = -1
+
+        if numb_fields != 2:
+            bad_line = chunk[line_start:line_end]
+            break
+
+        # start a new run whenever the chromosome changes
+        if numb_intervals == 0 or \
+                name_end - name_start != prev_name_end - prev_name_start or \
+                memcmp(text + name_start, text + prev_name_start,
+                       name_end - name_start) != 0:
+            chrom_names.append(chunk[name_start:name_end].decode())
+            run_starts.append(numb_intervals)
+            prev_name_start = name_start
+            prev_name_end = name_end
+
+        start_view[numb_intervals] = start
+        end_view[numb_intervals] = end
+        numb_intervals += 1
+
+        pos = line_end + 1
+
+    run_starts.append(numb_intervals)
+
+    return chrom_names, np.array(run_starts, dtype=np.int64), \
+        start_list[:numb_intervals], end_list[:numb_intervals], bad_line
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def find_chrom_runs(bytes chunk):
+    """
+    Finds the bytes of each run of consecutive lines with the same chromosome
+    in a chunk of complete bedGraph lines without parsing the intervals.
+
+    Lines that do not hold at least three fields after the chromosome name
+    are left out of every run.
+
+    Returns
+    -------
+    list
+        Name of the chromosome of each run
+    list
+        Offset of the first byte of each run
+    list
+        Offset one past the last byte of each run
+    """
+    cdef const char* text = chunk
+    cdef size_t length = len(chunk)
+
+    chrom_names = []
+    run_starts = []
+    run_ends = []
+
+    cdef size_t pos = 0, line_start, line_end, name_start, name_end
+    cdef size_t prev_name_start = 0, prev_name_end = 0
+    cdef bint in_run = False
+    cdef int numb_fields
+    cdef const char* line_pointer
+
+    while pos < length:
+        line_start = pos
+        line_pointer = <const char*>memchr(text + pos, c'\n', length - pos)
+        if line_pointer == NULL:
+            line_end = length
+        else:
+            line_end = line_pointer - text
+
+        # chromosome name
+        while pos < line_end and is_blank(text[pos]):
+            pos += 1
+        name_start = pos
+        while pos < line_end and not is_blank(text[pos]):
+            pos += 1
+        name_end = pos
+
+        # only lines that change the chromosome are checked
+        if name_start == name_end or (
+                in_run and
+                name_end - name_start == prev_name_end - prev_name_start and
+                memcmp(text + name_start, text + prev_name_start,
+                       name_end - name_start) == 0):
+            pos = line_end + 1
+            continue
+
+        numb_fields = 0
+        while pos < line_end:
+            while pos < line_end and is_blank(text[pos]):
+                pos += 1
+            if pos == line_end:
+                break
+            numb_fields += 1
+            while pos < line_end and not is_blank(text[pos]):
+                pos += 1
+
+        if in_run:
+            run_ends.append(line_start)
+            in_run = False
+
+        if numb_fields >= 3:
+            chrom_names.append(chunk[name_start:name_end].decode())
+            run_starts.append(line_start)
+            prev_name_start = name_start
+            prev_name_end = name_end
+            in_run = True
+
+        pos = line_end + 1
+
+    if in_run:
+        run_ends.append(length)
+
+    return chrom_names, run_starts, run_ends
+
+# most characters a formatted value can use, like -2.2250738585072014e-308
+cdef enum:
+    MAX_VALUE_LENGTH = 32
+
+# whole numbers with a smaller magnitude are written as integers
+cdef double MAX_EXACT_INTEGER = 1e15
+
+cdef inline size_t write_unsigned(char* text, unsigned long number) nogil:
+    cdef char[20] digits
+    cdef size_t numb_digits = 0, i
+
+    while True:
+        digits[numb_digits] = c'0' + number % 10
+        number //= 10
+        numb_digits += 1
+        if number == 0:
+            break
+
+    for i in range(numb_digits):
+        text[i] = digits[numb_digits - 1 - i]
+
+    return numb_digits
+
+cdef extern from "Python.h":
+    char* PyOS_double_to_string(double value, char format_code, int precision,
+                                int flags, int* value_type) except NULL
+    void PyMem_Free(void* pointer)
+
+cdef inline size_t write_double(char* text, double value):
+    # same digits as repr(value), the fewest that read back as value
+    cdef char* value_text
+    cdef size_t length
+
+    # whole numbers like -1 and 0 are common and much faster to write
+    if -MAX_EXACT_INTEGER < value < MAX_EXACT_INTEGER and \
+            value == <long long>value:
+        if value < 0:
+            text[0] = c'-'
+            return 1 + write_unsigned(text + 1, <unsigned long>-value)
+        return write_unsigned(text, <unsigned long>value)
+
+    value_text = PyOS_double_to_string(value, c'r', 0, 0, NULL)
+    length = strlen(value_text)
+
+    memcpy(text, value_text, length)
+    PyMem_Free(value_text)
+    return length
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def format_bed_rows(list chrom_names, const long long[:] chrom_indexes,
+                    const long long[:] start_list, const long long[:] end_list,
+                    const double[:, :] columns):
+    """
+    Formats intervals and their statistics as tab separated rows of
+    chrom, start, end and one column for each statistic.
+
+    Parameters
+    ----------
+    chrom_names : list
+        Names of the chromosomes of the intervals
+    chrom_indexes : numpy array
+        Index in chrom_names of the chromosome of each interval
+    start_list : numpy array
+        Start of each interval
+    end_list : numpy array
+        End of each interval
+    columns : 2D numpy array
+        One row of statistics for each interval
+
+    Returns
+    -------
+    bytearray
+        Formatted rows, each ending with a new line
+    """
+    assert chrom_indexes.shape[0] == start_list.shape[0] == \
+        end_list.shape[0] == columns.shape[0]
+
+    encoded_names = [chrom_name.encode() for chrom_name in chrom_names]
+    cdef bytes names = b''.join(encoded_names)
+    cdef const char* names_text = names
+    name_starts = np.zeros(len(encoded_names) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in encoded_names], out=name_starts[1:])
+    cdef const long long[:] name_starts_view = name_starts
+
+    cdef Py_ssize_t numb_rows = start_list.shape[0]
+    cdef Py_ssize_t numb_columns = columns.shape[1]
+    cdef Py_ssize_t row, column
+
+    # coordinates are written as unsigned, so the buffer is sized for the
+    # digits of the largest one
+    cdef unsigned long max_coordinate = 0
+    for row in range(numb_rows):
+        if <unsigned long>start_list[row] > max_coordinate:
+            max_coordinate = <unsigned long>start_list[row]
+        if <unsigned long>end_list[row] > max_coordinate:
+            max_coordinate = <unsigned long>end_list[row]
+    cdef char[20] digits
+    cdef size_t max_coordinate_length = write_unsigned(digits, max_coordinate)
+
+    cdef size_t max_name_length = max([len(name) for name in encoded_names],
+                                      default=0)
+    cdef size_t max_row_length = max_name_length + \
+        2 * (max_coordinate_length + 1) + \
+        numb_columns * (MAX_VALUE_LENGTH + 1) + 1
+
+    output = bytearray(numb_rows * max_row_length)
+    cdef char* text = output
+    cdef size_t pos = 0, name_length
+    cdef long long name_start
+
+    for row in range(numb_rows):
+        name_start = name_starts_view[chrom_indexes[row]]
+        name_length = name_starts_view[chrom_indexes[row] + 1] - name_start
+        memcpy(text + pos, names_text + name_start, name_length)
+        pos += name_length
+
+        text[pos] = c'\t'
+        pos += 1
+        pos += write_unsigned(text + pos, start_list[row])
+        text[pos] = c'\t'
+        pos += 1
+        pos += write_unsigned(text + pos, end_list[row])
+
+        for column in range(numb_columns):
+            text[pos] = c'\t'
+            pos += 1
+            pos += write_double(text + pos, columns[row, column])
+
+        text[pos] = c'\n'
+        pos += 1
+
+    del output[pos:]
+    return output
@@ -1,6 +1,12 @@
+import os
+import gzip
+import tempfile
+import tracemalloc
+import zlib
 import numpy as np
 import pyBedGraph
 from pyBedGraph import BedGraph
+from pyBedGraph.BigWig_Reader import BigWig_Reader
 
 print(f'Using {pyBedGraph.__file__}')
 
@@ -21,6 +27,44 @@ bedGraph.load_chrom_bins('chr1', 3)
 bigWig.load_chrom_data('chr1')
 bigWig.load_chrom_bins('chr1', 3)
 
+# bedGraph files are parsed in bulk, check they match the bigWig intervals
+for i in range(2):
+    assert np.array_equal(bedGraph.get_chrom('chr1').intervals[i],
+                          bigWig.get_chrom('chr1').intervals[i])
+assert np.allclose(bedGraph.get_chrom('chr1').value_map,
+                   bigWig.get_chrom('chr1').value_map)
+
+filtered_bedGraph = BedGraph('test_files/myChrom.sizes', 'test_files/random_test.bedGraph', min_value=0.5)
+assert filtered_bedGraph.get_chrom('chr1').num_intervals == 4
+assert list(filtered_bedGraph.get_chrom('chr1').intervals[0]) == [0, 2, 13, 29]
+filtered_bigWig = BedGraph('test_files/myChrom.sizes', 'test_files/random_test.bigWig', min_value=0.5)
+for i in range(2):
+    assert np.array_equal(filtered_bigWig.get_chrom('chr1').intervals[i],
+                          filtered_bedGraph.get_chrom('chr1').intervals[i])
+
+# bigWig files are read without pyBigWig
+with BigWig_Reader('test_files/random_test.bigWig') as bigWig_reader:
+    assert bigWig_reader.chroms() == {'chr1': 30}
+    assert list(bigWig_reader.iter_intervals('chrasdf')) == []
+try:
+    BigWig_Reader('test_files/random_test.bedGraph')
+    assert False
+except RuntimeError:
+    pass
+
+# memory used while loading depends on the number of intervals instead of
+# the size of the chromosome
+with open('test_files/large_chrom.sizes', 'w') as large_chrom_file:
+    large_chrom_file.write('chr1\t250000000\n')
+tracemalloc.start()
+large_chrom_bedGraph = BedGraph('test_files/large_chrom.sizes', 'test_files/random_test.bedGraph')
+load_peak_memory = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+os.remove('test_files/large_chrom.sizes')
+assert load_peak_memory < 20 * 1024 * 1024, load_peak_memory
+assert np.array_equal(large_chrom_bedGraph.get_chrom('chr1').value_map,
+                      bedGraph.get_chrom('chr1').value_map)
+
 inclusive_bedGraph = BedGraph('test_files/myChrom.sizes', 'test_files/random_test.bedGraph', ignore_missing_bp=False)
 inclusive_bedGraph.load_chrom_data('chr1')
 inclusive_bedGraph.load_chrom_bins('chr1', 3)
@@ -99,6 +143,82 @@ result = inclusive_bedGraph.stats('approx_mean', test_intervals)
 for i in range(len(result)):
     assert abs(result[i] - correct[i]) < 0.00001
 
+# every level of the bin pyramid adds up two bins of the level below until
+# one bin covers the chromosome
+for test_bedGraph in [bedGraph, inclusive_bedGraph]:
+    chrom = test_bedGraph.get_chrom('chr1')
+    assert chrom.bins_list[-1].size == 1
+    for level in range(1, chrom.bin_list_numb):
+        smaller_bins = np.zeros(2 * chrom.bins_list[level].size)
+        smaller_bins[:chrom.bins_list[level - 1].size] = chrom.bins_list[level - 1]
+        assert np.allclose(chrom.bins_list[level], smaller_bins.reshape(-1, 2).sum(axis=1))
+
+# approx_mean is within approx_mean_error of the mean, and with a max_error of
+# 0 every search that could be off is found exactly
+for test_bedGraph in [bedGraph, inclusive_bedGraph]:
+    approx = test_bedGraph.stats('approx_mean', test_intervals)
+    errors = test_bedGraph.stats('approx_mean_error', test_intervals)
+    exact = test_bedGraph.stats('mean', test_intervals)
+    assert np.all(np.abs(approx - exact) <= errors + 0.00001)
+
+    test_bedGraph.load_chrom_bins('chr1', 3, max_error=0)
+    assert np.allclose(test_bedGraph.stats('approx_mean', test_intervals), exact)
+    assert np.all(test_bedGraph.stats('approx_mean_error', test_intervals) == 0)
+    test_bedGraph.load_chrom_bins('chr1', 3)
+
+# bins of tracks with negative values keep their signed totals, so the error
+# still bounds approx_mean and max_error is kept relative to the exact mean
+rng = np.random.default_rng(0)
+with tempfile.TemporaryDirectory() as negative_dir:
+    negative_file_name = os.path.join(negative_dir, 'negative.bedGraph')
+    with open(negative_file_name, 'w') as negative_file:
+        for start in range(0, 30, 2):
+            negative_file.write(f'chr1\t{start}\t{start + 1}\t{rng.normal():.3f}\n')
+    starts = rng.integers(0, 29, 200, dtype=np.int32)
+    ends = np.minimum(starts + rng.integers(1, 20, 200, dtype=np.int32), 30).astype(np.int32)
+    for ignore_missing_bp in [True, False]:
+        negative_bedGraph = BedGraph('test_files/myChrom.sizes', negative_file_name,
+                                     ignore_missing_bp=ignore_missing_bp)
+        negative_bedGraph.load_chrom_data('chr1')
+        exact = negative_bedGraph.stats('mean', start_list=starts, end_list=ends, chrom_name='chr1')
+
+        negative_bedGraph.load_chrom_bins('chr1', 2)
+        approx = negative_bedGraph.stats('approx_mean', start_list=starts, end_list=ends,
+                                         chrom_name='chr1')
+        errors = negative_bedGraph.stats('approx_mean_error', start_list=starts, end_list=ends,
+                                         chrom_name='chr1')
+        assert np.all(np.abs(approx - exact) <= errors + 0.00001)
+
+        negative_bedGraph.load_chrom_bins('chr1', 2, max_error=0.01)
+        approx = negative_bedGraph.stats('approx_mean', start_list=starts, end_list=ends,
+                                         chrom_name='chr1')
+        assert np.all(np.abs(approx - exact) <= 0.01 * np.abs(exact) + 0.00001)
+
+chrom = bedGraph.get_chrom('chr1')
+assert chrom.get_error_bin_size(0.000001) == 2
+assert chrom.get_error_bin_size(1000, search_size=1000000) == 16
+
+# approx statistics are read from the zoom level of a bigWig file without
+# loading the chromosome, a search covering whole zoom records is exact
+for ignore_missing_bp in [True, False]:
+    zoom_bigWig = BedGraph('test_files/myChrom.sizes', 'test_files/random_test.bigWig', ignore_missing_bp=ignore_missing_bp)
+    zoom_bigWig.load_chrom_zoom('chr1')
+    assert not zoom_bigWig.get_chrom('chr1').loaded_chrom
+    zoom_values = [zoom_bigWig.stats(stat, [['chr1', 0, 30]])[0]
+                   for stat in ['approx_mean', 'approx_max', 'approx_min', 'approx_std']]
+    # empty searches have no mean or std instead of dividing by 0
+    for stat in ['approx_mean', 'approx_std']:
+        assert zoom_bigWig.stats(stat, [['chr1', 5, 5]])[0] == -1
+    zoom_bigWig.load_chrom_data('chr1')
+    exact_values = [zoom_bigWig.stats(stat, [['chr1', 0, 30]])[0]
+                    for stat in ['mean', 'max', 'min', 'std']]
+    assert np.allclose(zoom_values, exact_values)
+try:
+    bedGraph.load_chrom_zoom('chr1')
+    assert False
+except RuntimeError:
+    pass
+
 correct = [0, 0.33333333, 0.25, 0, 1, 0.3]
 result = inclusive_bedGraph.stats('coverage', test_intervals)
 for i in range(len(result)):
@@ -124,4 +244,395 @@ result = inclusive_bedGraph.stats('sum', test_intervals)
 for i in range(len(result)):
     assert abs(result[i] - correct[i]) < 0.00001
 
+# searching without an index array gives the same results
+for ignore_missing_bp, dense_bedGraph in [(True, bedGraph), (False, inclusive_bedGraph)]:
+    sparse_bedGraph = BedGraph('test_files/myChrom.sizes', 'test_files/random_test.bedGraph',
+                               ignore_missing_bp=ignore_missing_bp, sparse_index=True)
+    sparse_bedGraph.load_chrom_bins('chr1', 3)
+    assert sparse_bedGraph.get_chrom('chr1').index_list is None
+    for stat in ['mean', 'approx_mean', 'max', 'min', 'coverage', 'sum', 'std', 'max_index']:
+        if stat == 'max_index' and ignore_missing_bp:
+            continue
+        assert np.array_equal(sparse_bedGraph.stats(stat, test_intervals),
+                              dense_bedGraph.stats(stat, test_intervals))
+
+# bins are summed from the intervals they overlap, including intervals that
+# span several bins and ones past the end of the chromosome
+interval_start = np.array([1, 4, 20, 33], dtype=np.uint32)
+interval_end = np.array([3, 17, 21, 40], dtype=np.uint32)
+weights = np.array([1, 2, -1, 5], dtype=np.float64)
+per_bp = np.zeros(35)
+for start, end, weight in zip(interval_start, interval_end, weights):
+    per_bp[start:min(end, 35)] += weight
+assert np.allclose(pyBedGraph.util.sum_over_bins(interval_start, interval_end, weights, 35, 4),
+                   np.add.reduceat(per_bp, np.arange(0, 35, 4)))
+
+# coordinates too large to store are rejected instead of wrapping around, and
+# rows are sized for the digits of their coordinates
+assert pyBedGraph.util.parse_interval_chunk(b'chr1\t0\t2147483648\n')[4] is not None
+assert pyBedGraph.util.parse_interval_chunk(b'chr1\t0\t18446744073709551617\n')[4] is not None
+assert pyBedGraph.util.parse_bedgraph_chunk(b'chr1\t0\t4294967296\t1\n')[5] == 1
+rows = pyBedGraph.util.format_bed_rows(['chr1'], np.zeros(2, dtype=np.int64),
+                                       np.array([-1, 2147483646], dtype=np.int64),
+                                       np.array([5, 4294967295], dtype=np.int64),
+                                       np.full((2, 1), -2.2250738585072014e-308))
+assert rows.decode().split('\n')[1] == 'chr1\t2147483646\t4294967295\t-2.2250738585072014e-308'
+
+# values stored as float32 give the same statistics to float32 precision
+for ignore_missing_bp, float64_bedGraph in [(True, bedGraph), (False, inclusive_bedGraph)]:
+    for data_file in ['test_files/random_test.bedGraph', 'test_files/random_test.bigWig']:
+        float32_bedGraph = BedGraph('test_files/myChrom.sizes', data_file,
+                                    ignore_missing_bp=ignore_missing_bp, value_type='float32')
+        float32_bedGraph.load_chrom_data('chr1')
+        float32_bedGraph.load_chrom_bins('chr1', 3)
+        assert float32_bedGraph.get_chrom('chr1').value_map.dtype == np.float32
+        for stat in ['mean', 'approx_mean', 'max', 'min', 'coverage', 'sum', 'std', 'median']:
+            assert np.allclose(float32_bedGraph.stats(stat, test_intervals),
+                               float64_bedGraph.stats(stat, test_intervals), rtol=1e-6)
+
+try:
+    BedGraph('test_files/myChrom.sizes', 'test_files/random_test.bedGraph', value_type='int8')
+    assert False
+except RuntimeError:
+    pass
+
+# prefix sums give the same exact statistics
+for prefix_bedGraph in [bedGraph, inclusive_bedGraph]:
+    walked_results = {}
+    for stat in ['mean', 'coverage', 'sum', 'std', 'variance']:
+        walked_results[stat] = prefix_bedGraph.stats(stat, test_intervals)
+    prefix_bedGraph.load_chrom_prefix_sums('chr1')
+    for stat in walked_results:
+        result = prefix_bedGraph.stats(stat, test_intervals)
+        assert np.allclose(result, walked_results[stat], rtol=0, atol=1e-12)
+    prefix_bedGraph.get_chrom('chr1').free_prefix_sums()
+
+# prefix std of a constant region is 0 like the walked std
+with tempfile.TemporaryDirectory() as constant_dir:
+    constant_file_name = os.path.join(constant_dir, 'constant.bedGraph')
+    with open(constant_file_name, 'w') as constant_file:
+        for start in range(0, 28, 7):
+            constant_file.write(f'chr1\t{start}\t{start + 6}\t0.7\n')
+    for ignore_missing_bp in [True, False]:
+        constant_bedGraph = BedGraph('test_files/myChrom.sizes', constant_file_name,
+                                     ignore_missing_bp=ignore_missing_bp)
+        constant_bedGraph.load_chrom_data('chr1')
+        constant_intervals = [['chr1', 0, 6], ['chr1', 7, 13], ['chr1', 1, 5], ['chr1', 0, 11]]
+        walked_stds = constant_bedGraph.stats('std', constant_intervals)
+        constant_bedGraph.load_chrom_prefix_sums('chr1')
+        prefix_stds = constant_bedGraph.stats('std', constant_intervals)
+        assert np.all(prefix_stds[walked_stds == 0] == 0)
+        assert np.allclose(prefix_stds, walked_stds, rtol=0, atol=1e-12)
+
+# prefix std over many intervals with a large offset matches the walked std
+with tempfile.TemporaryDirectory() as offset_dir:
+    offset_sizes_name = os.path.join(offset_dir, 'offset.sizes')
+    with open(offset_sizes_name, 'w') as offset_sizes:
+        offset_sizes.write('chr1\t3000\n')
+    offset_file_name = os.path.join(offset_dir, 'offset.bedGraph')
+    with open(offset_file_name, 'w') as offset_file:
+        for i in range(200):
+            value = 1e9 + 3 if i >= 150 else 1e9 + (i * 7 % 13) * 0.25
+            offset_file.write(f'chr1\t{i * 10}\t{i * 10 + 8}\t{value}\n')
+    offset_intervals = [['chr1', 0, 2000], ['chr1', 5, 1503], ['chr1', 33, 1234],
+                        ['chr1', 1500, 1998], ['chr1', 1703, 1905], ['chr1', 0, 3000]]
+    for ignore_missing_bp in [True, False]:
+        offset_bedGraph = BedGraph(offset_sizes_name, offset_file_name,
+                                   ignore_missing_bp=ignore_missing_bp)
+        offset_bedGraph.load_chrom_data('chr1')
+        walked_stds = offset_bedGraph.stats('std', offset_intervals)
+        walked_variances = offset_bedGraph.stats('variance', offset_intervals)
+        offset_bedGraph.load_chrom_prefix_sums('chr1')
+        prefix_stds = offset_bedGraph.stats('std', offset_intervals)
+        prefix_variances = offset_bedGraph.stats('variance', offset_intervals)
+        assert np.allclose(prefix_stds, walked_stds, rtol=1e-9, atol=1e-12)
+        assert np.allclose(prefix_variances, walked_variances, rtol=1e-9, atol=1e-12)
+        if ignore_missing_bp:
+            assert np.all(prefix_stds[3:5] == 0)
+
+# include mode prefix std with missing base pairs far from the values
+with tempfile.TemporaryDirectory() as jump_dir:
+    jump_sizes_name = os.path.join(jump_dir, 'jump.sizes')
+    with open(jump_sizes_name, 'w') as jump_sizes:
+        jump_sizes.write('chr1\t5000\n')
+    jump_file_name = os.path.join(jump_dir, 'jump.bedGraph')
+    with open(jump_file_name, 'w') as jump_file:
+        for i in range(300):
+            value = 0 if i % 50 < 10 else 1e9 + i % 3
+            jump_file.write(f'chr1\t{i * 15 + i % 4}\t{i * 15 + 12}\t{value}\n')
+    jump_intervals = [['chr1', 0, 5000], ['chr1', 7, 4321], ['chr1', 160, 740],
+                      ['chr1', 900, 1401], ['chr1', 1111, 1112]]
+    jump_bedGraph = BedGraph(jump_sizes_name, jump_file_name, ignore_missing_bp=False)
+    jump_bedGraph.load_chrom_data('chr1')
+    walked_stds = jump_bedGraph.stats('std', jump_intervals)
+    jump_bedGraph.load_chrom_prefix_sums('chr1')
+    assert np.allclose(jump_bedGraph.stats('std', jump_intervals), walked_stds,
+                       rtol=1e-12, atol=1e-12)
+
+# range index gives the same max, min and max_index
+for range_bedGraph in [bedGraph, inclusive_bedGraph]:
+    scanned_results = {}
+    for stat in ['max', 'min', 'max_index']:
+        scanned_results[stat] = range_bedGraph.stats(stat, test_intervals)
+    range_bedGraph.load_chrom_range_index('chr1')
+    assert 'range_index' in range_bedGraph.get_memory_usage()['chr1']
+    for stat in scanned_results:
+        assert np.array_equal(range_bedGraph.stats(stat, test_intervals), scanned_results[stat])
+    range_bedGraph.get_chrom('chr1').free_range_index()
+
+# splitting searches between threads gives the same results
+rng = np.random.default_rng(0)
+thread_starts = rng.integers(0, 29, 50000, dtype=np.int32)
+thread_ends = thread_starts + rng.integers(1, 30 - thread_starts, dtype=np.int32)
+for thread_bedGraph in [bedGraph, inclusive_bedGraph]:
+    for stat in ['mean', 'max', 'min', 'coverage', 'std']:
+        serial_result = thread_bedGraph.stats(stat, start_list=thread_starts,
+                                              end_list=thread_ends, chrom_name='chr1')
+        thread_result = thread_bedGraph.stats(stat, start_list=thread_starts, end_list=thread_ends,
+                                              chrom_name='chr1', n_threads=4)
+        assert np.array_equal(serial_result, thread_result)
+
+# intervals on several chromosomes are grouped and returned in input order
+with open('test_files/random_test.bedGraph') as in_file:
+    chr1_lines = in_file.read()
+with open('test_files/two_chroms.bedGraph', 'w') as out_file:
+    out_file.write(chr1_lines + chr1_lines.replace('chr1', 'chr2'))
+with open('test_files/two_chroms.sizes', 'w') as out_file:
+    out_file.write('chr1\t30\nchr2\t30\n')
+two_chrom_bedGraph = BedGraph('test_files/two_chroms.sizes', 'test_files/two_chroms.bedGraph')
+os.remove('test_files/two_chroms.bedGraph')
+os.remove('test_files/two_chroms.sizes')
+two_chrom_bedGraph.load_chrom_data('chr1')
+two_chrom_bedGraph.load_chrom_data('chr2')
+
+mixed_intervals = [[['chr2', 'chr1'][i % 2], start, end]
+                   for i, (_, start, end) in enumerate(test_intervals)]
+correct = bedGraph.stats('mean', test_intervals)
+assert np.array_equal(two_chrom_bedGraph.stats('mean', mixed_intervals), correct)
+mixed_array = np.array([tuple(interval) for interval in mixed_intervals],
+                       dtype=[('chrom', 'U4'), ('start', np.int32), ('end', np.int32)])
+assert np.array_equal(two_chrom_bedGraph.multi_chrom_stats('mean', mixed_array), correct)
+assert np.array_equal(two_chrom_bedGraph.multi_chrom_stats(
+    'max', chrom_list=mixed_array['chrom'], start_list=mixed_array['start'],
+    end_list=mixed_array['end']), bedGraph.stats('max', test_intervals))
+
+# several statistics found at once match finding them one at a time
+multi_stats = ['mean', 'max', 'min', 'coverage', 'sum', 'std', 'variance', 'approx_mean']
+for test_bedGraph in [bedGraph, inclusive_bedGraph]:
+    result = test_bedGraph.stats_multi(multi_stats, test_intervals)
+    for stat in multi_stats:
+        assert np.allclose(result[stat], test_bedGraph.stats(stat, test_intervals))
+
+# variance is found in the same single pass as std
+for test_bedGraph in [bedGraph, inclusive_bedGraph]:
+    stds = test_bedGraph.stats('std', test_intervals)
+    variances = test_bedGraph.stats('variance', test_intervals)
+    covered = stds > 0
+    assert np.allclose(variances[covered], stds[covered] ** 2)
+    assert np.array_equal(variances[~covered], stds[~covered])
+
+# median and quantiles weigh each value by its number of base pairs, with or
+# without the quantile index
+correct = {
+    'median': [-1, 0.9, 0.1, -1, 0.9, 0.9],
+    'quantile_0.9': [-1, 0.9, 0.1, -1, 0.9, 1],
+    'quantile_0': [-1, 0.9, 0.1, -1, 0.7, 0.1]
+}
+inclusive_correct = {
+    'median': [0, 0, 0, 0, 0.9, 0],
+    'quantile_0.9': [0, 0.9, 0.1, 0, 0.9, 0.9],
+    'quantile_0': [0, 0, 0, 0, 0.7, 0]
+}
+for test_bedGraph, test_correct in [(bedGraph, correct), (inclusive_bedGraph, inclusive_correct)]:
+    for stat in test_correct:
+        assert np.array_equal(test_bedGraph.stats(stat, test_intervals), test_correct[stat])
+    test_bedGraph.load_chrom_quantile_index('chr1')
+    for stat in test_correct:
+        assert np.array_equal(test_bedGraph.stats(stat, test_intervals), test_correct[stat])
+    test_bedGraph.chromosome_map['chr1'].free_quantile_index()
+assert bedGraph.stats('quantile_2', test_intervals) is None
+result = two_chrom_bedGraph.stats_multi(['mean', 'max'], mixed_intervals)
+assert np.array_equal(result['mean'], bedGraph.stats('mean', test_intervals))
+assert np.array_equal(result['max'], bedGraph.stats('max', test_intervals))
+
+# a saved cache is memory-mapped by later objects and gives the same results
+with tempfile.TemporaryDirectory() as cache_dir:
+    bedGraph.save_cache(cache_dir, save_index_list=True, save_bins=True)
+    cached_bedGraph = BedGraph('test_files/myChrom.sizes', 'test_files/random_test.bedGraph',
+                               cache_dir=cache_dir)
+    cached_chrom = cached_bedGraph.get_chrom('chr1')
+    assert isinstance(cached_chrom.value_map, np.memmap)
+    assert cached_chrom.loaded_chrom and cached_chrom.loaded_bins
+    for stat in ['mean', 'approx_mean', 'max', 'min', 'coverage', 'sum', 'std']:
+        assert np.array_equal(cached_bedGraph.stats(stat, test_intervals),
+                              bedGraph.stats(stat, test_intervals))
+
+    # removing intervals changes the mapped arrays but not the saved files
+    cached_chrom.remove_intervals([0])
+    assert cached_chrom.value_map[0] == 0
+    reloaded_bedGraph = BedGraph('test_files/myChrom.sizes', 'test_files/random_test.bedGraph',
+                                 cache_dir=cache_dir)
+    assert np.array_equal(reloaded_bedGraph.get_chrom('chr1').value_map,
+                          bedGraph.get_chrom('chr1').value_map)
+    del cached_bedGraph, cached_chrom, reloaded_bedGraph
+
+# indexes loaded before removing intervals give the same results as walking
+with tempfile.TemporaryDirectory() as removed_dir:
+    removed_sizes_name = os.path.join(removed_dir, 'removed.sizes')
+    with open(removed_sizes_name, 'w') as removed_sizes:
+        removed_sizes.write('chr1\t2000\n')
+    removed_file_name = os.path.join(removed_dir, 'removed.bedGraph')
+    with open(removed_file_name, 'w') as removed_file:
+        for i in range(200):
+            removed_file.write(f'chr1\t{i * 10}\t{i * 10 + 7}\t{rng.integers(1, 100)}\n')
+    removed_starts = rng.integers(0, 1999, 200, dtype=np.int32)
+    removed_ends = np.minimum(removed_starts + rng.integers(1, 1000, 200, dtype=np.int32),
+                              2000).astype(np.int32)
+    for ignore_missing_bp in [True, False]:
+        removed_bedGraph = BedGraph(removed_sizes_name, removed_file_name,
+                                    ignore_missing_bp=ignore_missing_bp)
+        removed_bedGraph.load_chrom_data('chr1')
+        walked_bedGraph = BedGraph(removed_sizes_name, removed_file_name,
+                                   ignore_missing_bp=ignore_missing_bp)
+        walked_bedGraph.load_chrom_data('chr1')
+        removed_bedGraph.load_chrom_prefix_sums('chr1')
+        removed_bedGraph.load_chrom_range_index('chr1')
+        removed_bedGraph.load_chrom_quantile_index('chr1')
+        removed_intervals = np.argsort(walked_bedGraph.get_chrom('chr1').value_map)[-20:]
+        for test_bedGraph in [removed_bedGraph, walked_bedGraph]:
+            test_bedGraph.get_chrom('chr1').remove_intervals(removed_intervals)
+        for stat in ['mean', 'coverage', 'sum', 'std', 'max', 'min', 'max_index',
+                     'median', 'quantile_0.9']:
+            assert np.allclose(removed_bedGraph.stats(stat, start_list=removed_starts,
+                                                      end_list=removed_ends, chrom_name='chr1'),
+                               walked_bedGraph.stats(stat, start_list=removed_starts,
+                                                     end_list=removed_ends, chrom_name='chr1'),
+                               rtol=0, atol=1e-9)
+
+# lazy objects read in and index a chromosome the first time it is searched
+for lazy_file in ['test_files/random_test.bedGraph', 'test_files/random_test.bigWig']:
+    lazy_bedGraph = BedGraph('test_files/myChrom.sizes', lazy_file, lazy=True)
+    assert not lazy_bedGraph.chromosome_map and lazy_bedGraph.has_chrom('chr1')
+    for stat in ['mean', 'max', 'min', 'coverage', 'sum', 'std']:
+        assert np.allclose(lazy_bedGraph.stats(stat, test_intervals),
+                           bedGraph.stats(stat, test_intervals))
+    assert lazy_bedGraph.get_chrom('chr1').loaded_chrom
+
+# indexes over the memory budget are freed and loaded again when searched
+budget_bedGraph = BedGraph('test_files/myChrom.sizes', 'test_files/random_test.bedGraph',
+                           memory_budget=150)
+budget_bedGraph.load_chrom_data('chr1')
+budget_bedGraph.load_chrom_range_index('chr1')
+budget_bedGraph.load_chrom_bins('chr1', 3)
+assert budget_bedGraph.get_memory_manager_stats()['evictions'] > 0
+for stat in ['mean', 'approx_mean', 'max', 'min', 'coverage', 'sum', 'std']:
+    assert np.array_equal(budget_bedGraph.stats(stat, test_intervals),
+                          bedGraph.stats(stat, test_intervals))
+manager_stats = budget_bedGraph.get_memory_manager_stats()
+assert manager_stats['hits'] > 0 and manager_stats['misses'] > 0
+
+# results written to a file keep the intervals and have a column for each stat
+with tempfile.TemporaryDirectory() as out_dir:
+    bed_file_name = os.path.join(out_dir, 'out.bed')
+    result = bedGraph.stats_from_file('test_files/test_intervals.txt', stat=['mean', 'max'],
+                                      output_file_name=bed_file_name)
+    with open(bed_file_name) as bed_file:
+        rows = [line.split() for line in bed_file]
+    assert [row[:3] for row in rows] == [[str(value) for value in interval] for interval in test_intervals]
+    assert np.array_equal([float(row[3]) for row in rows], result['chr1']['mean'])
+    assert np.array_equal([float(row[4]) for row in rows], result['chr1']['max'])
+
+    npy_file_name = os.path.join(out_dir, 'out.npy')
+    bedGraph.stats_from_file('test_files/test_intervals.txt', stat=['mean', 'max'],
+                             output_file_name=npy_file_name, output_format='npy')
+    assert np.array_equal(np.load(npy_file_name),
+                          np.column_stack((result['chr1']['mean'], result['chr1']['max'])))
+
+    # streaming in tiny chunks gives the same rows as reading the whole file
+    stream_file_name = os.path.join(out_dir, 'stream.bed')
+    assert bedGraph.stats_from_file('test_files/test_intervals.txt', stat=['mean', 'max'],
+                                    output_file_name=stream_file_name, chunk_size=16,
+                                    keep_results=False) is None
+    with open(bed_file_name) as bed_file, open(stream_file_name) as stream_file:
+        assert bed_file.read() == stream_file.read()
+    chunks = list(bedGraph.iter_stats_from_file('test_files/test_intervals.txt', chunk_size=16))
+    assert len(chunks) > 1
+    assert np.array_equal(np.concatenate([chunk[3][0] for chunk in chunks]), result['chr1']['mean'])
+
+    # an unknown chromosome after searchable chunks fails the whole file
+    unknown_file_name = os.path.join(out_dir, 'unknown_intervals.txt')
+    with open('test_files/test_intervals.txt') as interval_file, \
+            open(unknown_file_name, 'w') as unknown_file:
+        unknown_file.write(interval_file.read() + 'chrasdf\t0\t10\n')
+    assert bedGraph.stats_from_file(unknown_file_name, output_to_file=False,
+                                    chunk_size=16) is None
+    unknown_out_name = os.path.join(out_dir, 'unknown_out.bed')
+    assert bedGraph.stats_from_file(unknown_file_name, output_file_name=unknown_out_name,
+                                    chunk_size=16) is None
+    assert not os.path.exists(unknown_out_name)
+    try:
+        list(bedGraph.iter_stats_from_file(unknown_file_name, chunk_size=16))
+        assert False
+    except pyBedGraph.SearchError:
+        pass
+
+    # filtered tracks written as bedGraph and bigWig read back the same
+    for out_name in ['filtered.bedGraph', 'filtered.bigWig']:
+        out_file_name = os.path.join(out_dir, out_name)
+        if out_name.endswith('bigWig'):
+            filtered_bedGraph.write_bigwig(out_file_name)
+        else:
+            filtered_bedGraph.write_bedgraph(out_file_name)
+
+        written_bedGraph = BedGraph('test_files/myChrom.sizes', out_file_name)
+        for i in range(2):
+            assert np.array_equal(written_bedGraph.get_chrom('chr1').intervals[i],
+                                  filtered_bedGraph.get_chrom('chr1').intervals[i])
+        assert np.allclose(written_bedGraph.get_chrom('chr1').value_map,
+                           filtered_bedGraph.get_chrom('chr1').value_map)
+
+    # coordinates past the largest int are written without wrapping around
+    with open(os.path.join(out_dir, 'large.sizes'), 'w') as large_sizes:
+        large_sizes.write('chr1\t4000000000\n')
+    with open(os.path.join(out_dir, 'large.bedGraph'), 'w') as large_file:
+        large_file.write('chr1\t5\t10\t1\nchr1\t3000000000\t3000000010\t2\n')
+    large_bedGraph = BedGraph(os.path.join(out_dir, 'large.sizes'),
+                              os.path.join(out_dir, 'large.bedGraph'))
+    large_bedGraph.write_bedgraph(os.path.join(out_dir, 'large_out.bedGraph'))
+    with open(os.path.join(out_dir, 'large_out.bedGraph')) as large_file:
+        assert large_file.read() == 'chr1\t5\t10\t1\nchr1\t3000000000\t3000000010\t2\n'
+
+    written_bedGraph.load_chrom_zoom('chr1')
+    written_bedGraph.load_chrom_data('chr1')
+    assert np.allclose(written_bedGraph.stats('approx_mean', [['chr1', 0, 30]]),
+                       written_bedGraph.stats('mean', [['chr1', 0, 30]]))
+
+    # gzip and bgzip compressed bedGraph files read the same, small bgzip
+    # blocks make the lazy read seek into the middle of the file
+    with open('test_files/random_test.bedGraph', 'rb') as in_file:
+        data = in_file.read()
+    gzip_file_name = os.path.join(out_dir, 'random_test.bedGraph.gz')
+    with gzip.open(gzip_file_name, 'wb') as gzip_file:
+        gzip_file.write(data)
+    bgzip_file_name = os.path.join(out_dir, 'random_test.bedGraph.bgz')
+    with open(bgzip_file_name, 'wb') as bgzip_file:
+        for i in range(0, len(data), 16):
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            block = compressor.compress(data[i:i + 16]) + compressor.flush()
+            bgzip_file.write(b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' +
+                             (len(block) + 25).to_bytes(2, 'little') + block +
+                             zlib.crc32(data[i:i + 16]).to_bytes(4, 'little') +
+                             len(data[i:i + 16]).to_bytes(4, 'little'))
+
+    for compressed_file_name in [gzip_file_name, bgzip_file_name]:
+        for lazy in [False, True]:
+            compressed_bedGraph = BedGraph('test_files/myChrom.sizes', compressed_file_name,
+                                           lazy=lazy)
+            compressed_bedGraph.load_chrom_data('chr1')
+            for i in range(2):
+                assert np.array_equal(compressed_bedGraph.get_chrom('chr1').intervals[i],
+                                      bedGraph.get_chrom('chr1').intervals[i])
+            assert np.array_equal(compressed_bedGraph.get_chrom('chr1').value_map,
+                                  bedGraph.get_chrom('chr1').value_map)
+
 print("Passed all simple tests!")